@@ -0,0 +1,617 @@
+# bench.py — Arcane Arena Verify Bot yük testi (ağ erişimi gerekmez)
+# main.py'deki gerçek handler'ları sahte Discord nesneleri ve sahte worksheet ile sürer:
+#   python bench.py                      → tüm senaryolar
+#   python bench.py panel --n 5000       → tek senaryo
+#   python bench.py --latency 0.08 --p429 0.02 --sheet-latency 0.6
+# Senaryolar: join (welcome DM raid), panel (Verify → Modal → Confirm fırtınası),
+#             auto (AUTO_REGISTER mesaj fırtınası), mirror (shop bot burst),
+#             files (MIRROR_ATTACHMENTS=copy; yerel HTTP sunucusu CDN yerine),
+#             shutdown (panel fırtınası ortasında SIGTERM; her zaman en son çalışır)
+
+import os
+import sys
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import statistics
+import tracemalloc
+
+# ─────────────────────────────────────────────────────────────────────────────
+# CLI + ENV (main import edilmeden önce)
+parser = argparse.ArgumentParser(description="Offline load test for main.py handlers.")
+parser.add_argument("scenario", nargs="*", help="join | panel | auto | mirror | files | shutdown (default: all)")
+parser.add_argument("--n", type=int, default=0, help="events per scenario (default: per-scenario)")
+parser.add_argument("--concurrency", type=int, default=200, help="concurrent users in panel/auto")
+parser.add_argument("--latency", type=float, default=0.05, help="mean Discord API latency (s)")
+parser.add_argument("--jitter", type=float, default=0.5, help="latency jitter (fraction of mean)")
+parser.add_argument("--p429", type=float, default=0.0, help="probability of a 429 on each API call")
+parser.add_argument("--retry-after", type=float, default=0.5, help="sleep per injected 429 (s)")
+parser.add_argument("--sheet-latency", type=float, default=0.4, help="append_rows latency (s)")
+parser.add_argument("--role-rate", type=float, default=200.0, help="ROLE_GRANT_RATE (role changes/s)")
+parser.add_argument("--dm-rate", type=float, default=200.0, help="WELCOME_RATE for the join raid")
+parser.add_argument("--timeout", type=float, default=120.0, help="max seconds to wait for queues to drain")
+parser.add_argument("--clicks", type=int, default=1, help="concurrent Confirm clicks per user in panel")
+parser.add_argument("--replicas", default="sheets", help="STORAGE_REPLICAS (e.g. sheets,jsonl)")
+parser.add_argument("--shutdown-after", type=float, default=0.5, help="seconds into the storm to send SIGTERM")
+parser.add_argument("--files", type=int, default=4, help="attachments per shop post in the files scenario")
+parser.add_argument("--file-kb", type=int, default=1024, help="mean attachment size (KB) in the files scenario")
+parser.add_argument("--seed", type=int, default=1)
+args = parser.parse_args()
+args.scenario = args.scenario or ["join", "panel", "auto", "mirror", "files", "shutdown"]
+for _name in args.scenario:
+    if _name not in ("join", "panel", "auto", "mirror", "files", "shutdown"):
+        parser.error(f"unknown scenario: {_name}")
+if "shutdown" in args.scenario:   # kapanış geri alınamaz: en sona
+    args.scenario = [s for s in args.scenario if s != "shutdown"] + ["shutdown"]
+random.seed(args.seed)
+
+TMP = tempfile.mkdtemp(prefix="verifybench-")
+GUILD_ID, VERIFIED, LOG_CH, REGISTER_CH, MIRROR_CH, CM_ROLE, SHOP_BOT = 1, 900, 901, 902, 903, 904, 905
+os.environ.update({
+    "DISCORD_TOKEN": "",
+    "GUILD_ID": str(GUILD_ID),
+    "VERIFIED_ROLE_ID": str(VERIFIED),
+    "LOG_CHANNEL_ID": str(LOG_CH),
+    "REGISTER_CHANNEL_ID": str(REGISTER_CH),
+    "MIRROR_TARGET_CHANNEL_ID": str(MIRROR_CH),
+    "COMMUNITY_MANAGER_ROLE_ID": str(CM_ROLE),
+    "MIRROR_BOT_USER_IDS": str(SHOP_BOT),
+    "AUTO_REGISTER": "true",
+    "JOURNAL_PATH": os.path.join(TMP, "registrations.db"),
+    "MIRROR_DEDUPE_PATH": os.path.join(TMP, "mirrored_ids.bin"),
+    "SHEET_ID": "",
+    "STORAGE_REPLICAS": args.replicas,
+    "STORAGE_JSONL_PATH": os.path.join(TMP, "registrations.jsonl"),
+    "METRICS_PORT": "0",
+    "ROLE_GRANT_RATE": str(args.role_rate),
+    "ROLE_GRANT_BURST": str(max(1.0, args.role_rate / 4)),
+    "WELCOME_RATE": str(args.dm_rate),
+    "WELCOME_BURST": str(max(1.0, args.dm_rate / 4)),
+    "WELCOME_QUEUE_MAX": "1000000",
+    "MIRROR_FLUSH_DELAY": "0.2",
+    "LOG_FLUSH_INTERVAL": "1.0",
+    "SHEETS_FLUSH_INTERVAL": "0.5",
+})
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import discord  # noqa: E402
+import main     # noqa: E402
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Fakes
+class FakeAPI:
+    """Her Discord çağrısı için gecikme + 429 enjeksiyonu. discord.py 429'u kendi içinde
+    uyuyup tekrar denediği için burada da 429 = ekstra retry_after beklemesi."""
+
+    def __init__(self, latency: float, jitter: float, p429: float, retry_after: float):
+        self.latency, self.jitter, self.p429, self.retry_after = latency, jitter, p429, retry_after
+        self.calls: dict[str, int] = {}
+        self.ratelimited = 0
+
+    async def call(self, route: str):
+        self.calls[route] = self.calls.get(route, 0) + 1
+        while self.p429 and random.random() < self.p429:
+            self.ratelimited += 1
+            await asyncio.sleep(self.retry_after)
+        lo = self.latency * (1 - self.jitter)
+        await asyncio.sleep(random.uniform(max(0.0, lo), self.latency * (1 + self.jitter)))
+
+    def reset(self):
+        self.calls.clear()
+        self.ratelimited = 0
+
+api = FakeAPI(args.latency, args.jitter, args.p429, args.retry_after)
+
+class FakeWorksheet:
+    """gspread Worksheet yerine: thread'de çalışan bloklayan çağrılar (time.sleep)."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.rows: list[list[str]] = []
+        self.append_calls = 0
+
+    def append_rows(self, rows, value_input_option=None):
+        time.sleep(self.latency)
+        self.append_calls += 1
+        self.rows.extend(rows)
+
+    def get_all_values(self):
+        time.sleep(self.latency)
+        return [list(r) for r in self.rows]
+
+    def get(self, rng):
+        time.sleep(self.latency)
+        start = int(rng[1:rng.index(":")])
+        return [list(r) for r in self.rows[start - 1:]]
+
+    def col_values(self, col):
+        time.sleep(self.latency)
+        return [r[col - 1] if len(r) >= col else "" for r in self.rows]
+
+class FakePerms:
+    administrator = False
+    manage_roles = False
+
+class FakeRole:
+    def __init__(self, role_id: int):
+        self.id = role_id
+        self.members: list = []
+
+class FakeMessage:
+    _next = discord.utils.time_snowflake(discord.utils.utcnow())
+
+    def __init__(self, channel=None, author=None, content: str = "", guild=None):
+        FakeMessage._next += 1
+        self.id = FakeMessage._next
+        self.channel, self.author, self.content, self.guild = channel, author, content, guild
+        self.role_mentions: list = []
+        self.attachments: list = []
+        self.embeds: list = []
+        self.jump_url = f"https://discord.com/channels/{GUILD_ID}/{getattr(channel, 'id', 0)}/{self.id}"
+
+    async def delete(self):
+        await api.call("message.delete")
+
+class FakeAttachment:
+    def __init__(self, url: str, filename: str, size: int, content_type: str):
+        self.url, self.filename, self.size, self.content_type = url, filename, size, content_type
+
+    def is_spoiler(self) -> bool:
+        return False
+
+class FakeCDN:
+    """Discord CDN yerine yerel HTTP sunucusu: /<boyut>/<ad> isteğine o kadar byte'ı parça parça akıtır."""
+
+    CHUNK = b"\0" * (64 * 1024)
+
+    def __init__(self):
+        self.served = 0
+        self._runner = None
+        self.base = ""
+
+    async def _handle(self, request):
+        from aiohttp import web
+        size = int(request.match_info["size"])
+        resp = web.StreamResponse(headers={"Content-Length": str(size)})
+        await resp.prepare(request)
+        left = size
+        while left > 0:
+            n = min(left, len(self.CHUNK))
+            await resp.write(self.CHUNK[:n])
+            left -= n
+        self.served += size
+        return resp
+
+    async def __aenter__(self):
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_get("/{size}/{name}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base = f"http://127.0.0.1:{port}"
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._runner.cleanup()
+
+class FakeChannel:
+    def __init__(self, channel_id: int, name: str, guild=None):
+        self.id, self.name, self.guild = channel_id, name, guild
+        self.mention = f"<#{channel_id}>"
+        self.sent = 0
+        self.files = 0
+        self.file_bytes = 0
+
+    async def send(self, content=None, **kw):
+        await api.call(f"channel.send:{self.name}")
+        for f in kw.get("files") or ():
+            # discord.py gibi dosyayı parça parça oku (multipart upload)
+            while chunk := f.fp.read(64 * 1024):
+                self.file_bytes += len(chunk)
+            self.files += 1
+        self.sent += 1
+        return FakeMessage(self, None, content or "", self.guild)
+
+class FakeUser:
+    def __init__(self, user_id: int, guild, bot: bool = False):
+        self.id = user_id
+        self.guild = guild
+        self.bot = bot
+        self.name = f"user{user_id}"
+        self.global_name = None
+        self.display_name = self.name
+        self.display_avatar = None
+        self.mention = f"<@{user_id}>"
+        self.roles: list = []
+        self.guild_permissions = FakePerms()
+
+    def get_role(self, role_id: int):
+        return next((r for r in self.roles if r.id == role_id), None)
+
+    async def send(self, *a, **kw):
+        await api.call("dm")
+
+    async def add_roles(self, *roles, reason=None):
+        await api.call("member.add_roles")
+        for r in roles:
+            if r not in self.roles:
+                self.roles.append(r)
+
+    async def remove_roles(self, *roles, reason=None):
+        await api.call("member.remove_roles")
+        self.roles = [r for r in self.roles if r not in roles]
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.name = "Bench Guild"
+        self.unavailable = False
+        self.roles = {VERIFIED: FakeRole(VERIFIED), CM_ROLE: FakeRole(CM_ROLE)}
+        self.channels = {
+            cid: FakeChannel(cid, name, self)
+            for cid, name in ((LOG_CH, "player-id-log"), (REGISTER_CH, "welcome"),
+                              (MIRROR_CH, "shop-mirror"), (999, "shop"))
+        }
+        self.members: dict[int, FakeUser] = {}
+        self.me = FakeUser(1, self, bot=True)
+
+    def add_member(self, user_id: int) -> FakeUser:
+        m = self.members[user_id] = FakeUser(user_id, self)
+        return m
+
+    def get_member(self, user_id: int):
+        return self.members.get(user_id)
+
+    async def fetch_member(self, user_id: int):
+        await api.call("guild.fetch_member")
+        return self.members[user_id]
+
+    def get_role(self, role_id: int):
+        return self.roles.get(role_id)
+
+    def get_channel(self, channel_id: int):
+        return self.channels.get(channel_id)
+
+class FakeResponse:
+    def __init__(self, inter):
+        self._inter = inter
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def defer(self, **kw):
+        await api.call("interaction.callback")
+        self._done = True
+
+    async def send_message(self, content=None, **kw):
+        await api.call("interaction.callback")
+        self._done = True
+        self._inter.sent.append((content, kw))
+
+    async def send_modal(self, modal):
+        await api.call("interaction.callback")
+        self._done = True
+        self._inter.modal = modal
+
+class FakeInteraction:
+    type = discord.InteractionType.component
+
+    def __init__(self, user: FakeUser, guild: FakeGuild, channel: FakeChannel):
+        self.user, self.guild, self.channel = user, guild, channel
+        self.response = FakeResponse(self)
+        self.sent: list = []
+        self.edits: list = []
+        self.modal = None
+
+    async def edit_original_response(self, **kw):
+        await api.call("interaction.edit")
+        self.edits.append(kw)
+
+    async def original_response(self):
+        await api.call("interaction.original")
+        return FakeMessage(self.channel, self.user, "", self.guild)
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Ölçüm
+class LagMonitor:
+    """Event loop gecikmesi: `interval` uykusunun ne kadar geç uyandığı."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: list[float] = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            t0 = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - t0 - self.interval))
+
+    def __enter__(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+
+def pct(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+def ms(v: float) -> str:
+    return f"{v * 1000:8.1f} ms"
+
+def report(name: str, n: int, elapsed: float, latencies: list[float], lag: LagMonitor, extra: dict):
+    print(f"\n== {name}: {n} events in {elapsed:.2f}s ==")
+    print(f"throughput        {n / elapsed if elapsed else 0:10.1f} /s")
+    if latencies:
+        print(f"latency p50/p95/p99 {ms(pct(latencies, 50))} {ms(pct(latencies, 95))} {ms(pct(latencies, 99))}"
+              f"  (mean {ms(statistics.fmean(latencies))})")
+    print(f"loop lag p50/p99/max {ms(pct(lag.samples, 50))} {ms(pct(lag.samples, 99))} "
+          f"{ms(max(lag.samples, default=0.0))}")
+    print(f"api calls         {sum(api.calls.values())} (429s injected: {api.ratelimited})")
+    for route, count in sorted(api.calls.items()):
+        print(f"  {route:<28} {count}")
+    for k, v in extra.items():
+        print(f"{k:<18}{v}")
+
+async def drain(predicate, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+def player_id(uid: int) -> str:
+    return f"{uid % 10 ** main.ID_LENGTH:0{main.ID_LENGTH}d}"
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Senaryolar
+async def scenario_join(guild: FakeGuild, n: int):
+    """n üyelik raid: on_member_join handler süresi + DM kuyruğunun boşalma süresi."""
+    sched = main.welcome_scheduler
+    handler, base_sent = [], sched.sent
+    with LagMonitor() as lag:
+        t0 = time.perf_counter()
+        for i in range(n):
+            m = guild.add_member(10_000_000 + i)
+            h0 = time.perf_counter()
+            await main.on_member_join(m)
+            handler.append(time.perf_counter() - h0)
+            if i % 100 == 0:
+                await asyncio.sleep(0)
+        drained = await drain(lambda: sched.depth == 0, args.timeout)
+        elapsed = time.perf_counter() - t0
+    report("join raid (on_member_join)", n, elapsed, handler, lag, {
+        "dms sent": sched.sent - base_sent,
+        "dm rate now": f"{sched.bucket.rate:.1f}/s",
+        "drained": drained,
+    })
+
+async def scenario_panel(guild: FakeGuild, n: int):
+    """Verify butonu → Modal → Confirm; kullanıcı başına uçtan uca süre."""
+    panel = main.VerifyPanelView()
+    channel = guild.get_channel(REGISTER_CH)
+    sem = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def one(uid: int):
+        async with sem:
+            m = guild.add_member(uid)
+            t0 = time.perf_counter()
+            i1 = FakeInteraction(m, guild, channel)
+            await panel.verify_button.callback(i1)
+            modal = i1.modal
+            modal.player_id_input._value = player_id(uid)
+            i2 = FakeInteraction(m, guild, channel)
+            await modal.on_submit(i2)
+            view = i2.sent[-1][1].get("view")
+            if view is None:
+                return
+            # --clicks > 1: çift tıklama / istemci tekrarları; gate tek doğrulamaya indirmeli
+            await asyncio.gather(*(
+                view.confirm.callback(FakeInteraction(m, guild, channel)) for _ in range(args.clicks)
+            ))
+            latencies.append(time.perf_counter() - t0)
+
+    with LagMonitor() as lag:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(20_000_000 + i) for i in range(n)))
+        elapsed = time.perf_counter() - t0
+        await drain(lambda: not main._background, args.timeout)   # rol sonrası DM'ler
+        drained = await drain(lambda: main.storage.depth == 0, args.timeout)
+    report("panel verify storm", n, elapsed, latencies, lag, {
+        "verified": len(latencies),
+        "role grants": f"{main.role_grants.granted} granted, {main.role_grants.failed} failed, "
+                       f"{main.role_grants.retried} retried (pending: {main.role_grants.depth})",
+        "sheet appends": f"{main.ws.append_calls} calls / {len(main.ws.rows)} rows (drained: {drained})",
+    })
+
+async def scenario_auto(guild: FakeGuild, n: int):
+    """AUTO_REGISTER: register kanalına rakam mesajı; on_message tamamlanma süresi."""
+    channel = guild.get_channel(REGISTER_CH)
+    sem = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def one(uid: int):
+        async with sem:
+            m = guild.add_member(uid)
+            msg = FakeMessage(channel, m, player_id(uid), guild)
+            t0 = time.perf_counter()
+            await main.on_message(msg)
+            latencies.append(time.perf_counter() - t0)
+
+    with LagMonitor() as lag:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(30_000_000 + i) for i in range(n)))
+        await drain(lambda: not main._background, args.timeout)
+        elapsed = time.perf_counter() - t0
+        await drain(lambda: main.storage.depth == 0, args.timeout)
+    report("auto-register storm", n, elapsed, latencies, lag, {
+        "sheet appends": f"{main.ws.append_calls} calls / {len(main.ws.rows)} rows",
+    })
+
+async def scenario_mirror(guild: FakeGuild, n: int):
+    """Shop botu burst'ü: on_message süresi ve hedef kanala giden mesaj sayısı."""
+    bot = FakeUser(SHOP_BOT, guild, bot=True)
+    source = guild.get_channel(999)
+    target = guild.get_channel(MIRROR_CH)
+    base = target.sent
+    latencies = []
+    with LagMonitor() as lag:
+        t0 = time.perf_counter()
+        for i in range(n):
+            msg = FakeMessage(source, bot, f"<@&{CM_ROLE}> New offer #{i}: " + "x" * random.randint(20, 400), guild)
+            h0 = time.perf_counter()
+            await main.on_message(msg)
+            latencies.append(time.perf_counter() - h0)
+        drained = await drain(lambda: main.mirror_queue.depth == 0, args.timeout)
+        await asyncio.sleep(0.1)
+        elapsed = time.perf_counter() - t0
+    sent = target.sent - base
+    report("mirror burst", n, elapsed, latencies, lag, {
+        "target messages": f"{sent} for {n} posts ({n / sent if sent else 0:.1f} embeds/message, drained: {drained})",
+    })
+
+async def scenario_files(guild: FakeGuild, n: int):
+    """MIRROR_ATTACHMENTS=copy: her postun ekleri yerel CDN'den akışla indirilip hedefe yüklenir.
+    Bellek tepe değeri (tracemalloc) taşınan toplam byte'tan bağımsız kalmalı."""
+    bot = FakeUser(SHOP_BOT, guild, bot=True)
+    source = guild.get_channel(999)
+    target = guild.get_channel(MIRROR_CH)
+    base_sent, base_files, base_bytes = target.sent, target.files, target.file_bytes
+    main.MIRROR_ATTACHMENTS = "copy"
+    latencies = []
+    async with FakeCDN() as cdn:
+        tracemalloc.start()
+        with LagMonitor() as lag:
+            t0 = time.perf_counter()
+            for i in range(n):
+                atts = []
+                for j in range(args.files):
+                    size = int(args.file_kb * 1024 * random.uniform(0.2, 1.8))
+                    kind = "image/png" if j == 0 else "application/octet-stream"
+                    atts.append(FakeAttachment(f"{cdn.base}/{size}/f{i}_{j}.bin", f"f{i}_{j}.bin", size, kind))
+                msg = FakeMessage(source, bot, f"<@&{CM_ROLE}> Bundle #{i}", guild)
+                msg.attachments = atts
+                h0 = time.perf_counter()
+                await main.on_message(msg)
+                latencies.append(time.perf_counter() - h0)
+            drained = await drain(lambda: main.mirror_queue.depth == 0 and not main.mirror_queue.sending, args.timeout)
+            elapsed = time.perf_counter() - t0
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        await main.mirror_files.close()
+    main.MIRROR_ATTACHMENTS = "link"
+    moved = target.file_bytes - base_bytes
+    report("mirror attachments (copy)", n, elapsed, latencies, lag, {
+        "target messages": f"{target.sent - base_sent} for {n} posts, {target.files - base_files} files (drained: {drained})",
+        "bytes": f"{cdn.served / 2**20:.0f} MB downloaded, {moved / 2**20:.0f} MB uploaded, "
+                 f"{moved / 2**20 / elapsed:.0f} MB/s",
+        "peak memory": f"{peak / 2**20:.1f} MB traced (spill at {main.MIRROR_SPILL_BYTES / 2**20:g} MB, "
+                       f"{main.MIRROR_DOWNLOAD_CONCURRENCY} parallel downloads)",
+    })
+
+async def scenario_shutdown(guild: FakeGuild, n: int):
+    """Panel fırtınası sırasında SIGTERM: yeni tıklamalar reddedilmeli, başlamış doğrulamalar
+    tamamlanmalı; rolü olmayan kayıt / kaydı olmayan rol kalmamalı."""
+    panel = main.VerifyPanelView()
+    channel = guild.get_channel(REGISTER_CH)
+    sem = asyncio.Semaphore(args.concurrency)
+    members, refused = [], 0
+
+    async def one(uid: int):
+        nonlocal refused
+        async with sem:
+            m = guild.add_member(uid)
+            members.append(m)
+            i1 = FakeInteraction(m, guild, channel)
+            if await panel.interaction_check(i1):
+                await panel.verify_button.callback(i1)
+            if i1.modal is None:
+                refused += 1
+                return
+            i1.modal.player_id_input._value = player_id(uid)
+            i2 = FakeInteraction(m, guild, channel)
+            if await i1.modal.interaction_check(i2):
+                await i1.modal.on_submit(i2)
+            view = i2.sent[-1][1].get("view") if i2.sent else None
+            if view is None:
+                refused += 1
+                return
+            i3 = FakeInteraction(m, guild, channel)
+            if await view.interaction_check(i3):
+                await view.confirm.callback(i3)
+            else:
+                refused += 1
+
+    async def sigterm():
+        await asyncio.sleep(args.shutdown_after)
+        main.request_shutdown("SIGTERM")
+
+    with LagMonitor() as lag:
+        t0 = time.perf_counter()
+        await asyncio.gather(sigterm(), *(one(40_000_000 + i) for i in range(n)))
+        await main.lifecycle.task
+        elapsed = time.perf_counter() - t0
+    index = main.indexes[guild.id]
+    with_role = sum(1 for m in members if m.get_role(VERIFIED))
+    with_row = sum(1 for m in members if index.player_of(m.id) is not None)
+    torn = sum(
+        1 for m in members
+        if bool(m.get_role(VERIFIED)) != (index.player_of(m.id) is not None)
+        and not main.role_grants.pending(guild.id, m.id)
+    )
+    report("SIGTERM under load", n, elapsed, [], lag, {
+        "verified": f"{with_role} with role, {with_row} journaled, {refused} refused (restarting)",
+        "torn": f"{torn} (role without row or row without role, not queued)",
+        "pending": f"roles {main.role_grants.depth}, replica rows {main.storage.depth}",
+    })
+
+SCENARIOS = {
+    "join":   (scenario_join, 5000),
+    "panel":  (scenario_panel, 2000),
+    "auto":   (scenario_auto, 2000),
+    "mirror": (scenario_mirror, 500),
+    "files":  (scenario_files, 50),
+    "shutdown": (scenario_shutdown, 1000),
+}
+
+async def _ready():
+    pass
+
+async def run():
+    guild = FakeGuild(GUILD_ID)
+    main.client.get_channel = guild.get_channel   # log digest'leri sahte kanala
+    main.client.wait_until_ready = _ready          # gateway yok; scheduler worker'ları hemen başlasın
+    main.ws = FakeWorksheet(args.sheet_latency)
+    main.SHEETS_OK = True
+    main.sheets_ready.set()
+    main.storage.start()
+    main.log_agg.start()
+    main.welcome_scheduler.start()
+    main.role_grants.start()
+
+    print(f"bench: latency {args.latency * 1000:.0f} ms ±{args.jitter:.0%}, p429 {args.p429}, "
+          f"append_rows {args.sheet_latency * 1000:.0f} ms, tmp {TMP}")
+    for name in dict.fromkeys(args.scenario):
+        fn, default_n = SCENARIOS[name]
+        api.reset()
+        await fn(guild, args.n or default_n)
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(run())
+    finally:
+        main.journal.close()
+        shutil.rmtree(TMP, ignore_errors=True)
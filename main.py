@@ -3,13 +3,33 @@
 # 2. Mirror: Raid Rush'taki gibi Shop mesajlarını kopyalar
 # 3. Welcome DM: Sunucuya girene otomatik DM atar ve verify kanalına yönlendirir (YENİ)
 
+import time
+_T0 = time.perf_counter()  # startup süre ölçümü import'lardan önce başlar
+
 import os
+import sys
 import re
 import json
+import random
 import base64
+import csv
+import io
+import asyncio
+import contextlib
+import signal
+import threading
+import tracemalloc
+import sqlite3
+import bisect
+import tempfile
+import aiohttp
+from array import array
+from collections import OrderedDict, deque
+from typing import Literal
 import discord
 from discord import app_commands
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse, parse_qs
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Helpers
@@ -20,6 +40,159 @@ def env_text(key: str, default: str) -> str:
         return default
     return val.replace("\\n", "\n")
 
+STARTUP_MARKS: list[tuple[str, float]] = []
+
+def mark_startup(name: str):
+    """Açılış aşamasını (T0'dan itibaren saniye) kaydet; her aşama bir kez."""
+    if not any(n == name for n, _ in STARTUP_MARKS):
+        STARTUP_MARKS.append((name, time.perf_counter() - _T0))
+
+mark_startup("imports")
+
+def startup_report() -> str:
+    lines, prev = [], 0.0
+    for name, t in STARTUP_MARKS:
+        lines.append(f"{name:<18} +{(t - prev) * 1000:7.0f} ms  (at {t:6.2f} s)")
+        prev = t
+    return "\n".join(lines) or "-"
+
+class TokenBucket:
+    """Basit token bucket: saniyede `rate` token, en fazla `capacity` birikir."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._stamp = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def available(self) -> float:
+        self._refill()
+        return self.tokens
+
+    async def acquire(self, n: float = 1.0):
+        while True:
+            self._refill()
+            if self.tokens >= n:
+                self.tokens -= n
+                return
+            await asyncio.sleep((n - self.tokens) / self.rate)
+
+class AdaptiveTokenBucket(TokenBucket):
+    """429'da hız yarıya iner (min_rate'e kadar), her başarılı işlemde max_rate'in %5'i kadar
+    geri çıkar (AIMD). Welcome DM'leri ve rol işlemleri bunu kullanır."""
+
+    def __init__(self, rate: float, capacity: float, min_rate: float):
+        super().__init__(rate, capacity)
+        self.max_rate = rate
+        self.min_rate = min_rate
+
+    def backoff(self, retry_after: float | None = None) -> float:
+        """Hızı yarıya indir, birikmiş token'ları sıfırla → beklenecek süre."""
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0
+        return retry_after if retry_after else 1 / self.rate
+
+    def recover(self):
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + 0.05 * self.max_rate)
+
+class KeyedLock:
+    """Anahtar başına asyncio.Lock; kimse beklemiyorsa kilit silinir (bellek sabit kalır)."""
+
+    def __init__(self):
+        self._locks: dict = {}
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    @contextlib.asynccontextmanager
+    async def __call__(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._locks.pop(key, None)
+
+class CompactIdSet:
+    """Snowflake ID kümesi: sıralı array('Q') taban (8 byte/ID) + küçük ekleme/silme delta'ları.
+    Delta'lar COMPACT_AT'i aşınca taban yeniden kurulur; yüz binlerce ID için set'ten ~6x küçük."""
+
+    COMPACT_AT = 4096
+
+    def __init__(self, ids=()):
+        self._base = array("Q", sorted(set(ids)))
+        self._added: set[int] = set()
+        self._removed: set[int] = set()
+
+    def _in_base(self, x: int) -> bool:
+        i = bisect.bisect_left(self._base, x)
+        return i < len(self._base) and self._base[i] == x
+
+    def __contains__(self, x: int) -> bool:
+        return x in self._added or (x not in self._removed and self._in_base(x))
+
+    def __len__(self) -> int:
+        return len(self._base) - len(self._removed) + len(self._added)
+
+    def add(self, x: int):
+        if x in self._removed:
+            self._removed.discard(x)
+        elif not self._in_base(x):
+            self._added.add(x)
+            self._maybe_compact()
+
+    def discard(self, x: int):
+        if x in self._added:
+            self._added.discard(x)
+        elif self._in_base(x) and x not in self._removed:
+            self._removed.add(x)
+            self._maybe_compact()
+
+    def update(self, ids):
+        for x in ids:
+            self.add(x)
+
+    def _maybe_compact(self):
+        if len(self._added) + len(self._removed) > self.COMPACT_AT:
+            self.compact()
+
+    def compact(self):
+        if self._removed:
+            merged = [x for x in self._base if x not in self._removed]
+        else:
+            merged = list(self._base)
+        merged.extend(self._added)
+        merged.sort()
+        self._base = array("Q", merged)
+        self._added.clear()
+        self._removed.clear()
+
+    def nbytes(self) -> int:
+        return self._base.itemsize * len(self._base) + sys.getsizeof(self._added) + sys.getsizeof(self._removed)
+
+_background: set[asyncio.Task] = set()   # kısa işler (DM, mesaj silme): kapanışta beklenir
+_services: set[asyncio.Task] = set()     # açılış/bağlantı görevleri: kapanışta beklenmez
+
+def spawn(coro, drain: bool = True) -> asyncio.Task:
+    """Fire-and-forget task; referansı tutulur ki GC tarafından yarıda kesilmesin.
+    drain=False: Sheets bağlantısı gibi uzun süre retry'da kalabilen görevler (kapanışı bekletmez)."""
+    task = asyncio.create_task(coro)
+    tasks = _background if drain else _services
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
+    return task
+
 # ─────────────────────────────────────────────────────────────────────────────
 # ENV / IDs
 TOKEN               = os.getenv("DISCORD_TOKEN", "")
@@ -33,6 +206,15 @@ MOD_ROLE_ID   = int(os.getenv("MOD_ROLE_ID", "0"))                 # optional mo
 AUTO_REGISTER = os.getenv("AUTO_REGISTER", "false").lower() in ("1", "true", "yes")
 ID_LENGTH     = int(os.getenv("ID_LENGTH", "9"))
 
+# Verification pipeline: aşama başına eşzamanlı worker sayısı
+PIPELINE_DELETE_WORKERS = int(os.getenv("PIPELINE_DELETE_WORKERS", "4"))
+PIPELINE_ROLE_WORKERS   = int(os.getenv("PIPELINE_ROLE_WORKERS", "4"))
+PIPELINE_DM_WORKERS     = int(os.getenv("PIPELINE_DM_WORKERS", "4"))
+
+# /verify_bulk
+BULK_ROLE_CONCURRENCY = int(os.getenv("BULK_ROLE_CONCURRENCY", "5"))   # eşzamanlı fetch_member; roller role_grants hızında
+BULK_MAX_BYTES        = int(os.getenv("BULK_MAX_BYTES", str(8 * 1024 * 1024)))
+
 # Branding / guild
 GUILD_ID    = int(os.getenv("GUILD_ID", "0"))
 SERVER_NAME = os.getenv("SERVER_NAME", "Arcane Arena")
@@ -40,6 +222,21 @@ BRAND       = os.getenv("BRAND", "Arcane Arena")
 
 SHOW_AUTHOR = os.getenv("SHOW_AUTHOR", "false").lower() in ("1", "true", "yes")
 
+# Büyük sunucular: açılışta chunking yok, member cache yok; verified kontrolü kompakt ID kümesinden
+LEAN_MEMBER_CACHE = os.getenv("LEAN_MEMBER_CACHE", "false").lower() in ("1", "true", "yes")
+
+# Çoklu sunucu: AutoShardedClient + sunucu başına ayarlar (JSON dosyası, /guild_config ile yönetilir)
+AUTO_SHARD        = os.getenv("AUTO_SHARD", "false").lower() in ("1", "true", "yes")
+SHARD_COUNT       = int(os.getenv("SHARD_COUNT", "0"))       # 0 = Discord önerisi
+GUILD_CONFIG_PATH = os.getenv("GUILD_CONFIG_PATH", "data/guilds.json")
+
+# Welcome DM scheduler (join dalgalarında DM hızını sınırlar)
+WELCOME_RATE      = float(os.getenv("WELCOME_RATE", "1.0"))        # DM / saniye (üst sınır)
+WELCOME_BURST     = float(os.getenv("WELCOME_BURST", "5"))
+WELCOME_QUEUE_MAX = int(os.getenv("WELCOME_QUEUE_MAX", "5000"))
+WELCOME_COOLDOWN  = float(os.getenv("WELCOME_COOLDOWN", str(6 * 3600)))  # aynı kullanıcıya tekrar DM
+WELCOME_WORKERS   = max(1, int(os.getenv("WELCOME_WORKERS", "4")))    # aynı anda uçuşta olan DM
+
 # 🔁 MIRROR SETTINGS (Shop Loglama)
 MIRROR_TARGET_CHANNEL_ID  = int(os.getenv("MIRROR_TARGET_CHANNEL_ID", "0"))
 COMMUNITY_MANAGER_ROLE_ID = int(os.getenv("COMMUNITY_MANAGER_ROLE_ID", "0"))
@@ -47,6 +244,22 @@ COMMUNITY_MANAGER_ROLE_ID = int(os.getenv("COMMUNITY_MANAGER_ROLE_ID", "0"))
 MIRROR_BOT_USER_IDS = {
     int(x) for x in os.getenv("MIRROR_BOT_USER_IDS", "").replace(" ", "").split(",") if x.isdigit()
 }
+# Kopyalanan mesaj ID'leri: bellek tavanı, TTL ve disk snapshot'ı
+MIRROR_DEDUPE_MAX      = int(os.getenv("MIRROR_DEDUPE_MAX", "50000"))
+MIRROR_DEDUPE_TTL      = float(os.getenv("MIRROR_DEDUPE_TTL", str(7 * 24 * 3600)))
+MIRROR_DEDUPE_PATH     = os.getenv("MIRROR_DEDUPE_PATH", "data/mirrored_ids.bin")
+MIRROR_SNAPSHOT_EVERY  = float(os.getenv("MIRROR_SNAPSHOT_EVERY", "300"))
+MIRROR_FLUSH_DELAY     = float(os.getenv("MIRROR_FLUSH_DELAY", "1.0"))   # burst'ü toplamak için bekleme
+# Ek dosyalar: "link" (ilk görsel embed'de, kaynak mesaja bağlı) | "copy" (hepsi hedefe yeniden yüklenir)
+MIRROR_ATTACHMENTS          = os.getenv("MIRROR_ATTACHMENTS", "link").lower()
+MIRROR_DOWNLOAD_CONCURRENCY = max(1, int(os.getenv("MIRROR_DOWNLOAD_CONCURRENCY", "4")))
+MIRROR_SPILL_BYTES          = int(os.getenv("MIRROR_SPILL_BYTES", str(1024 * 1024)))        # üstü temp dosyaya
+MIRROR_UPLOAD_LIMIT         = int(os.getenv("MIRROR_UPLOAD_LIMIT", str(10 * 1024 * 1024)))  # guild limiti yoksa
+MIRROR_DOWNLOAD_TIMEOUT     = float(os.getenv("MIRROR_DOWNLOAD_TIMEOUT", "120"))
+MIRROR_TMP_DIR              = os.getenv("MIRROR_TMP_DIR", "") or None
+if MIRROR_ATTACHMENTS not in ("link", "copy"):
+    print(f"⚠️ Unknown MIRROR_ATTACHMENTS '{MIRROR_ATTACHMENTS}', using 'link'")
+    MIRROR_ATTACHMENTS = "link"
 
 # Panel text (tamamen ENV'den; boş ise fallback)
 WELCOME_TITLE = env_text("WELCOME_TITLE", "The most competitive tower defense experience.")
@@ -69,6 +282,7 @@ ASSET_IMAGE_PATH  = os.getenv("ASSET_IMAGE_PATH", "assets/player_id_guide.png")
 # NEW: Üstte büyük karşılama görseli
 BANNER_IMAGE_PATH = os.getenv("BANNER_IMAGE_PATH", "assets/welcome_banner.png")
 BANNER_IMAGE_URL  = os.getenv("BANNER_IMAGE_URL", "")
+ASSET_STAT_INTERVAL = float(os.getenv("ASSET_STAT_INTERVAL", "30"))  # disk değişikliği kontrol aralığı
 
 # Modal / buttons
 VERIFY_BUTTON_LABEL = os.getenv("VERIFY_BUTTON_LABEL", "Verify")
@@ -77,6 +291,11 @@ MODAL_FIELD_LABEL   = os.getenv("MODAL_FIELD_LABEL", f"Player ID (exactly {ID_LE
 CONFIRM_LABEL       = os.getenv("CONFIRM_LABEL", "Confirm")
 CANCEL_LABEL        = os.getenv("CANCEL_LABEL", "Cancel")
 
+# Registration storage: yerel SQLite journal birincil; kayıtlar listelenen replikalara
+# (sheets, jsonl; virgülle) asenkron kopyalanır. Boş = yalnız yerel.
+STORAGE_REPLICAS   = [x.strip().lower() for x in os.getenv("STORAGE_REPLICAS", "sheets").split(",") if x.strip()]
+STORAGE_JSONL_PATH = os.getenv("STORAGE_JSONL_PATH", "data/registrations.jsonl")
+
 # Google Sheets
 SHEET_ID               = os.getenv("SHEET_ID", "")
 WORKSHEET              = os.getenv("WORKSHEET", "Registrations")
@@ -90,18 +309,20 @@ SUPPORT_USER_ID = os.getenv("SUPPORT_USER_ID", "0")
 # ─────────────────────────────────────────────────────────────────────────────
 # Validation
 EXACT_ASCII_DIGITS_RAW = re.compile(rf"^\d{{{ID_LENGTH}}}$")
-_mirrored_ids: set[int] = set()
 
-# Metinler
-REGISTER_JUMP = (
-    f"https://discord.com/channels/{GUILD_ID}/{REGISTER_CHANNEL_ID}" if GUILD_ID else "#welcome"
-)
+for _name in [n for n in STORAGE_REPLICAS if n not in ("sheets", "jsonl")]:
+    print(f"⚠️ Unknown storage replica '{_name}' ignored (known: sheets, jsonl)")
+    STORAGE_REPLICAS.remove(_name)
 
-def cm_contact():
-    if SUPPORT_USER_ID and SUPPORT_USER_ID.isdigit() and SUPPORT_USER_ID != "0":
-        return f"<@{SUPPORT_USER_ID}>"
-    if CM_ROLE_ID:
-        return f"<@&{CM_ROLE_ID}>"
+# Metinler
+def cm_contact(guild: discord.Guild | None = None):
+    cfg = guild_configs.get(guild.id) if guild else None
+    support = cfg.support_user_id if cfg else (int(SUPPORT_USER_ID) if SUPPORT_USER_ID.isdigit() else 0)
+    cm_role = cfg.cm_role_id if cfg else CM_ROLE_ID
+    if support:
+        return f"<@{support}>"
+    if cm_role:
+        return f"<@&{cm_role}>"
     return "the Community Managers"
 
 MSG_INVALID = "{mention} Invalid Player ID. Please enter your **{need}-digit** Player ID."
@@ -109,377 +330,3526 @@ MSG_ALREADY_VERIFIED = (
     "{mention} You are **already verified**. Updates are disabled. "
     "Please DM {cm} to request a change."
 )
+MSG_ID_TAKEN = (
+    "{mention} This Player ID is **already registered** to another account. "
+    "If you think this is a mistake, please DM {cm}."
+)
+MSG_ROLE_QUEUED = "⏳ Player ID saved! Your access is being granted — you’ll get a DM as soon as it’s done."
+MSG_ROLE_FAILED = (
+    "⚠️ {mention} Your Player ID was saved, but I couldn’t grant your access. "
+    "Please contact {cm}."
+)
+MSG_RESTARTING = "♻️ The bot is restarting — please try again in a few seconds."
 DM_OK    = "✅ Player ID saved and your access has been granted. Enjoy!"
-DM_BLOCK = f"Hi! I can’t process DMs. Please click **Verify** in {REGISTER_JUMP} on **{SERVER_NAME}**."
+DM_BLOCK = "Hi! I can’t process DMs. Please click **Verify** in {jump} on **{server}**."
 
 COLOR_OK   = 0x57F287
 COLOR_WARN = 0xFEE75C
 COLOR_ERR  = 0xED4245
 
+# ─────────────────────────────────────────────────────────────────────────────
+# Guild config (sunucu başına ID'ler; bellekte guild_id → GuildConfig)
+class GuildConfig:
+    """Bir sunucunun kanal/rol ID'leri ve ayarları. Tanımsız alanlar 0 / varsayılan."""
+
+    FIELDS = {
+        "register_channel_id": int,
+        "log_channel_id": int,
+        "verified_role_id": int,
+        "mod_role_id": int,
+        "cm_role_id": int,
+        "support_user_id": int,
+        "mirror_target_channel_id": int,
+        "community_manager_role_id": int,
+        "mirror_bot_user_ids": set,
+        "auto_register": bool,
+        "worksheet": str,
+        "server_name": str,
+    }
+
+    def __init__(self, guild_id: int, **values):
+        self.guild_id = guild_id
+        self.register_channel_id = 0
+        self.log_channel_id = 0
+        self.verified_role_id = 0
+        self.mod_role_id = 0
+        self.cm_role_id = 0
+        self.support_user_id = 0
+        self.mirror_target_channel_id = 0
+        self.community_manager_role_id = 0
+        self.mirror_bot_user_ids = set(MIRROR_BOT_USER_IDS)   # genelde aynı shop botu
+        self.auto_register = AUTO_REGISTER
+        self.worksheet = f"{WORKSHEET} {guild_id}"
+        self.server_name = ""                                 # boşsa Discord'daki sunucu adı
+        for key, value in values.items():
+            self.set(key, value)
+
+    def set(self, key: str, value):
+        kind = self.FIELDS.get(key)
+        if kind is None:
+            raise KeyError(f"Unknown setting '{key}'")
+        if kind is set:
+            if isinstance(value, str):
+                value = [x for x in value.replace(" ", "").split(",") if x]
+            value = {int(x) for x in value}
+        elif kind is bool:
+            value = value if isinstance(value, bool) else str(value).lower() in ("1", "true", "yes")
+        else:
+            value = kind(value)
+        setattr(self, key, value)
+
+    @classmethod
+    def from_env(cls, guild_id: int) -> "GuildConfig":
+        """Tek sunuculu kurulum: mevcut ENV değişkenleri."""
+        return cls(
+            guild_id,
+            register_channel_id=REGISTER_CHANNEL_ID,
+            log_channel_id=LOG_CHANNEL_ID,
+            verified_role_id=VERIFIED_ROLE_ID,
+            mod_role_id=MOD_ROLE_ID,
+            cm_role_id=CM_ROLE_ID,
+            support_user_id=int(SUPPORT_USER_ID) if SUPPORT_USER_ID.isdigit() else 0,
+            mirror_target_channel_id=MIRROR_TARGET_CHANNEL_ID,
+            community_manager_role_id=COMMUNITY_MANAGER_ROLE_ID,
+            worksheet=WORKSHEET,
+            server_name=SERVER_NAME,
+        )
+
+    def to_dict(self) -> dict:
+        out = {}
+        for key, kind in self.FIELDS.items():
+            value = getattr(self, key)
+            out[key] = sorted(value) if kind is set else value
+        return out
+
+    @property
+    def mirror_enabled(self) -> bool:
+        return bool(self.mirror_target_channel_id and self.community_manager_role_id and self.mirror_bot_user_ids)
+
+class GuildConfigStore:
+    """GUILD_CONFIG_PATH'teki {"<guild_id>": {ayar: değer}} dosyasının bellekteki önbelleği.
+    Handler'lar her olayda yalnızca dict lookup yapar; dosya /guild_config reload ile
+    (restart'sız) yeniden okunur, /guild_config set ile atomik olarak yazılır.
+
+    Dosyada olmayan GUILD_ID (ya da dosya boşken herhangi bir sunucu) ENV ayarlarını kullanır;
+    böylece tek sunuculu kurulumlar değişmeden çalışır."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._configs: dict[int, GuildConfig] = {}
+        self._env: dict[int, GuildConfig] = {}
+        self.loaded_at: datetime | None = None
+        self.last_error = ""
+
+    def load(self) -> int:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                raw = json.load(f)
+        except FileNotFoundError:
+            raw = {}
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"⚠️ Guild config not reloaded ({self.path}): {e}")
+            raise
+        configs = {int(gid): GuildConfig(int(gid), **values) for gid, values in raw.items()}
+        self._configs = configs          # tek atama: yarım yüklenmiş önbellek görünmez
+        self.loaded_at = datetime.now(timezone.utc)
+        self.last_error = ""
+        return len(configs)
+
+    def save(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({str(gid): c.to_dict() for gid, c in sorted(self._configs.items())}, f, indent=2)
+        os.replace(tmp, self.path)
+
+    def get(self, guild_id: int | None) -> GuildConfig | None:
+        if not guild_id:
+            return None
+        cfg = self._configs.get(guild_id)
+        if cfg is not None:
+            return cfg
+        if guild_id == GUILD_ID or (not GUILD_ID and not self._configs):
+            return self._env.setdefault(guild_id, GuildConfig.from_env(guild_id))
+        return None
+
+    def set(self, guild_id: int, key: str, value) -> GuildConfig:
+        cfg = self._configs.get(guild_id)
+        if cfg is None:
+            base = self.get(guild_id)
+            cfg = GuildConfig(guild_id, **base.to_dict()) if base else GuildConfig(guild_id)
+        cfg.set(key, value)
+        self._configs[guild_id] = cfg
+        self.save()
+        return cfg
+
+    def in_file(self, guild_id: int) -> bool:
+        return guild_id in self._configs
+
+    def all(self) -> list[GuildConfig]:
+        return list({**self._env, **self._configs}.values())
+
+guild_configs = GuildConfigStore(GUILD_CONFIG_PATH)
+guild_configs.load()
+
+def guild_cfg(guild: discord.Guild | int | None) -> GuildConfig | None:
+    return guild_configs.get(guild if isinstance(guild, int) or guild is None else guild.id)
+
+def server_name(guild: discord.Guild) -> str:
+    cfg = guild_cfg(guild)
+    return (cfg.server_name if cfg else "") or guild.name
+
+def register_jump(guild_id: int) -> str:
+    cfg = guild_cfg(guild_id)
+    if not cfg or not cfg.register_channel_id:
+        return "#welcome"
+    return f"https://discord.com/channels/{guild_id}/{cfg.register_channel_id}"
+
+def dm_block(user: discord.abc.User) -> str:
+    """DM'de sunucu bilgisi yok: kullanıcının yapılandırılmış ortak sunucusu (lean modda boş
+    olabilir), yoksa tek sunuculu kurulumun GUILD_ID'si."""
+    guild = next((g for g in getattr(user, "mutual_guilds", ()) if guild_cfg(g)), None)
+    if guild is not None:
+        return DM_BLOCK.format(jump=register_jump(guild.id), server=server_name(guild))
+    return DM_BLOCK.format(jump=register_jump(GUILD_ID), server=SERVER_NAME)
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Discord client
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
-client = discord.Client(intents=intents)
-tree = app_commands.CommandTree(client)
+
+class VerifyBot(discord.AutoShardedClient if AUTO_SHARD else discord.Client):
+    async def setup_hook(self):
+        # Login bitti, gateway henüz bağlanmadı: persistent view'ı şimdi kaydet ki
+        # restart sonrası ilk panel tıklamaları da çalışsın. Yavaş işler arka planda.
+        mark_startup("login")
+        self.add_view(VerifyPanelView())
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                asyncio.get_running_loop().add_signal_handler(sig, request_shutdown, sig.name)
+            except (NotImplementedError, RuntimeError):
+                pass   # Windows: sinyal handler'ı yok, client.run'ın varsayılanı geçerli
+        spawn(connect_sheets(), drain=False)
+        spawn(sync_commands(), drain=False)
+        spawn(start_metrics_server(), drain=False)
+        storage.start()
+        indexes.start()
+        _mirrored_ids.start()
+        welcome_scheduler.start()
+        role_grants.start()
+        reconciler.start()
+        log_agg.start()
+
+_client_options = {"intents": intents}
+if LEAN_MEMBER_CACHE:
+    _client_options.update(chunk_guilds_at_startup=False, member_cache_flags=discord.MemberCacheFlags.none())
+if AUTO_SHARD and SHARD_COUNT:
+    _client_options["shard_count"] = SHARD_COUNT
+client = VerifyBot(**_client_options)
+
+class Lifecycle:
+    """Kapanış durumu ve uçuştaki handler'lar. Uzun iş yapan handler'lar başta track() çağırır;
+    task bitince kendiliğinden düşer. Kapanışta (SIGTERM) yeni interaction'lar reddedilir ve
+    izlenen işler SHUTDOWN_DEADLINE'a kadar beklenir (bkz. graceful_shutdown)."""
+
+    def __init__(self):
+        self.closing = False
+        self.refused = 0
+        self.task: asyncio.Task | None = None
+        self._work: dict[asyncio.Task, str] = {}
+
+    def track(self, kind: str):
+        task = asyncio.current_task()
+        if task is not None and task not in self._work:
+            self._work[task] = kind
+            task.add_done_callback(self._untrack)
+
+    def _untrack(self, task: asyncio.Task):
+        self._work.pop(task, None)
+
+    def inflight(self) -> dict[str, int]:
+        out: dict[str, int] = {}
+        for kind in self._work.values():
+            out[kind] = out.get(kind, 0) + 1
+        return out
+
+lifecycle = Lifecycle()
+
+async def refuse_if_closing(interaction: discord.Interaction) -> bool:
+    """Kapanıyorsak interaction'ı kibarca geri çevir (True döner)."""
+    if not lifecycle.closing:
+        return False
+    lifecycle.refused += 1
+    try:
+        if interaction.type is discord.InteractionType.autocomplete:
+            await interaction.response.autocomplete([])
+        else:
+            await interaction.response.send_message(MSG_RESTARTING, ephemeral=True)
+    except Exception:
+        pass
+    return True
+
+class RefuseWhileClosing:
+    """View/Modal mixin: kapanış sırasında gelen tıklamalar MSG_RESTARTING alır."""
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        return not await refuse_if_closing(interaction)
+
+class VerifyTree(RefuseWhileClosing, app_commands.CommandTree):
+    pass
+
+tree = VerifyTree(client)
+
+async def sync_commands():
+    try:
+        await tree.sync()
+        mark_startup("commands_synced")
+    except Exception as e:
+        print(f"⚠️ Command sync failed: {e}")
 
 allowed_mentions_users_only = discord.AllowedMentions(everyone=False, roles=False, users=True)
 
 def is_mod(member: discord.Member) -> bool:
     if member.guild_permissions.administrator or member.guild_permissions.manage_roles:
         return True
-    if MOD_ROLE_ID and discord.utils.get(member.roles, id=MOD_ROLE_ID):
+    cfg = guild_cfg(member.guild)
+    if cfg and cfg.mod_role_id and discord.utils.get(member.roles, id=cfg.mod_role_id):
         return True
     return False
 
-async def send_temp(ch: discord.TextChannel, text: str):
-    try:
-        return await ch.send(text, delete_after=10, allowed_mentions=allowed_mentions_users_only)
-    except:
-        return None
+async def send_temp(ch: discord.TextChannel, text: str):
+    try:
+        return await ch.send(text, delete_after=10, allowed_mentions=allowed_mentions_users_only)
+    except:
+        return None
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Metrics (Prometheus text format, opsiyonel yerel HTTP endpoint)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))          # 0 = kapalı
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+_metrics: list = []
+
+def _fmt_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Counter:
+    """Monotonik sayaç. inc() yalnızca bir dict güncellemesidir."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labels: tuple = ()):
+        self.name, self.doc, self.labels = name, doc, labels
+        self._values: dict[tuple, float] = {}
+        _metrics.append(self)
+
+    def inc(self, *label_values, n: float = 1.0):
+        self._values[label_values] = self._values.get(label_values, 0.0) + n
+
+    def render(self) -> list[str]:
+        return [f"{self.name}{_fmt_labels(self.labels, k)} {v:g}" for k, v in self._values.items()]
+
+class Histogram:
+    """Sabit bucket'lı histogram. observe() = bir bisect + üç toplama."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.doc, self.labels, self.buckets = name, doc, labels, buckets
+        self._le = [f'le="{b:g}"' for b in buckets] + ['le="+Inf"']
+        self._series: dict[tuple, list] = {}   # labels → [bucket counts..., sum, count]
+        _metrics.append(self)
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    @contextlib.contextmanager
+    def time(self, *label_values):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, *label_values)
+
+    def render(self) -> list[str]:
+        out = []
+        for key, series in self._series.items():
+            acc = 0
+            for le, n in zip(self._le[:-1], series):
+                acc += n
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labels, key, le)} {acc}")
+            out.append(f"{self.name}_bucket{_fmt_labels(self.labels, key, self._le[-1])} {series[-1]}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labels, key)} {series[-2]:.6f}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labels, key)} {series[-1]}")
+        return out
+
+class Gauge:
+    """Scrape anında fn() ile okunan değer; kuyruk derinlikleri gibi zaten tutulan durumlar için."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, fn, labels: tuple = ()):
+        self.name, self.doc, self.fn, self.labels = name, doc, fn, labels
+        _metrics.append(self)
+
+    def render(self) -> list[str]:
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        if isinstance(value, dict):
+            return [f"{self.name}{_fmt_labels(self.labels, k)} {v:g}" for k, v in value.items()]
+        return [f"{self.name} {value:g}"]
+
+class CounterFunc(Gauge):
+    """Sayaç değeri zaten bir nesnede tutuluyorsa (ör. scheduler istatistikleri) scrape anında oku."""
+
+    kind = "counter"
+
+def render_metrics() -> str:
+    lines = []
+    for m in _metrics:
+        lines.append(f"# HELP {m.name} {m.doc}")
+        lines.append(f"# TYPE {m.name} {m.kind}")
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+async def _metrics_handler(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request = await asyncio.wait_for(reader.readline(), timeout=5)
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/metrics", "/"):
+            body, status = render_metrics().encode(), "200 OK"
+        else:
+            body, status = b"not found\n", "404 Not Found"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except Exception:
+        pass
+    finally:
+        writer.close()
+
+async def start_metrics_server():
+    if not METRICS_PORT:
+        return
+    try:
+        await asyncio.start_server(_metrics_handler, METRICS_HOST, METRICS_PORT)
+        print(f"[Metrics] Serving on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    except Exception as e:
+        print(f"⚠️ Metrics endpoint failed: {e}")
+
+M_INTERACTION   = Histogram("verify_interaction_seconds", "Confirm click: defer → final edit_original_response.")
+M_STAGE         = Histogram("verify_stage_seconds", "Verification stage latency.", ("stage",))
+M_STORAGE_APPEND = Histogram("storage_append_seconds", "Replica append latency per batch.", ("backend",))
+M_VERIFICATIONS = Counter("verifications_total", "Successful verifications.", ("source",))
+M_FAILURES      = Counter("failures_total", "Failures by kind.", ("kind",))
+M_VERIFY_DEDUP  = Counter("verify_deduplicated_total", "Verification requests served without new work.", ("how",))
+M_MIRROR_FILES  = Counter("mirror_attachments_total", "Mirrored attachments by result (copy mode).", ("result",))
+M_MIRROR_FILE_BYTES = Counter("mirror_attachment_bytes_total", "Attachment bytes streamed.", ("direction",))
+M_MIRROR_FILE_SECONDS = Histogram(
+    "mirror_attachment_seconds", "Attachment transfer time (download: per file, upload: per message).", ("direction",)
+)
+
+Gauge("queue_depth", "Pending items in internal queues.", lambda: {
+    **{(r.backend.name,): r.depth for r in storage.replicas},
+    ("mirror",):  mirror_queue.depth,
+    ("welcome",): welcome_scheduler.depth,
+    ("roles",):   role_grants.depth,
+    ("log",):     log_agg.depth,
+}, ("queue",))
+Gauge("registrations_indexed", "Player IDs in the in-memory indexes.", lambda: sum(len(i.by_player) for i in indexes.values()))
+CounterFunc("mirror_messages_total", "Mirror messages sent (each packs up to 10 embeds).",
+            lambda: mirror_queue.messages_sent)
+CounterFunc("mirror_embeds_total", "Mirrored shop posts by result.", lambda: {
+    ("sent",): mirror_queue.embeds_sent,
+    ("failed",): mirror_queue.failed,
+}, ("result",))
+CounterFunc("role_changes_total", "Verified role grants/removals by result.", lambda: {
+    ("granted",): role_grants.granted,
+    ("revoked",): role_grants.revoked,
+    ("failed",): role_grants.failed,
+    ("retried",): role_grants.retried,
+    ("rate_limited",): role_grants.rate_limited,
+    ("superseded",): role_grants.superseded,
+}, ("result",))
+CounterFunc("welcome_dms_total", "Welcome DMs by result.", lambda: {
+    ("sent",): welcome_scheduler.sent,
+    ("dms_closed",): welcome_scheduler.dms_closed,
+    ("error",): welcome_scheduler.errors,
+    ("rate_limited",): welcome_scheduler.rate_limited,
+    ("skipped_verified",): welcome_scheduler.skipped_verified,
+    ("skipped_left",): welcome_scheduler.skipped_left,
+    ("dropped_full",): welcome_scheduler.dropped_full,
+    ("dropped_cooldown",): welcome_scheduler.dropped_cooldown,
+}, ("result",))
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Log channel digests
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "3.0"))
+
+class LogAggregator:
+    """Log satırlarını biriktirip kanal başına özet (digest) mesajlar halinde gönderir.
+    Zamanlayıcı dolunca ya da mesaj 2000 karakter sınırına ulaşınca flush edilir;
+    hata satırları (urgent) beklemeden gönderilir. `log()` hiçbir zaman beklemez."""
+
+    LIMIT = 2000
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        self._buffers: dict[int, list[str]] = {}
+        self._sizes: dict[int, int] = {}
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._sending = asyncio.Lock()
+        self.lines = 0
+        self.digests = 0
+        self.failed = 0
+
+    @property
+    def depth(self) -> int:
+        return sum(len(b) for b in self._buffers.values())
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def log(self, text: str, urgent: bool = False, channel_id: int | None = None):
+        if channel_id is None:
+            channel_id = LOG_CHANNEL_ID
+        if not channel_id:
+            return
+        text = text[: self.LIMIT]
+        buf = self._buffers.setdefault(channel_id, [])
+        buf.append(text)
+        self._sizes[channel_id] = self._sizes.get(channel_id, 0) + len(text) + 1
+        self.lines += 1
+        if urgent or self._sizes[channel_id] >= self.LIMIT:
+            self._wake.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    def _chunks(self, lines: list[str]) -> list[str]:
+        chunks, cur, size = [], [], 0
+        for line in lines:
+            if cur and size + len(line) + 1 > self.LIMIT:
+                chunks.append("\n".join(cur))
+                cur, size = [], 0
+            cur.append(line)
+            size += len(line) + 1
+        if cur:
+            chunks.append("\n".join(cur))
+        return chunks
+
+    async def flush(self):
+        async with self._sending:
+            for channel_id in list(self._buffers):
+                lines = self._buffers.pop(channel_id)
+                self._sizes.pop(channel_id, None)
+                ch = client.get_channel(channel_id)
+                if not ch:
+                    continue
+                for chunk in self._chunks(lines):
+                    try:
+                        await ch.send(chunk, allowed_mentions=allowed_mentions_users_only)
+                        self.digests += 1
+                    except Exception as e:
+                        self.failed += 1
+                        print(f"[Log] Digest send failed: {e}")
+
+log_agg = LogAggregator(LOG_FLUSH_INTERVAL)
+
+def log_event(text: str, urgent: bool = False, guild: discord.Guild | int | None = None):
+    """Log kanalına satır ekle (beklemeden). Hatalar için urgent=True: hemen flush edilir.
+    guild verilirse o sunucunun log kanalına; verilmezse (sunucudan bağımsız olaylar) ENV'deki kanala."""
+    if guild is None:
+        return log_agg.log(text, urgent=urgent)
+    cfg = guild_cfg(guild)
+    log_agg.log(text, urgent=urgent, channel_id=cfg.log_channel_id if cfg else 0)
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Google Sheets init (arka planda; gateway login'i beklemez)
+ws = None              # varsayılan worksheet (WORKSHEET)
+sheets_book = None     # spreadsheet; sunucu başına worksheet'ler buradan açılır
+SHEETS_OK = False
+SHEETS_WHY = ""
+SERVICE_EMAIL = ""
+SHEETS_CONFIGURED      = bool(SHEET_ID and (GOOGLE_CREDENTIALS_B64 or GOOGLE_CREDENTIALS)) and "sheets" in STORAGE_REPLICAS
+SHEETS_CONNECTING      = SHEETS_CONFIGURED
+SHEETS_CONNECT_RETRIES = int(os.getenv("SHEETS_CONNECT_RETRIES", "8"))
+sheets_ready = asyncio.Event()
+
+if "sheets" not in STORAGE_REPLICAS:
+    SHEETS_WHY = "Not in STORAGE_REPLICAS"
+elif not SHEETS_CONFIGURED:
+    SHEETS_WHY = "Missing SHEET_ID or credentials"
+else:
+    SHEETS_WHY = "Connecting…"
+
+def _open_worksheet():
+    """Bloklayan kısım (thread'de çalışır). Google kütüphaneleri ilk ihtiyaçta import edilir."""
+    global SERVICE_EMAIL, sheets_book
+    import gspread
+    from gspread.exceptions import SpreadsheetNotFound
+    from google.oauth2.service_account import Credentials
+
+    creds_raw = GOOGLE_CREDENTIALS
+    if GOOGLE_CREDENTIALS_B64:
+        creds_raw = base64.b64decode(GOOGLE_CREDENTIALS_B64).decode("utf-8")
+
+    info = json.loads(creds_raw)
+    SERVICE_EMAIL = info.get("client_email", "")
+
+    scopes = [
+        "https://www.googleapis.com/auth/spreadsheets",
+        "https://www.googleapis.com/auth/drive",
+    ]
+    creds = Credentials.from_service_account_info(info, scopes=scopes)
+    gc = gspread.authorize(creds)
+
+    try:
+        sh = gc.open_by_key(SHEET_ID)
+    except SpreadsheetNotFound:
+        raise RuntimeError(
+            f"Spreadsheet not found. Wrong SHEET_ID or not shared with {SERVICE_EMAIL}."
+        )
+
+    sheets_book = sh
+    return _open_tab(WORKSHEET, create=True)
+
+def _open_tab(title: str, create: bool):
+    """Worksheet'i aç; yoksa create=True ise oluştur, değilse None (thread'de çalışır)."""
+    from gspread.exceptions import WorksheetNotFound
+    try:
+        return sheets_book.worksheet(title)
+    except WorksheetNotFound:
+        return sheets_book.add_worksheet(title=title, rows="1000", cols="12") if create else None
+
+async def connect_sheets():
+    """Retry'lı bağlantı. Hazır olana kadar gelen doğrulamalar journal'da bekler."""
+    global ws, SHEETS_OK, SHEETS_WHY, SHEETS_CONNECTING
+    if not SHEETS_CONFIGURED:
+        return
+    for attempt in range(1, SHEETS_CONNECT_RETRIES + 1):
+        try:
+            handle = await asyncio.to_thread(_open_worksheet)
+        except Exception as e:
+            SHEETS_WHY = str(e)
+            if attempt == SHEETS_CONNECT_RETRIES:
+                SHEETS_CONNECTING = False
+                print("⚠️ Sheets disabled:", e)
+                return
+            delay = min(300, 2 ** attempt)
+            print(f"⚠️ Sheets connect failed (attempt {attempt}/{SHEETS_CONNECT_RETRIES}), retry in {delay}s: {e}")
+            await asyncio.sleep(delay)
+            continue
+        ws = handle
+        SHEETS_OK, SHEETS_WHY, SHEETS_CONNECTING = True, "", False
+        mark_startup("sheets_connected")
+        print(f"✅ Google Sheets connected as {SERVICE_EMAIL} → sheet:{SHEET_ID} tab:{WORKSHEET}")
+        sheets_ready.set()
+        storage.kick()
+        return
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Sheets API erişim katmanı: kota, backoff, circuit breaker
+SHEETS_READS_PER_MIN   = float(os.getenv("SHEETS_READS_PER_MIN", "60"))    # Google: 60/dk/kullanıcı
+SHEETS_WRITES_PER_MIN  = float(os.getenv("SHEETS_WRITES_PER_MIN", "60"))
+SHEETS_MAX_RETRIES     = int(os.getenv("SHEETS_MAX_RETRIES", "5"))
+SHEETS_BREAKER_FAILS   = int(os.getenv("SHEETS_BREAKER_FAILS", "5"))       # art arda hata → devre açılır
+SHEETS_BREAKER_COOLDOWN = float(os.getenv("SHEETS_BREAKER_COOLDOWN", "60"))
+
+class CircuitOpen(RuntimeError):
+    pass
+
+class SheetsClient:
+    """Her `ws` çağrısı buradan geçer. Okuma/yazma için ayrı token bucket (proje kotası),
+    429/5xx/ağ hatalarında jitter'lı exponential backoff, art arda hatalarda circuit breaker:
+    açıkken API'ye hiç gidilmez; cooldown sonrası tek bir deneme (half-open) ile yoklanır."""
+
+    def __init__(self):
+        self.buckets = {
+            "read":  TokenBucket(SHEETS_READS_PER_MIN / 60, max(1.0, SHEETS_READS_PER_MIN / 6)),
+            "write": TokenBucket(SHEETS_WRITES_PER_MIN / 60, max(1.0, SHEETS_WRITES_PER_MIN / 6)),
+        }
+        self.state = "closed"            # closed | open | half_open
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.cooldown = SHEETS_BREAKER_COOLDOWN
+        self._probe = asyncio.Lock()
+        self._calls: deque[float] = deque()
+        self._errors: deque[tuple[float, str]] = deque()
+        self.last_error = ""
+
+    @staticmethod
+    def _status(err: Exception) -> int | None:
+        resp = getattr(err, "response", None)
+        return getattr(resp, "status_code", None) or getattr(err, "code", None)
+
+    def _transient(self, err: Exception) -> bool:
+        status = self._status(err)
+        if isinstance(status, int):
+            return status == 429 or status >= 500
+        return isinstance(err, (OSError, TimeoutError))
+
+    def _record(self, deq: deque, item, horizon: float = 300.0):
+        now = time.monotonic()
+        deq.append(item)
+        while deq and (deq[0] if isinstance(deq[0], float) else deq[0][0]) < now - horizon:
+            deq.popleft()
+
+    def _check_breaker(self):
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.cooldown:
+                raise CircuitOpen(f"Sheets circuit open ({self.last_error})")
+            self.state = "half_open"
+
+    def _on_success(self):
+        if self.state != "closed":
+            print("[Sheets] Circuit closed")
+            log_event("✅ Google Sheets reachable again; replication resumed.")
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.cooldown = SHEETS_BREAKER_COOLDOWN
+
+    def _on_failure(self, err: Exception):
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= SHEETS_BREAKER_FAILS:
+            if self.state == "half_open":
+                self.cooldown = min(600.0, self.cooldown * 2)
+            if self.state != "open":
+                print(f"[Sheets] Circuit open for {self.cooldown:.0f}s: {err}")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    async def call(self, kind: str, fn, *args, **kwargs):
+        """`fn(*args, **kwargs)`'ı thread'de çalıştır. kind: "read" | "write"."""
+        self._check_breaker()
+        async with contextlib.AsyncExitStack() as stack:
+            if self.state == "half_open":
+                await stack.enter_async_context(self._probe)   # tek probe
+                self._check_breaker()
+            for attempt in range(SHEETS_MAX_RETRIES + 1):
+                await self.buckets[kind].acquire()
+                self._record(self._calls, time.monotonic())
+                try:
+                    result = await asyncio.to_thread(fn, *args, **kwargs)
+                except Exception as e:
+                    self.last_error = str(e)[:200]
+                    self._record(self._errors, (time.monotonic(), str(self._status(e) or type(e).__name__)))
+                    # 5xx/timeout'ta yazma sunucuda işlenmiş olabilir: yazmalarda yalnız 429 tekrarlanır,
+                    # gerisini writer G sütununu yeniden okuyarak (duplicate'siz) kendisi dener.
+                    if not self._transient(e) or (kind == "write" and self._status(e) != 429):
+                        if self._transient(e):
+                            self._on_failure(e)
+                        raise
+                    if self.state == "half_open" or attempt == SHEETS_MAX_RETRIES:
+                        self._on_failure(e)
+                        raise
+                    if self._status(e) == 429:
+                        self.buckets[kind].tokens = 0   # kota doldu: bucket'ı da boşalt
+                    # full jitter: [0, min(64, 2^n)) saniye
+                    await asyncio.sleep(random.uniform(0, min(64.0, 2.0 ** (attempt + 1))))
+                    continue
+                self._on_success()
+                return result
+
+    def describe(self) -> str:
+        now = time.monotonic()
+        calls_1m = sum(1 for t in self._calls if t >= now - 60)
+        errs = [code for t, code in self._errors if t >= now - 300]
+        calls_5m = len(self._calls)
+        rate = f"{len(errs) / calls_5m:.0%}" if calls_5m else "-"
+        by_code: dict[str, int] = {}
+        for code in errs:
+            by_code[code] = by_code.get(code, 0) + 1
+        state = {"closed": "🟢 closed", "open": "🔴 open", "half_open": "🟡 half-open"}[self.state]
+        out = (
+            f"Breaker: **{state}** (consecutive failures `{self.consecutive_failures}`)\n"
+            f"Quota left: read `{self.buckets['read'].available():.0f}` / write "
+            f"`{self.buckets['write'].available():.0f}` tokens "
+            f"({SHEETS_READS_PER_MIN:g} / {SHEETS_WRITES_PER_MIN:g} per min)\n"
+            f"Calls: `{calls_1m}` last min · errors last 5 min: `{len(errs)}` ({rate})"
+        )
+        if by_code:
+            out += " · " + ", ".join(f"`{k}`×{v}" for k, v in sorted(by_code.items()))
+        if self.state == "open":
+            left = max(0.0, self.cooldown - (now - self.opened_at))
+            out += f"\nNext probe in `{left:.0f}s`"
+        return out + "\n"
+
+sheets_api = SheetsClient()
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Registration storage: SQLite journal (birincil) → replikalar (Sheets, JSONL)
+JOURNAL_PATH          = os.getenv("JOURNAL_PATH", "data/registrations.db")
+JOURNAL_COMMIT_DELAY  = float(os.getenv("JOURNAL_COMMIT_DELAY", "0.005"))   # sn; canlı yazımlar bu pencerede tek commit
+JOURNAL_COMMIT_MAX    = 256                                                 # bu kadar satırda beklemeden commit
+SHEETS_BATCH_SIZE     = max(1, int(os.getenv("SHEETS_BATCH_SIZE", "100")))
+SHEETS_FLUSH_INTERVAL = float(os.getenv("SHEETS_FLUSH_INTERVAL", "2.0"))
+SHEETS_MAX_BATCH      = max(1, int(os.getenv("SHEETS_MAX_BATCH", "5000")))   # toplu import flush'ı
+
+class StorageBackend:
+    """Kayıt deposu arayüzü. Satır biçimi (Sheets sütunlarıyla aynı):
+    [guild_name, user_id, display, player_id, ts, source, seq]
+
+    Her sunucunun kayıtları ayrı bir bölümdedir (Sheets: sunucunun worksheet'i, SQLite/JSONL:
+    guild_id alanı); yazımlar (guild_id, row) çiftleriyle gelir, okumalar guild_id ile süzülür.
+    `external` depolar bot dışından da düzenlenebilir (ör. elle eklenen Sheets satırları);
+    registration index ve reconcile bu depodan okur."""
+
+    name = ""
+    label = ""
+    external = False
+
+    @property
+    def ready(self) -> bool:
+        return True
+
+    async def wait_ready(self):
+        return
+
+    async def append(self, batch: list[tuple[int, list[str]]]):
+        raise NotImplementedError
+
+    async def read_all(self, guild_id: int | None = None) -> list[list[str]]:
+        raise NotImplementedError
+
+    async def read_from(self, start: int, guild_id: int | None = None) -> list[list[str]]:
+        """1'den sayılan `start` satırından sonuna kadar (artımlı okuma)."""
+        return (await self.read_all(guild_id))[start - 1:]
+
+    async def max_seq(self) -> int:
+        """Depodaki en büyük journal seq'i (crash sonrası replikasyon mark'ını doğrulamak için)."""
+        return max((int(r[6]) for r in await self.read_all() if len(r) >= 7 and r[6].isdigit()), default=0)
+
+    async def lookup(self, player_id: str | None = None, user_id: int | None = None,
+                     guild_id: int | None = None) -> list[list[str]]:
+        return [
+            r for r in await self.read_all(guild_id)
+            if len(r) >= 4 and (r[3] == player_id or (user_id is not None and r[1] == str(user_id)))
+        ]
+
+    def describe(self) -> str:
+        return ""
+
+class Journal(StorageBackend):
+    """Append-only yerel kayıt defteri (SQLite/WAL, user_id ve player_id index'li).
+    Her başarılı doğrulama önce buraya yazılır; replikalar bu tablodan high-water mark
+    ile replay edilir. Toplu yazımlar tek transaction'dır (append_many).
+
+    Canlı doğrulamalar group commit ile yazılır: append_one satırı açık transaction'a ekler,
+    commit JOURNAL_COMMIT_DELAY sonra (ya da JOURNAL_COMMIT_MAX satırda) tek seferde yapılır.
+    Çağıran `await durable()` ile commit'i bekler; replikasyon ve kendi transaction'ını açan
+    yazımlar önce commit() çağırır, böylece commit edilmemiş satır dışarı gitmez."""
+
+    name = "sqlite"
+    label = "SQLite journal"
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")  # WAL + NORMAL: process crash'inde kayıp yok
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS registrations (
+                   seq        INTEGER PRIMARY KEY AUTOINCREMENT,
+                   guild_id   INTEGER NOT NULL,
+                   guild_name TEXT    NOT NULL,
+                   user_id    TEXT    NOT NULL,
+                   display    TEXT    NOT NULL,
+                   player_id  TEXT    NOT NULL,
+                   ts         TEXT    NOT NULL,
+                   source     TEXT    NOT NULL
+               )"""
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS registrations_user ON registrations (user_id)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS registrations_player ON registrations (player_id)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS registrations_guild ON registrations (guild_id, seq)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.commit_delay = JOURNAL_COMMIT_DELAY
+        self._uncommitted = 0
+        self._commit_handle: asyncio.TimerHandle | None = None
+        self._durable: asyncio.Future | None = None
+        self.commits = 0
+        self.group_rows = 0
+
+    def commit(self):
+        """Bekleyen canlı yazımları tek commit'le kalıcı yap ve durable() bekleyenleri uyandır."""
+        if self._commit_handle is not None:
+            self._commit_handle.cancel()
+            self._commit_handle = None
+        waiters, self._durable = self._durable, None
+        err = None
+        if self.db.in_transaction:
+            try:
+                self.db.execute("COMMIT")
+                self.commits += 1
+                self.group_rows += self._uncommitted
+            except Exception as e:
+                err = e
+                self.db.execute("ROLLBACK")
+                print(f"[Journal] Commit failed, {self._uncommitted} row(s) rolled back: {e}")
+        self._uncommitted = 0
+        if waiters is not None and not waiters.done():
+            if err is None:
+                waiters.set_result(None)
+            else:
+                waiters.set_exception(err)
+                waiters.exception()   # bekleyen yoksa "never retrieved" uyarısı çıkmasın
+
+    async def durable(self):
+        """Bu ana kadar append_one ile yazılan satırlar commit edilene kadar bekle."""
+        if not self._uncommitted:
+            return
+        if self._durable is None:
+            self._durable = asyncio.get_running_loop().create_future()
+        await asyncio.shield(self._durable)
+
+    async def append(self, batch: list[tuple[int, list[str]]]):
+        """StorageBackend arayüzü: (guild_id, row) çiftleri tek transaction'da (varsa seq sütunu atlanır)."""
+        self.commit()
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.executemany(
+                "INSERT INTO registrations (guild_id, guild_name, user_id, display, player_id, ts, source) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(gid, *row[:6]) for gid, row in batch],
+            )
+
+    def append_one(self, guild_id: int, row: list) -> int:
+        """row = [guild_name, user_id, display, player_id, ts, source] → seq (group commit; bkz. durable)"""
+        if not self.db.in_transaction:
+            self.db.execute("BEGIN")
+        cur = self.db.execute(
+            "INSERT INTO registrations (guild_id, guild_name, user_id, display, player_id, ts, source) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (guild_id, *row),
+        )
+        self._uncommitted += 1
+        if self._uncommitted >= JOURNAL_COMMIT_MAX:
+            self.commit()
+        elif self._commit_handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self.commit()    # loop dışı (script): hemen
+            else:
+                self._commit_handle = loop.call_later(self.commit_delay, self.commit)
+        return cur.lastrowid
+
+    def append_many(self, guild_id: int, rows: list[list]) -> int:
+        """Tek transaction'da çok satır; son seq'i döndürür."""
+        self.commit()
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.executemany(
+                "INSERT INTO registrations (guild_id, guild_name, user_id, display, player_id, ts, source) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(guild_id, *row) for row in rows],
+            )
+        return self.last_seq()
+
+    def after(self, seq: int, limit: int, guild_id: int | None = None) -> list[tuple[int, list]]:
+        if guild_id is None:
+            cur = self.db.execute(
+                "SELECT seq, guild_name, user_id, display, player_id, ts, source "
+                "FROM registrations WHERE seq > ? ORDER BY seq LIMIT ?",
+                (seq, limit),
+            )
+        else:
+            cur = self.db.execute(
+                "SELECT seq, guild_name, user_id, display, player_id, ts, source "
+                "FROM registrations WHERE guild_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (guild_id, seq, limit),
+            )
+        return [(r[0], list(r[1:])) for r in cur]
+
+    def routed_after(self, seq: int, limit: int) -> list[tuple[int, int, list]]:
+        """Replikasyon için: (seq, guild_id, row); replika satırı sunucusunun bölümüne yazar."""
+        cur = self.db.execute(
+            "SELECT seq, guild_id, guild_name, user_id, display, player_id, ts, source "
+            "FROM registrations WHERE seq > ? ORDER BY seq LIMIT ?",
+            (seq, limit),
+        )
+        return [(r[0], r[1], list(r[2:])) for r in cur]
+
+    async def read_all(self, guild_id: int | None = None) -> list[list[str]]:
+        return [row + [str(seq)] for seq, row in self.after(0, -1, guild_id)]
+
+    async def max_seq(self) -> int:
+        return self.last_seq()
+
+    async def lookup(self, player_id: str | None = None, user_id: int | None = None,
+                     guild_id: int | None = None) -> list[list[str]]:
+        cur = self.db.execute(
+            "SELECT guild_name, user_id, display, player_id, ts, source, seq "
+            "FROM registrations WHERE (player_id = ? OR user_id = ?) AND (? IS NULL OR guild_id = ?) "
+            "ORDER BY seq",
+            (player_id or "", str(user_id) if user_id is not None else "", guild_id, guild_id),
+        )
+        return [[*r[:6], str(r[6])] for r in cur]
+
+    def count_after(self, seq: int) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM registrations WHERE seq > ?", (seq,)).fetchone()[0]
+
+    def last_seq(self) -> int:
+        return self.db.execute("SELECT COALESCE(MAX(seq), 0) FROM registrations").fetchone()[0]
+
+    def get_mark(self, key: str) -> int:
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return int(row[0]) if row else 0
+
+    def set_mark(self, key: str, value: int):
+        self.db.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, str(value)),
+        )
+
+    def describe(self) -> str:
+        rows = self.group_rows / self.commits if self.commits else 0
+        return f"`{self.path}` (last seq `{self.last_seq()}`, live commits `{self.commits}` · `{rows:.1f}` rows/commit)"
+
+    def close(self):
+        try:
+            self.commit()
+            self.db.close()
+        except Exception:
+            pass
+
+journal = Journal(JOURNAL_PATH)
+
+class SheetsBackend(StorageBackend):
+    """Google Sheets: her sunucu kendi worksheet'ine yazılır (GuildConfig.worksheet; tek sunuculu
+    kurulumda WORKSHEET). Tüm çağrılar kota/breaker katmanından (sheets_api) geçer."""
+
+    name = "sheets"
+    label = "Sheet"
+    external = True
+
+    def __init__(self):
+        self._tabs: dict[str, object] = {}
+
+    @property
+    def ready(self) -> bool:
+        return ws is not None
+
+    async def wait_ready(self):
+        await sheets_ready.wait()
+
+    @staticmethod
+    def title_for(guild_id: int | None) -> str:
+        cfg = guild_configs.get(guild_id)
+        return cfg.worksheet if cfg else WORKSHEET
+
+    async def _tab(self, title: str, create: bool = True):
+        if title == WORKSHEET or sheets_book is None:
+            return ws
+        tab = self._tabs.get(title)
+        if tab is None:
+            tab = await sheets_api.call("read", _open_tab, title, create)
+            if tab is not None:
+                self._tabs[title] = tab
+        return tab
+
+    async def append(self, batch: list[tuple[int, list[str]]]):
+        # Ardışık aynı-worksheet satırları tek append_rows; sıra seq sırası olarak kalır,
+        # böylece herhangi bir worksheet'teki en büyük seq'ten öncekilerin hepsi yazılmıştır.
+        i = 0
+        while i < len(batch):
+            title = self.title_for(batch[i][0])
+            j = i
+            while j < len(batch) and self.title_for(batch[j][0]) == title:
+                j += 1
+            tab = await self._tab(title)
+            await sheets_api.call("write", tab.append_rows, [row for _, row in batch[i:j]], value_input_option="RAW")
+            i = j
+
+    async def read_all(self, guild_id: int | None = None) -> list[list[str]]:
+        tab = await self._tab(self.title_for(guild_id))
+        return await sheets_api.call("read", tab.get_all_values)
+
+    async def read_from(self, start: int, guild_id: int | None = None) -> list[list[str]]:
+        tab = await self._tab(self.title_for(guild_id))
+        try:
+            return await sheets_api.call("read", tab.get, f"A{start}:G")
+        except Exception as e:
+            if "exceeds grid limits" not in str(e):
+                raise
+            return []   # grid'in sonundayız; yeni satır yok
+
+    async def max_seq(self) -> int:
+        top = 0
+        for title in {WORKSHEET, *(c.worksheet for c in guild_configs.all())}:
+            tab = await self._tab(title, create=False)
+            if tab is not None:
+                col = await sheets_api.call("read", tab.col_values, 7)
+                top = max(top, max((int(v) for v in col if v.isdigit()), default=0))
+        return top
+
+    def describe(self) -> str:
+        return f"sheet `{SHEET_ID or '-'}` tab `{WORKSHEET}` (+{len(self._tabs)} guild tabs open)"
+
+class JsonlBackend(StorageBackend):
+    """Append-only JSON Lines dosyası (satır başına bir kayıt). Yazımlar thread'de, fsync'li."""
+
+    name = "jsonl"
+    label = "JSONL"
+    FIELDS = ("guild", "user_id", "display", "player_id", "ts", "source", "seq")
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def _write(self, batch: list[tuple[int, list[str]]]):
+        data = "".join(
+            json.dumps({"guild_id": gid, **dict(zip(self.FIELDS, r))}, ensure_ascii=False) + "\n"
+            for gid, r in batch
+        )
+        with open(self.path, "a+b") as f:
+            if f.tell():
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    data = "\n" + data   # crash'te yarım kalmış satırı kapat
+            f.write(data.encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _read(self, guild_id: int | None) -> list[list[str]]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return []
+        out = []
+        for line in lines:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue   # yarım yazılmış son satır (crash)
+            if guild_id is None or rec.get("guild_id") == guild_id:
+                out.append([str(rec.get(k, "")) for k in self.FIELDS])
+        return out
+
+    def _last_seq(self) -> int:
+        # Dosyanın sonundan geriye doğru ilk geçerli satır; tüm dosyayı okumaya gerek yok
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                tail = b""
+                pos = f.tell()
+                while pos > 0:
+                    step = min(4096, pos)
+                    pos -= step
+                    f.seek(pos)
+                    tail = f.read(step) + tail
+                    for line in reversed(tail.splitlines()[1 if pos else 0:]):
+                        try:
+                            return int(json.loads(line)["seq"])
+                        except (ValueError, KeyError, TypeError):
+                            continue
+        except FileNotFoundError:
+            pass
+        return 0
+
+    async def append(self, batch: list[tuple[int, list[str]]]):
+        await asyncio.to_thread(self._write, batch)
+
+    async def read_all(self, guild_id: int | None = None) -> list[list[str]]:
+        return await asyncio.to_thread(self._read, guild_id)
+
+    async def max_seq(self) -> int:
+        return await asyncio.to_thread(self._last_seq)
+
+    def describe(self) -> str:
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        return f"`{self.path}` ({size / 1024:.0f} KB)"
+
+class Replicator:
+    """Bir replika deposunun tek yazıcısı. Journal'da high-water mark'tan sonraki satırları
+    her flush penceresinde tek bir `append` çağrısıyla yazar.
+
+    Her satırın sonunda journal seq'i gider; açılışta depodaki en büyük seq mark'tan
+    ilerideyse (yazma başarılı olup mark kaydedilemeden çökmüş) mark ileri alınır,
+    böylece aynı satır iki kez gönderilmez."""
+
+    def __init__(self, backend: StorageBackend, batch_size: int, flush_interval: float):
+        self.backend = backend
+        self.MARK = f"{backend.name}_hwm"
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+        self._held = 0
+        self._synced = False
+        self.hwm = journal.get_mark(self.MARK)
+
+        self.rows_written = 0
+        self.flushes = 0
+        self.last_flush_rows = 0
+        self.last_flush_latency: float | None = None
+        self.last_flush_at: datetime | None = None
+        self.last_error = ""
+
+    @property
+    def depth(self) -> int:
+        return journal.count_after(self.hwm)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def kick(self):
+        self._wake.set()
+
+    def notify(self):
+        """Yeni satır journal'a yazıldı; backlog bir batch'i doldurduysa hemen flush et."""
+        if not self._held and journal.last_seq() - self.hwm >= self.batch_size:
+            self._wake.set()
+
+    @contextlib.contextmanager
+    def hold(self):
+        """Toplu işlemler sırasında periyodik flush'ı durdur; sonunda büyük batch'lerle yazılır."""
+        self._held += 1
+        try:
+            yield
+        finally:
+            self._held -= 1
+
+    async def _run(self):
+        failures = 0
+        while True:
+            delay = self.flush_interval if not failures else min(60.0, self.flush_interval * 2 ** failures)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if not self.backend.ready or self._held:
+                continue
+            try:
+                await self.flush()
+                if failures:
+                    print(f"[{self.backend.label}] Replication recovered")
+                failures = 0
+            except Exception as e:
+                failures += 1
+                self.last_error = str(e)
+                self._synced = False    # yazma yarım kalmış olabilir; sonraki flush mark'ı depodan doğrular
+                M_FAILURES.inc(self.backend.name)
+                if not isinstance(e, CircuitOpen):
+                    print(f"[{self.backend.label}] append failed (attempt {failures}): {e}")
+                if failures == 1:
+                    self._report_failure(e)
+
+    async def backfill(self, batch: list[tuple[int, list]]):
+        """Depodan kaybolmuş (seq ≤ hwm) journal satırlarını yeniden yaz; flush ile aynı kilit."""
+        async with self._lock:
+            for i in range(0, len(batch), SHEETS_MAX_BATCH):
+                await self.backend.append(batch[i:i + SHEETS_MAX_BATCH])
+
+    def observe_seq(self, top: int):
+        """Index yüklemesi bir sunucunun seq sütununu okudu: mark'ı ileri al. _synced değişmez —
+        diğer sunucuların tab'larında daha ileri bir seq olabilir; onu yalnız max_seq (tüm tab'lar) görür."""
+        if top > self.hwm:
+            self.hwm = top
+            journal.set_mark(self.MARK, self.hwm)
+
+    async def _sync_mark(self):
+        """Crash sonrası: depodaki en büyük seq mark'tan büyükse mark'ı ileri al."""
+        top = await self.backend.max_seq()
+        if top > self.hwm:
+            self.hwm = top
+            journal.set_mark(self.MARK, self.hwm)
+        self._synced = True
+
+    async def flush(self, limit: int | None = None):
+        """Backlog'u `limit` (varsayılan batch_size) satırlık append çağrılarıyla yaz."""
+        async with self._lock:
+            if not self._synced:
+                await self._sync_mark()
+            while True:
+                journal.commit()   # commit edilmemiş (crash'te kaybolabilecek) satır replikaya gitmesin
+                pending = journal.routed_after(self.hwm, limit or self.batch_size)
+                if not pending:
+                    return
+                batch = [(gid, row + [str(seq)]) for seq, gid, row in pending]
+                t0 = time.perf_counter()
+                await self.backend.append(batch)
+                self.hwm = pending[-1][0]
+                journal.set_mark(self.MARK, self.hwm)
+                self.last_flush_latency = time.perf_counter() - t0
+                M_STORAGE_APPEND.observe(self.last_flush_latency, self.backend.name)
+                self.last_flush_rows = len(batch)
+                self.last_flush_at = datetime.now(timezone.utc)
+                self.rows_written += len(batch)
+                self.flushes += 1
+
+    def _report_failure(self, err: Exception):
+        log_event(
+            f"⚠️ {self.backend.label} write failed: `{err}` — {self.depth} row(s) kept in the local journal, "
+            "will retry automatically.",
+            urgent=True
+        )
+
+    def describe(self) -> str:
+        state = "✅" if self.backend.ready else "⏳"
+        lat = self.last_flush_latency
+        out = (
+            f"{state} **{self.backend.name}** → {self.backend.describe()}\n"
+            f"  synced to `{self.hwm}`, queue depth `{self.depth}` "
+            f"(batch `{self.batch_size}`, every `{self.flush_interval:g}s`)\n"
+            f"  last flush `{self.last_flush_rows}` rows in "
+            f"`{f'{lat * 1000:.0f} ms' if lat is not None else '-'}` · "
+            f"written `{self.rows_written}` rows / `{self.flushes}` flushes\n"
+        )
+        if self.last_error:
+            out += f"  last error: `{self.last_error[:200]}`\n"
+        return out
+
+class Storage:
+    """Fan-out: kayıt önce hızlı birincil depoya (SQLite journal) yazılır, her replika kendi
+    Replicator'ı ve kendi high-water mark'ı ile asenkron olarak yakalar. Bir replikanın
+    yavaşlaması/çökmesi doğrulamayı ve diğer replikaları bekletmez."""
+
+    BACKENDS = {
+        "sheets": lambda: SheetsBackend(),
+        "jsonl":  lambda: JsonlBackend(STORAGE_JSONL_PATH),
+    }
+
+    def __init__(self, primary: Journal, replica_names: list[str], batch_size: int, flush_interval: float):
+        self.primary = primary
+        self.replicas = [
+            Replicator(self.BACKENDS[name](), batch_size, flush_interval) for name in replica_names
+        ]
+        # index/reconcile kaynağı: dışarıdan düzenlenebilen ilk replika (yoksa yalnız journal)
+        self.source = next((r for r in self.replicas if r.backend.external), None)
+
+    def get(self, name: str) -> Replicator | None:
+        return next((r for r in self.replicas if r.backend.name == name), None)
+
+    @property
+    def depth(self) -> int:
+        return max((r.depth for r in self.replicas), default=0)
+
+    def start(self):
+        for r in self.replicas:
+            r.start()
+
+    def kick(self):
+        for r in self.replicas:
+            r.kick()
+
+    def notify(self):
+        for r in self.replicas:
+            r.notify()
+
+    @contextlib.contextmanager
+    def hold(self):
+        with contextlib.ExitStack() as stack:
+            for r in self.replicas:
+                stack.enter_context(r.hold())
+            yield
+
+    async def flush(self, limit: int | None = None):
+        """Hazır replikaları paralel flush et; ilk hatayı yükselt (diğerleri yine de biter)."""
+        ready = [r for r in self.replicas if r.backend.ready]
+        results = await asyncio.gather(*(r.flush(limit) for r in ready), return_exceptions=True)
+        for r, res in zip(ready, results):
+            if isinstance(res, Exception):
+                raise RuntimeError(f"{r.backend.name}: {res}")
+
+    def describe(self) -> str:
+        out = f"Primary: **sqlite** → {self.primary.describe()}\n"
+        if not self.replicas:
+            return out + "Replicas: none (local only)\n"
+        return out + "".join(r.describe() for r in self.replicas)
+
+storage = Storage(journal, STORAGE_REPLICAS, SHEETS_BATCH_SIZE, SHEETS_FLUSH_INTERVAL)
+
+INDEX_REFRESH_INTERVAL = float(os.getenv("INDEX_REFRESH_INTERVAL", "300"))
+TEST_SOURCE = "test"   # /sheets_test satırları: yazım testi, kayıt değil
+
+def is_test_row(row: list) -> bool:
+    return len(row) > 5 and row[5] == TEST_SOURCE
+
+class RegistrationIndex:
+    """player_id → user_id ve user_id → player_id hash index'leri.
+    Açılışta worksheet tek bir bulk read ile yüklenir; sonra periyodik olarak yalnızca
+    bilinen satır sayısından sonraki satırlar okunur. Yazılan satırlar anında eklenir.
+    /lookup autocomplete'i için player ID'lerin ve (casefold) display name'lerin sıralı
+    listeleri de tutulur: prefix araması bisect ile, Sheets API'ye gitmeden yapılır."""
+
+    def __init__(self, guild_id: int, refresh_interval: float):
+        self.guild_id = guild_id
+        self.refresh_interval = refresh_interval
+        self.by_player: dict[str, int] = {}
+        self.by_user: dict[int, str] = {}
+        self.names: dict[int, str] = {}     # user_id → son bilinen display name
+        self._sorted_players: list[str] = []
+        self._sorted_names: list[tuple[str, int]] = []
+        self._dirty = False
+        self.sheet_rows = 0          # worksheet'te okunmuş satır sayısı (header dahil)
+        self.loaded = False
+        self.last_refresh_at: datetime | None = None
+        self.last_error = ""
+        self._task: asyncio.Task | None = None
+
+    def add(self, user_id: int, player_id: str, name: str = ""):
+        self.by_player.setdefault(player_id, user_id)   # ilk sahip kazanır
+        self.by_user[user_id] = player_id
+        if name:
+            self.names[user_id] = name
+        self._dirty = True
+
+    def _ensure_sorted(self):
+        # Sıralı listeler tembel yeniden kurulur: bulk import/load sırasında her satırda değil,
+        # yalnızca bir arama geldiğinde (100k satırda ~onlarca ms)
+        if self._dirty:
+            self._sorted_players = sorted(self.by_player)
+            self._sorted_names = sorted((n.casefold(), uid) for uid, n in self.names.items())
+            self._dirty = False
+
+    def search(self, query: str, limit: int = 25) -> list[tuple[str, int]]:
+        """(player_id, user_id) eşleşmeleri: player ID prefix'i, tam user ID, display name prefix'i;
+        yer kalırsa display name içinde geçenler."""
+        self._ensure_sorted()
+        q = query.strip()
+        out: dict[str, int] = {}
+
+        def put(pid: str | None, uid: int) -> bool:
+            if pid is not None and pid not in out:
+                out[pid] = uid
+            return len(out) >= limit
+
+        if q.isdigit():
+            if int(q) in self.by_user and put(self.by_user[int(q)], int(q)):
+                return list(out.items())
+            i = bisect.bisect_left(self._sorted_players, q)
+            while i < len(self._sorted_players) and self._sorted_players[i].startswith(q):
+                pid = self._sorted_players[i]
+                if put(pid, self.by_player[pid]):
+                    return list(out.items())
+                i += 1
+        key = q.casefold()
+        if not key:
+            return list(out.items())
+        i = bisect.bisect_left(self._sorted_names, (key, -1))
+        while i < len(self._sorted_names) and self._sorted_names[i][0].startswith(key):
+            uid = self._sorted_names[i][1]
+            if put(self.by_user.get(uid), uid):
+                return list(out.items())
+            i += 1
+        if len(key) >= 3:
+            for name, uid in self._sorted_names:
+                if key in name and put(self.by_user.get(uid), uid):
+                    break
+        return list(out.items())
+
+    def owner_of(self, player_id: str) -> int | None:
+        return self.by_player.get(player_id)
+
+    def player_of(self, user_id: int) -> str | None:
+        return self.by_user.get(user_id)
+
+    def conflict(self, user_id: int, player_id: str) -> int | None:
+        """Player ID başka bir kullanıcıya aitse o kullanıcının ID'si."""
+        owner = self.by_player.get(player_id)
+        return owner if owner is not None and owner != user_id else None
+
+    def _ingest(self, rows: list[list[str]]) -> int:
+        top = 0
+        for r in rows:
+            if len(r) >= 7 and r[6].isdigit():
+                top = max(top, int(r[6]))
+            if len(r) < 4 or not r[1].isdigit() or not r[3] or is_test_row(r):
+                continue   # header / boş satır / /sheets_test
+            self.add(int(r[1]), r[3], r[2])
+        return top
+
+    def load_journal(self):
+        for _seq, row in journal.after(0, -1, guild_id=self.guild_id):
+            if not is_test_row(row):
+                self.add(int(row[1]), row[3], row[2])
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        src = storage.source
+        if src is None:
+            self.loaded = True     # yalnız yerel depolar: journal'dan zaten yüklendi
+            return
+        await src.backend.wait_ready()
+        while True:
+            try:
+                await (self.refresh() if self.loaded else self.load())
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"[Index] Refresh failed: {e}")
+            await asyncio.sleep(self.refresh_interval if self.loaded else 30)
+
+    async def load(self):
+        """Sunucunun bölümünü (Sheets: kendi worksheet'i) tek bulk read ile yükle."""
+        values = await storage.source.backend.read_all(self.guild_id)
+        top = self._ingest(values)
+        self.sheet_rows = len(values)
+        storage.source.observe_seq(top)
+        if LEAN_MEMBER_CACHE:
+            verified_set(self.guild_id).update(self.by_user)
+        self.loaded = True
+        self.last_refresh_at = datetime.now(timezone.utc)
+        print(f"[Index] Guild {self.guild_id}: loaded {len(self.by_player)} player IDs from {self.sheet_rows} sheet rows")
+
+    async def refresh(self):
+        """Yalnızca son bilinen satırdan sonrasını oku (başkalarının elle eklediği satırlar dahil)."""
+        values = await storage.source.backend.read_from(self.sheet_rows + 1, self.guild_id)
+        self._ingest(values)
+        self.sheet_rows += len(values)
+        self.last_refresh_at = datetime.now(timezone.utc)
+
+class IndexRegistry:
+    """guild_id → RegistrationIndex. Index ilk erişimde journal'dan kurulur; start() sonrası
+    oluşturulanların yenileme döngüsü hemen başlar."""
+
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self._indexes: dict[int, RegistrationIndex] = {}
+        self._started = False
+
+    def __getitem__(self, guild_id: int) -> RegistrationIndex:
+        idx = self._indexes.get(guild_id)
+        if idx is None:
+            idx = self._indexes[guild_id] = RegistrationIndex(guild_id, self.refresh_interval)
+            idx.load_journal()
+            if self._started:
+                idx.start()
+        return idx
+
+    def values(self) -> list[RegistrationIndex]:
+        return list(self._indexes.values())
+
+    def start(self):
+        self._started = True
+        for idx in self._indexes.values():
+            idx.start()
+
+indexes = IndexRegistry(INDEX_REFRESH_INTERVAL)
+
+def build_row(guild: discord.Guild, user: discord.abc.User, player_id: str, source: str) -> list:
+    """Order: Guild Name, User ID, Display Name, Player ID, Timestamp(UTC), Source
+    (Sheets'e ek olarak 7. sütunda Journal Seq yazılır.)"""
+    ts = datetime.now(timezone.utc).isoformat()
+    display = (
+        getattr(user, "global_name", None)
+        or getattr(user, "display_name", None)
+        or user.name
+    )
+    row = [
+        guild.name,      # Guild Name
+        str(user.id),    # User ID
+        display,         # Display Name
+        player_id,       # Player ID
+        ts,              # Timestamp (UTC)
+        source,          # panel | auto | manual | bulk | test
+    ]
+    return row
+
+def sheet_append_row(guild: discord.Guild, user: discord.abc.User, player_id: str, source: str):
+    """Satır önce yerel journal'a yazılır; replikalara (Sheets, JSONL) Replicator'lar replay eder."""
+    row = build_row(guild, user, player_id, source)
+    seq = journal.append_one(guild.id, row)
+    if source != TEST_SOURCE:
+        indexes[guild.id].add(user.id, player_id, row[2])
+    storage.notify()
+    return seq
+
+async def report_conflict(guild: discord.Guild, member: discord.abc.User, player_id: str, owner_id: int):
+    log_event(f"⛔ {member.mention} tried Player ID `{player_id}`, already registered to <@{owner_id}>.", guild=guild)
+
+# Aşama havuzları: silme, rol ve DM ayrı ayrı sınırlanır; kayıt (journal) yereldir
+delete_pool = asyncio.Semaphore(PIPELINE_DELETE_WORKERS)
+role_pool   = asyncio.Semaphore(PIPELINE_ROLE_WORKERS)
+dm_pool     = asyncio.Semaphore(PIPELINE_DM_WORKERS)
+member_locks = KeyedLock()
+
+# Verified kullanıcılar (sunucu başına): rol kontrolleri bu kümeden okunur (LEAN_MEMBER_CACHE'te
+# member cache yok). Kaynaklar: role.members / registration index (açılış), payload'daki roller,
+# kendi rol işlemlerimiz ve member_update event'leri.
+verified_users: dict[int, CompactIdSet] = {}
+
+def verified_set(guild_id: int) -> CompactIdSet:
+    ids = verified_users.get(guild_id)
+    if ids is None:
+        ids = verified_users[guild_id] = CompactIdSet()
+    return ids
+
+# Yeni verify olanlar; payload'daki roller gateway event'i gelene kadar eski kalabilir
+_just_verified: dict[tuple[int, int], float] = {}
+JUST_VERIFIED_TTL = 120.0
+
+def recently_verified(guild_id: int, user_id: int) -> bool:
+    t = _just_verified.get((guild_id, user_id))
+    return t is not None and time.monotonic() - t < JUST_VERIFIED_TTL
+
+def mark_verified(guild_id: int, user_id: int):
+    now = time.monotonic()
+    _just_verified[(guild_id, user_id)] = now
+    verified_set(guild_id).add(user_id)
+    if len(_just_verified) > 1000:
+        for key in [k for k, t in _just_verified.items() if now - t >= JUST_VERIFIED_TTL]:
+            del _just_verified[key]
+
+def mark_unverified(guild_id: int, user_id: int):
+    _just_verified.pop((guild_id, user_id), None)
+    verified_set(guild_id).discard(user_id)
+
+def is_verified(member: discord.Member) -> bool:
+    """Interaction/mesaj payload'ındaki roller günceldir: rol varsa kümeye ekle, yoksa
+    (ve rolü az önce biz vermediysek) çıkar; sonra kümeden cevap ver."""
+    cfg = guild_cfg(member.guild)
+    ids = verified_set(member.guild.id)
+    if cfg and cfg.verified_role_id:
+        if member.get_role(cfg.verified_role_id) is not None:
+            ids.add(member.id)
+        elif not recently_verified(member.guild.id, member.id):
+            ids.discard(member.id)
+    return member.id in ids
+
+def seed_verified_users():
+    """Tam cache'te rolün üyelerinden; lean modda registration index'ten."""
+    for guild in client.guilds:
+        cfg = guild_cfg(guild)
+        if cfg is None:
+            continue
+        ids = verified_set(guild.id)
+        if LEAN_MEMBER_CACHE:
+            ids.update(indexes[guild.id].by_user)
+        else:
+            vrole = guild.get_role(cfg.verified_role_id)
+            if vrole:
+                ids.update(m.id for m in vrole.members)
+        ids.compact()
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+RSS_AT_IMPORT = _rss_bytes()
+RSS_AT_READY = 0
+
+def memory_report() -> str:
+    cached = sum(len(g.members) for g in client.guilds)
+    total = sum((g.member_count or 0) for g in client.guilds)
+    rss = _rss_bytes()
+    return (
+        f"Mode: `{'lean' if LEAN_MEMBER_CACHE else 'full'}` member cache\n"
+        f"Cached members: `{cached}` of `{total}`\n"
+        f"Verified sets: `{sum(len(v) for v in verified_users.values())}` IDs in "
+        f"`{sum(v.nbytes() for v in verified_users.values()) / 1024:.0f} KB` ({len(verified_users)} guilds)\n"
+        f"RSS: before login `{RSS_AT_IMPORT / 2**20:.1f} MB` → ready "
+        f"`{RSS_AT_READY / 2**20:.1f} MB` → now `{rss / 2**20:.1f} MB`\n"
+    )
+
+async def _stage_persist(guild: discord.Guild, member: discord.Member, player_id: str, source: str):
+    try:
+        with M_STAGE.time("journal"):
+            sheet_append_row(guild, member, player_id, source)
+            await journal.durable()
+        log_event(f"{member.mention} player id `{player_id}` · source **{source}**", guild=guild)
+    except Exception as e:
+        M_FAILURES.inc("journal")
+        log_event(f"⚠️ Journal write failed for {member.mention}: `{e}`", urgent=True, guild=guild)
+
+async def _stage_dm(member: discord.Member, player_id: str):
+    async with dm_pool:
+        try:
+            emb = discord.Embed(description=DM_OK, color=COLOR_OK)
+            if SHOW_AUTHOR:
+                emb.set_author(name=f"{BRAND} Verify")
+            emb.add_field(name="Player ID", value=f"`{player_id}`", inline=True)
+            with M_STAGE.time("dm"):
+                await member.send(embed=emb)
+        except:
+            M_FAILURES.inc("dm")
+
+async def _stage_delete(message: discord.Message):
+    async with delete_pool:
+        try:
+            with M_STAGE.time("delete"):
+                await message.delete()
+        except:
+            pass
+
+async def apply_success(guild: discord.Guild, member: discord.Member, player_id: str, source: str) -> str:
+    """Rol ve kayıt (journal → Sheets) aşamaları paralel çalışır. Rol role_grants kuyruğundan
+    verilir; DM yalnızca rol verildikten sonra gider. → "granted" | "queued" | "failed"
+    Kayıt zaten index'teyse (rol hâlâ kuyrukta ya da başarısız olmuş bir denemenin tekrarı)
+    ikinci satır yazılmaz; yalnızca rol yeniden istenir."""
+    stages = [role_grants.grant(member, player_id, "Player ID verified", ROLE_GRANT_WAIT)]
+    if indexes[guild.id].player_of(member.id) != player_id:
+        stages.append(_stage_persist(guild, member, player_id, source))
+    granted, *_ = await asyncio.gather(*stages)
+    M_VERIFICATIONS.inc(source)
+    return {True: "granted", None: "queued", False: "failed"}[granted]
+
+VERIFY_RESULT_TTL = float(os.getenv("VERIFY_RESULT_TTL", "120"))
+
+class VerifyOutcome:
+    __slots__ = ("status", "player_id", "owner", "shared", "role")
+
+    def __init__(self, status: str, player_id: str, owner: int | None = None, shared: str = "", role: str = ""):
+        self.status = status        # "verified" | "conflict"
+        self.player_id = player_id
+        self.owner = owner
+        self.shared = shared        # "" (bu çağrı yaptı) | "joined" | "cached"
+        self.role = role            # verified ise: "granted" | "queued" | "failed"
+
+class VerificationGate:
+    """(guild, user) başına tek doğrulama. Aynı anda gelen Confirm/auto/manual istekleri
+    uçuştaki işleme katılır (aynı Future'ı bekler); biten başarılı sonuçlar VERIFY_RESULT_TTL
+    boyunca saklanır, tekrar denemeler API'ye gitmeden anında döner."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._inflight: dict[tuple[int, int], asyncio.Future] = {}
+        self._recent: OrderedDict[tuple[int, int], tuple[float, VerifyOutcome]] = OrderedDict()
+
+    def _cached(self, key: tuple[int, int]) -> VerifyOutcome | None:
+        hit = self._recent.get(key)
+        if hit and hit[0] > time.monotonic():
+            return hit[1]
+        if hit:
+            del self._recent[key]
+        return None
+
+    def pending(self, guild_id: int, user_id: int) -> bool:
+        """Uçuşta ya da yakın zamanda bitmiş bir doğrulama var mı (is_verified'dan önce bakılır)."""
+        key = (guild_id, user_id)
+        return key in self._inflight or self._cached(key) is not None
+
+    def forget(self, guild_id: int, user_id: int):
+        self._recent.pop((guild_id, user_id), None)
+
+    @staticmethod
+    def _role_now(key: tuple[int, int], role: str) -> str:
+        """Saklanan sonuç "queued" ise kuyruk o zamandan beri ilerlemiş olabilir."""
+        if role != "queued" or role_grants.pending(*key):
+            return role
+        return "granted" if key[1] in verified_set(key[0]) else "failed"
+
+    async def run(self, guild: discord.Guild, member: discord.Member, player_id: str, source: str,
+                  apply=None) -> VerifyOutcome:
+        """apply: (guild, member, player_id, source) → rol durumu; varsayılan apply_success
+        (/verify_bulk kendi toplu yazımını verir, böylece aynı kilit ve sonuç önbelleğini paylaşır)."""
+        key = (guild.id, member.id)
+        hit = self._cached(key)
+        if hit:
+            M_VERIFY_DEDUP.inc("cached")
+            return VerifyOutcome(hit.status, hit.player_id, hit.owner, "cached", self._role_now(key, hit.role))
+        fut = self._inflight.get(key)
+        if fut is not None:
+            M_VERIFY_DEDUP.inc("joined")
+            res = await asyncio.shield(fut)
+            return VerifyOutcome(res.status, res.player_id, res.owner, "joined", res.role)
+
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            # Ön kontrol ile buraya gelene kadar Player ID başkasına geçmiş olabilir
+            owner = indexes[guild.id].conflict(member.id, player_id)
+            if owner is not None:
+                res = VerifyOutcome("conflict", player_id, owner)
+            else:
+                role = await (apply or apply_success)(guild, member, player_id, source)
+                res = VerifyOutcome("verified", player_id, role=role)
+                self._recent[key] = (time.monotonic() + self.ttl, res)
+                while len(self._recent) > 10000:
+                    self._recent.popitem(last=False)
+            fut.set_result(res)
+            return res
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            fut.set_exception(e)
+            fut.exception()   # katılan yoksa "never retrieved" uyarısı çıkmasın
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+verification_gate = VerificationGate(VERIFY_RESULT_TTL)
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Role grants (kalıcı kuyruk; Verified rolü verme/alma)
+ROLE_GRANT_RATE      = float(os.getenv("ROLE_GRANT_RATE", "10"))     # rol değişikliği/sn (tüm sunucular)
+ROLE_GRANT_BURST     = float(os.getenv("ROLE_GRANT_BURST", "10"))
+ROLE_GRANT_WAIT      = float(os.getenv("ROLE_GRANT_WAIT", "15"))     # interaction'ın sonucu bekleyeceği süre
+ROLE_GRANT_MAX_TRIES = int(os.getenv("ROLE_GRANT_MAX_TRIES", "8"))
+
+class RoleOp:
+    __slots__ = ("guild_id", "user_id", "add", "player_id", "reason", "tries", "member", "waiters")
+
+    def __init__(self, guild_id: int, user_id: int, add: bool, player_id: str, reason: str,
+                 tries: int = 0, member: discord.Member | None = None):
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.add = add
+        self.player_id = player_id   # grant başarılı olunca DM'de gösterilir ("" → DM yok)
+        self.reason = reason
+        self.tries = tries
+        self.member = member
+        self.waiters: list[asyncio.Future] = []
+
+    @property
+    def key(self) -> tuple[int, int]:
+        return (self.guild_id, self.user_id)
+
+class RoleScheduler:
+    """Verified rolü verme/alma kuyruğu. (guild, user) başına tek bekleyen işlem tutulur; son
+    istek kazanır (ör. /unverify bekleyen grant'i iptal eder). İşlemler journal veritabanındaki
+    role_ops tablosuna yazılır, restart sonrası kaldığı yerden devam edilir.
+
+    Tüm rol değişiklikleri (doğrulama, /unverify, /verify_bulk, /reconcile) buradan geçer. Worker'lar
+    AdaptiveTokenBucket hızında çalışır; 429'da hız yarıya iner ve başarılı işlemlerle yavaşça geri çıkar. 5xx/ağ hataları full-jitter backoff ile en fazla
+    ROLE_GRANT_MAX_TRIES kez denenir; Forbidden/NotFound kalıcıdır. Grant başarılı olunca
+    üye verified sayılır ve (player_id varsa) DM gönderilir."""
+
+    MIN_RATE = 0.2
+
+    def __init__(self, db: sqlite3.Connection, rate: float, burst: float, workers: int, max_tries: int):
+        self.db = db
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS role_ops (
+                   guild_id  INTEGER NOT NULL,
+                   user_id   INTEGER NOT NULL,
+                   op        TEXT    NOT NULL,
+                   player_id TEXT    NOT NULL,
+                   reason    TEXT    NOT NULL,
+                   tries     INTEGER NOT NULL DEFAULT 0,
+                   PRIMARY KEY (guild_id, user_id)
+               )"""
+        )
+        self.bucket = AdaptiveTokenBucket(rate, burst, self.MIN_RATE)
+        self.workers = workers
+        self.max_tries = max_tries
+        self._ops: dict[tuple[int, int], RoleOp] = {}
+        self._ready: deque[RoleOp] = deque()
+        self._busy: set[tuple[int, int]] = set()
+        self._wake = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+        self._restored = False
+
+        self.granted = 0
+        self.revoked = 0
+        self.retried = 0
+        self.rate_limited = 0
+        self.failed = 0
+        self.superseded = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._ops)
+
+    def pending(self, guild_id: int, user_id: int) -> bool:
+        return (guild_id, user_id) in self._ops
+
+    def start(self):
+        if not self._restored:
+            self._restored = True
+            for gid, uid, op, pid, reason, tries in self.db.execute(
+                "SELECT guild_id, user_id, op, player_id, reason, tries FROM role_ops"
+            ):
+                if (gid, uid) not in self._ops:
+                    self._ops[(gid, uid)] = entry = RoleOp(gid, uid, op == "add", pid, reason, tries)
+                    self._ready.append(entry)
+            if self._ready:
+                print(f"[Roles] Resuming {len(self._ready)} pending role changes")
+                self._wake.set()
+        self._tasks = [t for t in self._tasks if not t.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._run()))
+
+    def submit(self, guild_id: int, user_id: int, add: bool, reason: str,
+               player_id: str = "", member: discord.Member | None = None) -> asyncio.Future:
+        """İşlemi kuyruğa al (ve kalıcı yaz); Future işlem bitince True/False olur."""
+        fut = asyncio.get_running_loop().create_future()
+        key = (guild_id, user_id)
+        old = self._ops.get(key)
+        if old is not None and old.add == add:
+            # Aynı işlem zaten bekliyor: ona katıl
+            old.member = member or old.member
+            old.waiters.append(fut)
+            return fut
+        if old is not None:
+            self.superseded += 1
+            self._settle(old, False)
+        op = RoleOp(guild_id, user_id, add, player_id, reason, member=member)
+        op.waiters.append(fut)
+        self._ops[key] = op
+        self.db.execute(
+            "INSERT OR REPLACE INTO role_ops (guild_id, user_id, op, player_id, reason, tries) "
+            "VALUES (?, ?, ?, ?, ?, 0)",
+            (guild_id, user_id, "add" if add else "remove", player_id, reason),
+        )
+        if key not in self._busy:   # işlenmekte olan eski işlem bitince sıraya girer
+            self._ready.append(op)
+            self._wake.set()
+        return fut
+
+    async def _wait(self, fut: asyncio.Future, wait: float) -> bool | None:
+        try:
+            return await asyncio.wait_for(asyncio.shield(fut), wait)
+        except asyncio.TimeoutError:
+            return None   # kuyrukta; sonuç arka planda uygulanır
+
+    async def grant(self, member: discord.Member, player_id: str, reason: str, wait: float) -> bool | None:
+        """Rol verildiyse True, kalıcı hatada False, `wait` içinde bitmediyse None (kuyrukta kalır)."""
+        cfg = guild_cfg(member.guild)
+        role_id = cfg.verified_role_id if cfg else 0
+        if not self.pending(member.guild.id, member.id) and (not role_id or member.get_role(role_id) is not None):
+            self._granted(member, player_id)
+            return True
+        fut = self.submit(member.guild.id, member.id, True, reason, player_id, member)
+        return await self._wait(fut, wait)
+
+    async def revoke(self, member: discord.Member, reason: str, wait: float) -> bool | None:
+        fut = self.submit(member.guild.id, member.id, False, reason, member=member)
+        return await self._wait(fut, wait)
+
+    def _granted(self, member: discord.Member, player_id: str):
+        mark_verified(member.guild.id, member.id)
+        if player_id:
+            spawn(_stage_dm(member, player_id))
+
+    def _settle(self, op: RoleOp, ok: bool):
+        for fut in op.waiters:
+            if not fut.done():
+                fut.set_result(ok)
+        op.waiters.clear()
+
+    def _requeue(self, op: RoleOp):
+        if self._ops.get(op.key) is op and op.key not in self._busy:
+            self._ready.append(op)
+            self._wake.set()
+
+    def _retry(self, op: RoleOp, delay: float, why: str, count: bool = True):
+        if count:
+            op.tries += 1
+            if op.tries >= self.max_tries:
+                return self._finish(op, False, f"{why} (gave up after {op.tries} tries)")
+            self.db.execute(
+                "UPDATE role_ops SET tries = ? WHERE guild_id = ? AND user_id = ?", (op.tries, *op.key)
+            )
+        self.retried += 1
+        asyncio.get_running_loop().call_later(delay, self._requeue, op)
+
+    def _finish(self, op: RoleOp, ok: bool, why: str = ""):
+        if self._ops.get(op.key) is not op:
+            # Çalışırken yerine yenisi geldi (ör. grant sürerken /unverify): waiter'ları submit zaten
+            # False ile kapattı. Sayaç, DM ve verified işareti yok; son durumu yeni işlem belirler.
+            self._settle(op, False)
+            return
+        del self._ops[op.key]
+        self.db.execute("DELETE FROM role_ops WHERE guild_id = ? AND user_id = ?", op.key)
+        if ok and op.add:
+            self.granted += 1
+            if op.member is not None:
+                self._granted(op.member, op.player_id)
+            else:
+                mark_verified(*op.key)
+        elif ok:
+            self.revoked += 1
+            mark_unverified(*op.key)
+        else:
+            self.failed += 1
+            M_FAILURES.inc("role")
+            verb = "assign role to" if op.add else "remove role from"
+            log_event(f"⚠️ Could not {verb} <@{op.user_id}>: `{why}`", urgent=True, guild=op.guild_id)
+        self._settle(op, ok)
+
+    async def _run(self):
+        # start() setup_hook'tan çağrılır; gateway hazır olmadan get_guild() None döner ve
+        # restore edilen işlemler yanlışlıkla kalıcı hataya düşerdi
+        await client.wait_until_ready()
+        while True:
+            if not self._ready:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            op = self._ready.popleft()
+            if self._ops.get(op.key) is not op:
+                continue   # yerine yenisi geldi
+            await self.bucket.acquire()
+            if self._ops.get(op.key) is not op:
+                continue
+            self._busy.add(op.key)
+            try:
+                async with role_pool:
+                    await self._apply(op)
+            except Exception as e:
+                self._finish(op, False, str(e))
+            finally:
+                self._busy.discard(op.key)
+                nxt = self._ops.get(op.key)
+                if nxt is not None and nxt is not op:
+                    self._ready.append(nxt)
+                    self._wake.set()
+
+    async def _apply(self, op: RoleOp):
+        guild = op.member.guild if op.member is not None else client.get_guild(op.guild_id)
+        cfg = guild_cfg(op.guild_id)
+        if guild is None or guild.unavailable or cfg is None:
+            # Sunucu (henüz) görünmüyor ya da ayarı yüklenmedi: geçici say, backoff ile tekrar dene
+            return self._retry(op, random.uniform(0, min(60.0, 2.0 ** (op.tries + 1))), "server not available")
+        role = guild.get_role(cfg.verified_role_id)
+        if role is None:
+            return self._finish(op, False, "Verified role not found")
+        try:
+            if op.member is None:
+                op.member = guild.get_member(op.user_id) or await guild.fetch_member(op.user_id)
+            with M_STAGE.time("role"):
+                if op.add and op.member.get_role(role.id) is None:
+                    await op.member.add_roles(role, reason=op.reason)
+                elif not op.add and op.member.get_role(role.id) is not None:
+                    await op.member.remove_roles(role, reason=op.reason)
+        except discord.NotFound:
+            # Üye ayrılmış: alma işlemi zaten tamam, verme yapılamaz
+            return self._finish(op, not op.add, "member left the server")
+        except discord.Forbidden as e:
+            return self._finish(op, False, str(e))
+        except discord.RateLimited as e:
+            self.rate_limited += 1
+            return self._retry(op, self.bucket.backoff(e.retry_after), "rate limited", count=False)
+        except discord.HTTPException as e:
+            if e.status == 429:
+                self.rate_limited += 1
+                return self._retry(op, self.bucket.backoff(), "rate limited", count=False)
+            if e.status < 500:
+                return self._finish(op, False, str(e))
+            return self._retry(op, random.uniform(0, min(60.0, 2.0 ** (op.tries + 1))), str(e))
+        except (asyncio.TimeoutError, OSError) as e:
+            return self._retry(op, random.uniform(0, min(60.0, 2.0 ** (op.tries + 1))), str(e) or type(e).__name__)
+        self.bucket.recover()
+        self._finish(op, True)
+
+    def describe(self) -> str:
+        return (
+            f"Pending: `{self.depth}` (in flight `{len(self._busy)}`)\n"
+            f"Rate: `{self.bucket.rate:.2f}`/s (max `{self.bucket.max_rate:g}`)\n"
+            f"Granted: `{self.granted}` · revoked: `{self.revoked}` · failed: `{self.failed}` · "
+            f"retries: `{self.retried}` · rate limited: `{self.rate_limited}` · superseded: `{self.superseded}`\n"
+        )
+
+role_grants = RoleScheduler(journal.db, ROLE_GRANT_RATE, ROLE_GRANT_BURST, PIPELINE_ROLE_WORKERS, ROLE_GRANT_MAX_TRIES)
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Asset cache (help görseli + banner)
+class CachedAsset:
+    """Görsel byte'ları açılışta bir kez belleğe alınır. İlk başarılı gönderimden sonra
+    Discord CDN URL'i saklanır; sonraki gönderimler yeniden upload yerine URL kullanır.
+    Dosya diskte değişirse (mtime/size) byte'lar yeniden okunur ve URL unutulur."""
+
+    CDN_MARGIN = 300  # imzalı CDN URL'inin süresi dolmadan bu kadar saniye önce bırak
+
+    def __init__(self, path: str, fallback_url: str):
+        self.path = path
+        self.fallback_url = fallback_url
+        self.filename = os.path.basename(path) if path else ""
+        self.data: bytes | None = None
+        self._stamp: tuple[float, int] | None = None
+        self._checked_at = 0.0
+        self.cdn_url = ""
+        self.cdn_expires: float | None = None
+
+        self.cdn_hits = 0
+        self.uploads = 0
+        self.url_fallbacks = 0
+        self.disk_loads = 0
+
+    def load(self):
+        self._checked_at = time.monotonic()
+        try:
+            st = os.stat(self.path) if self.path else None
+        except OSError:
+            st = None
+        if st is None:
+            if self.data is not None:
+                self.data, self._stamp = None, None
+                self.forget_cdn()
+            return
+        stamp = (st.st_mtime, st.st_size)
+        if stamp == self._stamp:
+            return
+        try:
+            with open(self.path, "rb") as f:
+                self.data = f.read()
+        except OSError as e:
+            print(f"[Assets] Could not read {self.path}: {e}")
+            self.data = None
+            return
+        self._stamp = stamp
+        self.disk_loads += 1
+        self.forget_cdn()
+
+    def check(self):
+        if time.monotonic() - self._checked_at >= ASSET_STAT_INTERVAL:
+            self.load()
+
+    def forget_cdn(self):
+        self.cdn_url, self.cdn_expires = "", None
+
+    def remember(self, message: discord.Message | None):
+        """Gönderilen mesajdaki ek'in CDN URL'ini sakla (imzalı URL'in `ex` süresiyle)."""
+        if not message or not message.attachments:
+            return
+        url = message.attachments[0].url
+        ex = parse_qs(urlparse(url).query).get("ex")
+        try:
+            self.cdn_expires = int(ex[0], 16) if ex else None
+        except ValueError:
+            self.cdn_expires = None
+        self.cdn_url = url
+
+    def cdn(self) -> str:
+        if self.cdn_url and self.cdn_expires and time.time() > self.cdn_expires - self.CDN_MARGIN:
+            self.forget_cdn()
+        return self.cdn_url
+
+    def file(self) -> discord.File:
+        return discord.File(io.BytesIO(self.data), filename=self.filename)
+
+    def will_use(self) -> str:
+        if self.cdn():
+            return "cdn"
+        if self.data is not None:
+            return "file"
+        return "url" if self.fallback_url else "none"
+
+    def describe(self) -> str:
+        size = f"{len(self.data) / 1024:.0f} KB" if self.data is not None else "-"
+        if self.cdn():
+            left = f", expires in {(self.cdn_expires - time.time()) / 3600:.1f} h" if self.cdn_expires else ""
+            cdn = f"cached{left}"
+        else:
+            cdn = "none"
+        return (
+            f"• in memory      : `{size}` (disk loads: `{self.disk_loads}`)\n"
+            f"• CDN URL        : `{cdn}`\n"
+            f"• hits           : cdn `{self.cdn_hits}` · upload `{self.uploads}` · url `{self.url_fallbacks}`\n"
+        )
+
+help_asset   = CachedAsset(ASSET_IMAGE_PATH, HELP_IMAGE_URL)
+banner_asset = CachedAsset(BANNER_IMAGE_PATH, BANNER_IMAGE_URL)
+help_asset.load()
+banner_asset.load()
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Panel View + Modal + Confirm
+class VerifyPanelView(RefuseWhileClosing, discord.ui.View):
+    def __init__(self):
+        super().__init__(timeout=None)
+
+    @discord.ui.button(
+        label=(VERIFY_BUTTON_LABEL or "Verify"),
+        style=discord.ButtonStyle.success,
+        custom_id="verify:start"
+    )
+    async def verify_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        member = interaction.user
+        if guild_cfg(interaction.guild) is None:
+            return await interaction.response.send_message(
+                "Verification is not set up on this server yet.", ephemeral=True
+            )
+        if is_verified(member):
+            return await interaction.response.send_message(
+                MSG_ALREADY_VERIFIED.format(mention=member.mention, cm=cm_contact(interaction.guild)),
+                ephemeral=True
+            )
+        await interaction.response.send_modal(VerifyModal())
+
+    @discord.ui.button(
+        label=(HELP_BUTTON_LABEL or "Where is my Player ID?"),
+        style=discord.ButtonStyle.secondary,
+        custom_id="verify:help"
+    )
+    async def help_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        """Ephemeral embed + image (cdn -> file -> url -> text)."""
+        emb = discord.Embed(title=HELP_TITLE, description=HELP_DESC, color=COLOR_WARN)
+
+        help_asset.check()
+
+        # 1) Daha önce yüklenmiş görselin CDN URL'i (yeniden upload yok)
+        cdn = help_asset.cdn()
+        if cdn:
+            help_asset.cdn_hits += 1
+            emb.set_image(url=cdn)
+            return await interaction.response.send_message(embed=emb, ephemeral=True)
+
+        # 2) Bellekteki dosya; ilk gönderimden sonra CDN URL'i sakla
+        if help_asset.data is not None:
+            try:
+                emb.set_image(url=f"attachment://{help_asset.filename}")
+                await interaction.response.send_message(embed=emb, ephemeral=True, file=help_asset.file())
+                help_asset.uploads += 1
+                try:
+                    help_asset.remember(await interaction.original_response())
+                except Exception:
+                    pass
+                return
+            except Exception:
+                pass  # gönderilemedi; URL fallback
+
+        # 3) URL fallback
+        if help_asset.fallback_url:
+            help_asset.url_fallbacks += 1
+            emb.set_image(url=help_asset.fallback_url)
+            return await interaction.response.send_message(embed=emb, ephemeral=True)
+
+        # 4) Görsel yoksa bilgilendir
+        warn = (
+            "⚠️ No help image configured.\n\n"
+            "• Set **ASSET_IMAGE_PATH** to an existing file in the repo (e.g. `assets/player_id_guide.png`),\n"
+            "  **or** set **HELP_IMAGE_URL** to a direct image URL.\n\n"
+            "Tip (raw GitHub):\n"
+            "`https://raw.githubusercontent.com/<user>/<repo>/<branch>/assets/player_id_guide.png`"
+        )
+        await interaction.response.send_message(warn, ephemeral=True)
+
+class VerifyModal(RefuseWhileClosing, discord.ui.Modal, title=MODAL_TITLE):
+    player_id_input: discord.ui.TextInput = discord.ui.TextInput(
+        label=MODAL_FIELD_LABEL,
+        placeholder="e.g. 123456789",
+        style=discord.TextStyle.short,
+        required=True,
+        max_length=32,
+    )
+
+    async def on_submit(self, interaction: discord.Interaction):
+        raw = str(self.player_id_input.value).strip()
+
+        # sıkı doğrulama
+        if not EXACT_ASCII_DIGITS_RAW.fullmatch(raw):
+            return await interaction.response.send_message(
+                MSG_INVALID.format(mention=interaction.user.mention, need=ID_LENGTH),
+                ephemeral=True
+            )
+
+        digits = raw
+        owner = indexes[interaction.guild.id].conflict(interaction.user.id, digits)
+        if owner is not None:
+            await interaction.response.send_message(
+                MSG_ID_TAKEN.format(mention=interaction.user.mention, cm=cm_contact(interaction.guild)),
+                ephemeral=True
+            )
+            return await report_conflict(interaction.guild, interaction.user, digits, owner)
+
+        view = ConfirmView(player_id=digits, origin=interaction)
+        emb = discord.Embed(
+            title="Confirm your Player ID",
+            description=f"**{digits}**\n\nClick **{CONFIRM_LABEL}** to finish, or **{CANCEL_LABEL}** to abort.",
+            color=COLOR_WARN
+        )
+        await interaction.response.send_message(embed=emb, view=view, ephemeral=True)
+
+class ConfirmView(RefuseWhileClosing, discord.ui.View):
+    # Cevap bekleyen Confirm pencereleri; kapanışta "restarting" mesajına çevrilir
+    open_views: set["ConfirmView"] = set()
+
+    def __init__(self, player_id: str, origin: discord.Interaction | None = None):
+        super().__init__(timeout=60)
+        self.player_id = player_id
+        self.origin = origin
+        if origin is not None:
+            ConfirmView.open_views.add(self)
+
+    async def on_timeout(self):
+        ConfirmView.open_views.discard(self)
+
+    async def close_for_restart(self):
+        ConfirmView.open_views.discard(self)
+        self.stop()
+        await self.origin.edit_original_response(content=MSG_RESTARTING, embed=None, view=None)
+
+    @discord.ui.button(label=CONFIRM_LABEL, style=discord.ButtonStyle.success, row=0)
+    async def confirm(self, interaction: discord.Interaction, button: discord.ui.Button):
+        lifecycle.track("verify")
+        ConfirmView.open_views.discard(self)
+        # 1) Hemen ACK (kullanıcı 'Interaction failed' görmesin)
+        t0 = time.perf_counter()
+        await interaction.response.defer(ephemeral=True)
+
+        member = interaction.user
+        guild  = interaction.guild
+
+        # Çift tıklama / auto ile yarış: uçuştaki doğrulamaya katıl, is_verified'a bakma
+        if not verification_gate.pending(guild.id, member.id) and is_verified(member):
+            # 2) Orijinal ephemeral’ı düzenle
+            return await interaction.edit_original_response(
+                content=MSG_ALREADY_VERIFIED.format(mention=member.mention, cm=cm_contact(guild)),
+                embed=None, view=None
+            )
+
+        # Uzun sürebilecek işler (rol, sheets, DM); (guild, user) başına bir kez yapılır.
+        # Modal ile Confirm arasında ID başkasına geçtiyse gate "conflict" döner.
+        outcome = await verification_gate.run(guild, member, self.player_id, source="panel")
+        if outcome.status == "conflict":
+            await interaction.edit_original_response(
+                content=MSG_ID_TAKEN.format(mention=member.mention, cm=cm_contact(guild)),
+                embed=None, view=None
+            )
+            return await report_conflict(guild, member, self.player_id, outcome.owner)
+        if outcome.player_id != self.player_id:
+            return await interaction.edit_original_response(
+                content=MSG_ALREADY_VERIFIED.format(mention=member.mention, cm=cm_contact(guild)),
+                embed=None, view=None
+            )
+
+        # 3) Bitti mesajı (rol verildiyse; kuyrukta ya da başarısızsa ona göre)
+        if outcome.role == "failed":
+            done = MSG_ROLE_FAILED.format(mention=member.mention, cm=cm_contact(guild))
+        elif outcome.role == "queued":
+            done = MSG_ROLE_QUEUED
+        else:
+            done = "✅ Verified!"
+        await interaction.edit_original_response(content=done, embed=None, view=None)
+        M_INTERACTION.observe(time.perf_counter() - t0)
+
+    @discord.ui.button(label=CANCEL_LABEL, style=discord.ButtonStyle.secondary, row=0)
+    async def cancel(self, interaction: discord.Interaction, button: discord.ui.Button):
+        ConfirmView.open_views.discard(self)
+        # Yine önce ACK gönder
+        await interaction.response.defer(ephemeral=True)
+        await interaction.edit_original_response(content="❎ Cancelled.", embed=None, view=None)
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Mirror dedupe
+class MirrorDedupe:
+    """Kopyalanmış mesaj ID'leri için sınırlı LRU. Snowflake ID zaman damgasını zaten
+    taşıdığı için TTL ayrıca saklanmaz; snapshot da yalnızca 8 byte/ID'dir."""
+
+    def __init__(self, path: str, max_items: int, ttl: float):
+        self.path = path
+        self.max_items = max_items
+        self.ttl = ttl
+        self._ids: OrderedDict[int, None] = OrderedDict()
+        self._dirty = False
+        self._task: asyncio.Task | None = None
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _expired(self, message_id: int, now: float) -> bool:
+        return discord.utils.snowflake_time(message_id).timestamp() < now - self.ttl
+
+    def __contains__(self, message_id: int) -> bool:
+        return message_id in self._ids
+
+    def add(self, message_id: int):
+        self._ids[message_id] = None
+        self._ids.move_to_end(message_id)
+        self._dirty = True
+        while len(self._ids) > self.max_items:
+            self._ids.popitem(last=False)
+            self.evicted += 1
+
+    def prune(self):
+        now = time.time()
+        expired = [i for i in self._ids if self._expired(i, now)]
+        for i in expired:
+            del self._ids[i]
+        if expired:
+            self._dirty = True
+            self.evicted += len(expired)
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as f:
+                ids = array("Q")
+                ids.frombytes(f.read())
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"[Mirror] Dedupe snapshot unreadable, starting empty: {e}")
+            return
+        for i in ids:
+            self._ids[i] = None
+        self.prune()
+        while len(self._ids) > self.max_items:
+            self._ids.popitem(last=False)
+        self._dirty = False
+        print(f"[Mirror] Loaded {len(self._ids)} mirrored IDs")
+
+    def save(self):
+        if not self._dirty:
+            return
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(array("Q", self._ids).tobytes())
+        os.replace(tmp, self.path)
+        self._dirty = False
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(MIRROR_SNAPSHOT_EVERY)
+            try:
+                self.prune()
+                self.save()
+            except Exception as e:
+                print(f"[Mirror] Dedupe snapshot failed: {e}")
+
+class AttachmentFetcher:
+    """MIRROR_ATTACHMENTS=copy: kaynak ek dosyalarını CDN'den indirip hedefe yeniden yükler.
+    İndirmeler MIRROR_DOWNLOAD_CONCURRENCY ile sınırlı paralel çalışır ve 64 KB'lık parçalarla
+    SpooledTemporaryFile'a akar: MIRROR_SPILL_BYTES'a kadar bellekte, üstü temp dosyada.
+    Upload da aynı dosya nesnesinden parça parça okunur; hiçbir dosya bütünüyle belleğe alınmaz."""
+
+    CHUNK = 64 * 1024
+    MAX_FILES = 10   # Discord: mesaj başına en fazla 10 dosya
+
+    def __init__(self, concurrency: int, spill_bytes: int, timeout: float):
+        self.spill_bytes = spill_bytes
+        self.timeout = timeout
+        self._sem = asyncio.Semaphore(concurrency)
+        self._session: aiohttp.ClientSession | None = None
+
+    async def _http(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout, sock_read=30)
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def download(self, att: discord.Attachment, limit: int) -> tuple[discord.File, int]:
+        async with self._sem:
+            buf = tempfile.SpooledTemporaryFile(max_size=self.spill_bytes, dir=MIRROR_TMP_DIR)
+            try:
+                size, t0 = 0, time.perf_counter()
+                async with (await self._http()).get(att.url) as resp:
+                    resp.raise_for_status()
+                    async for chunk in resp.content.iter_chunked(self.CHUNK):
+                        size += len(chunk)
+                        if size > limit:
+                            raise ValueError(f"larger than the {limit // 2**20} MB upload limit")
+                        buf.write(chunk)
+                M_MIRROR_FILE_SECONDS.observe(time.perf_counter() - t0, "download")
+                M_MIRROR_FILE_BYTES.inc("download", n=size)
+                buf.seek(0)
+                return discord.File(buf, filename=att.filename, spoiler=att.is_spoiler()), size
+            except BaseException:
+                buf.close()
+                raise
+
+    async def fetch(self, atts, limit: int) -> tuple[list[tuple[discord.Attachment, discord.File, int]], list[discord.Attachment]]:
+        """→ (kopyalananlar [(ek, File, boyut)], link olarak kalanlar). Sıra kaynak sırasıdır."""
+        todo = [a for a in atts if a.size <= limit]
+        results = await asyncio.gather(*(self.download(a, limit) for a in todo), return_exceptions=True)
+        copied, linked = [], [a for a in atts if a.size > limit]
+        if linked:
+            M_MIRROR_FILES.inc("too_large", n=len(linked))
+        names: set[str] = set()
+        for att, res in zip(todo, results):
+            if isinstance(res, BaseException):
+                print(f"[Mirror] Download failed for {att.filename}: {res}")
+                M_MIRROR_FILES.inc("failed")
+                linked.append(att)
+                continue
+            f, size = res
+            if f.filename in names:   # attachment:// referansları karışmasın
+                f.filename = f"{len(names)}_{f.filename}"
+            names.add(f.filename)
+            copied.append((att, f, size))
+        return copied, linked
+
+    def group(self, copied: list, limit: int) -> list[list]:
+        """Sırayı bozmadan en az mesaja böl: mesaj başına ≤10 dosya ve toplam ≤ limit."""
+        groups, cur, total = [], [], 0
+        for item in copied:
+            if cur and (len(cur) >= self.MAX_FILES or total + item[2] > limit):
+                groups.append(cur)
+                cur, total = [], 0
+            cur.append(item)
+            total += item[2]
+        if cur:
+            groups.append(cur)
+        return groups
+
+mirror_files = AttachmentFetcher(MIRROR_DOWNLOAD_CONCURRENCY, MIRROR_SPILL_BYTES, MIRROR_DOWNLOAD_TIMEOUT)
+
+class MirrorQueue:
+    """Hedef kanal başına sıralı gönderim kuyruğu. Her flush'ta en fazla 10 embed
+    (ve toplam 6000 karakter) tek mesajda gönderilir; kanal başına tek worker olduğundan
+    kaynak sırası korunur ve istekler kanalın rate-limit bucket'ını sırayla kullanır.
+    Kopyalanacak ek dosyası olan postlar tek başına gönderilir (bkz. _send_with_files)."""
+
+    MAX_EMBEDS = 10
+    MAX_CHARS  = 6000
+    MAX_TRIES  = 5
+
+    def __init__(self, flush_delay: float):
+        self.flush_delay = flush_delay
+        self._queues: dict[int, deque] = {}
+        self._events: dict[int, asyncio.Event] = {}
+        self._tasks: dict[int, asyncio.Task] = {}
+        self._queued: set[int] = set()
+        self.messages_sent = 0
+        self.embeds_sent = 0
+        self.rate_limited = 0
+        self.failed = 0
+        self.sending = 0   # kuyruktan alınmış, gönderimi süren embed'ler
+
+    @property
+    def depth(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def is_queued(self, message_id: int) -> bool:
+        return message_id in self._queued
+
+    def pending(self, target_id: int) -> int:
+        q = self._queues.get(target_id)
+        return len(q) if q else 0
+
+    async def wait_below(self, target_id: int, limit: int):
+        """Backfill için geri basınç: hedef kuyruğu `limit`in altına inene kadar bekle."""
+        while self.pending(target_id) >= limit:
+            await asyncio.sleep(0.25)
+
+    def enqueue(self, target: discord.abc.Messageable, message_id: int, embed: discord.Embed, attachments=()):
+        q = self._queues.setdefault(target.id, deque())
+        q.append((message_id, embed, tuple(attachments)))
+        self._queued.add(message_id)
+        self._events.setdefault(target.id, asyncio.Event()).set()
+        task = self._tasks.get(target.id)
+        if task is None or task.done():
+            self._tasks[target.id] = asyncio.create_task(self._run(target))
+
+    def _take(self, q: deque) -> list:
+        if q and q[0][2]:
+            return [q.popleft()]
+        batch, chars = [], 0
+        while q and len(batch) < self.MAX_EMBEDS and not q[0][2]:
+            size = len(q[0][1])
+            if batch and chars + size > self.MAX_CHARS:
+                break
+            batch.append(q.popleft())
+            chars += size
+        return batch
+
+    async def _run(self, target: discord.abc.Messageable):
+        q, ev = self._queues[target.id], self._events[target.id]
+        while True:
+            if not q:
+                ev.clear()
+                await ev.wait()
+            if len(q) < self.MAX_EMBEDS and self.flush_delay > 0:
+                await asyncio.sleep(self.flush_delay)
+            batch = self._take(q)
+            if batch:
+                self.sending += len(batch)
+                try:
+                    if batch[0][2]:
+                        await self._send_with_files(target, batch[0])
+                    else:
+                        await self._send(target, batch)
+                finally:
+                    self.sending -= len(batch)
+
+    async def _deliver(self, target: discord.abc.Messageable, files: list[discord.File] = (), **kw) -> bool:
+        for attempt in range(1, self.MAX_TRIES + 1):
+            for f in files:
+                f.reset()   # önceki denemede okunmuş olabilir
+            try:
+                if files:
+                    await target.send(files=list(files), **kw)
+                else:
+                    await target.send(**kw)
+                return True
+            except discord.RateLimited as err:
+                self.rate_limited += 1
+                await asyncio.sleep(err.retry_after)
+            except discord.HTTPException as err:
+                if err.status == 429 or err.status >= 500:
+                    if err.status == 429:
+                        self.rate_limited += 1
+                    await asyncio.sleep(min(30.0, 2 ** attempt))
+                    continue
+                print(f"[Mirror] Error: {err}")
+                return False
+            except Exception as err:
+                print(f"[Mirror] Error: {err}")
+                return False
+        print(f"[Mirror] Giving up after {self.MAX_TRIES} tries")
+        return False
+
+    def _done(self, batch: list, ok: bool, messages: int = 1):
+        for mid, _e, _a in batch:
+            self._queued.discard(mid)
+            if ok:
+                _mirrored_ids.add(mid)
+        if ok:
+            self.messages_sent += messages
+            self.embeds_sent += len(batch)
+        else:
+            self.failed += len(batch)
+
+    async def _send(self, target: discord.abc.Messageable, batch: list):
+        self._done(batch, await self._deliver(target, embeds=[e for _, e, _a in batch]))
+
+    async def _send_with_files(self, target: discord.abc.Messageable, item: tuple):
+        """Ekleri indir, (≤10 dosya, ≤ upload limiti) gruplarına böl: ilk mesaj embed + ilk grup,
+        kalan gruplar ardışık mesajlar. İndirilemeyen/çok büyük ekler embed'de link olarak kalır."""
+        mid, embed, atts = item
+        limit = getattr(getattr(target, "guild", None), "filesize_limit", 0) or MIRROR_UPLOAD_LIMIT
+        copied, linked = await mirror_files.fetch(atts, limit)
+        try:
+            groups = mirror_files.group(copied, limit) or [[]]
+            first_image = next((a for a in atts if a.content_type and a.content_type.startswith("image/")), None)
+            if first_image is not None:
+                local = next((f for a, f, _s in groups[0] if a is first_image), None)
+                embed.set_image(url=f"attachment://{local.filename}" if local else first_image.url)
+            if linked:
+                links = "\n".join(f"[{a.filename}]({a.url})" for a in linked)
+                embed.add_field(name="Attachments", value=links[:1024], inline=False)
+            ok, sent = True, 0
+            for i, group in enumerate(groups):
+                files = [f for _a, f, _s in group]
+                t0 = time.perf_counter()
+                ok = await (self._deliver(target, files, embed=embed) if i == 0 else self._deliver(target, files))
+                if not ok:
+                    break
+                sent += 1
+                if files:
+                    M_MIRROR_FILE_SECONDS.observe(time.perf_counter() - t0, "upload")
+                    M_MIRROR_FILE_BYTES.inc("upload", n=sum(s for _a, _f, s in group))
+                    M_MIRROR_FILES.inc("copied", n=len(files))
+            self._done([item], ok or sent > 0, messages=sent)
+        finally:
+            for _a, f, _s in copied:
+                f.close()
+                f.fp.close()   # File fp'yi kapatmaz (sahibi biziz); temp dosya (spill olduysa) silinir
+
+_mirrored_ids = MirrorDedupe(MIRROR_DEDUPE_PATH, MIRROR_DEDUPE_MAX, MIRROR_DEDUPE_TTL)
+_mirrored_ids.load()
+mirror_queue = MirrorQueue(MIRROR_FLUSH_DELAY)
+
+def mirror_enabled(guild: discord.Guild | None) -> bool:
+    cfg = guild_cfg(guild)
+    return bool(cfg and cfg.mirror_enabled)
+
+def is_mirror_candidate(message: discord.Message) -> bool:
+    """Shop botunun CM rolünü etiketlediği mesaj mı (on_message ve backfill aynı filtreyi kullanır)."""
+    cfg = guild_cfg(message.guild)
+    if not cfg or message.author.id not in cfg.mirror_bot_user_ids:
+        return False
+    role_mention = f"<@&{cfg.community_manager_role_id}>"
+    return role_mention in (message.content or "") or any(
+        r.id == cfg.community_manager_role_id for r in message.role_mentions
+    )
+
+def already_mirrored(message_id: int) -> bool:
+    return message_id in _mirrored_ids or mirror_queue.is_queued(message_id)
+
+def mirror_embed(message: discord.Message) -> discord.Embed:
+    content = message.content or ""
+    avatar = message.author.display_avatar.url if message.author.display_avatar else None
+    chan_name = getattr(message.channel, "name", str(message.channel.id))
+
+    e = discord.Embed(color=0xFFD166, description=(content[:4000] or "*(no text)*"))
+    e.set_author(name=f"{message.author.name} • #{chan_name}", icon_url=avatar)
+    e.add_field(name="Source", value=f"[Go to message]({message.jump_url})", inline=False)
+
+    if message.attachments and MIRROR_ATTACHMENTS == "link":
+        att = message.attachments[0]
+        if att.content_type and att.content_type.startswith("image/"):
+            e.set_image(url=att.url)
+        if len(message.attachments) > 1:
+            e.set_footer(text=f"+{len(message.attachments)-1} more attachments")
+    return e
+
+def mirror_attachments(message: discord.Message) -> tuple:
+    """Copy modunda yeniden yüklenecek ekler (görsel ve link MirrorQueue'da eklenir)."""
+    return tuple(message.attachments) if MIRROR_ATTACHMENTS == "copy" else ()
+
+MIRROR_BACKFILL_INFLIGHT = 50   # hedef kuyruğunda bekleyebilecek en fazla embed (geri basınç)
+MIRROR_BACKFILL_SEEN_MAX = int(os.getenv("MIRROR_BACKFILL_SEEN_MAX", "500000"))  # hedefte okunacak mirror ID üst sınırı (8 byte/ID)
+_JUMP_RE = re.compile(r"/channels/\d+/(\d+)/(\d+)")
+
+class MirrorBackfill:
+    """Kesinti sırasında kaçırılan shop postlarını kaynak kanal geçmişinden tamamlar.
+    Geçmiş async iterator ile (100'lük sayfalar) akıtılır, liste olarak tutulmaz; eşleşenler
+    normal mirror kuyruğuna verilir (10'luk embed batch'leri, kanal başına tek gönderici).
+    Kuyruk MIRROR_BACKFILL_INFLIGHT'a ulaşınca tarama bekler → bellek sabit kalır.
+
+    Dedupe TTL'inden eski pencerelerde de çift gönderim olmasın diye hedef kanalın aynı
+    penceredeki mesajları taranır ve "Source" linklerindeki mesaj ID'leri atlanır. Bu ID'ler
+    CompactIdSet'te tutulur ve MIRROR_BACKFILL_SEEN_MAX'ta kesilir (en fazla ~4 MB); ötesinde
+    yalnızca dedupe deposuna güvenilir. Kapanışta (SIGTERM) tarama durur, kuyruğa yeni iş eklenmez."""
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self.scanned = 0
+        self.matched = 0
+        self.skipped = 0
+        self.queued = 0
+        self.truncated = False
+        self.stopped = False
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def _target_seen(self, target: discord.TextChannel, source_id: int, after: datetime) -> CompactIdSet:
+        seen = CompactIdSet()
+        async for m in target.history(limit=None, after=after):
+            if lifecycle.closing:
+                break
+            if m.author.id != client.user.id:
+                continue
+            for e in m.embeds:
+                for f in e.fields:
+                    hit = _JUMP_RE.search(f.value or "")
+                    if hit and int(hit.group(1)) == source_id:
+                        seen.add(int(hit.group(2)))
+            if len(seen) >= MIRROR_BACKFILL_SEEN_MAX:
+                self.truncated = True
+                break
+        seen.compact()
+        return seen
+
+    async def run(self, source: discord.TextChannel, target: discord.TextChannel,
+                  after: datetime, before: datetime | None, progress=None):
+        if self._lock.locked():
+            raise RuntimeError("A backfill is already running")
+        async with self._lock:
+            self.scanned = self.matched = self.skipped = self.queued = 0
+            self.truncated = self.stopped = False
+            seen = await self._target_seen(target, source.id, after)
+            last = time.monotonic()
+            async for m in source.history(limit=None, after=after, before=before, oldest_first=True):
+                if lifecycle.closing:
+                    break
+                self.scanned += 1
+                if is_mirror_candidate(m):
+                    self.matched += 1
+                    if m.id in seen or already_mirrored(m.id):
+                        self.skipped += 1
+                    else:
+                        await mirror_queue.wait_below(target.id, MIRROR_BACKFILL_INFLIGHT)
+                        mirror_queue.enqueue(target, m.id, mirror_embed(m), mirror_attachments(m))
+                        self.queued += 1
+                if progress and time.monotonic() - last >= 3:
+                    last = time.monotonic()
+                    await progress(self)
+            del seen
+            self.stopped = lifecycle.closing
+            await mirror_queue.wait_below(target.id, 1)
+
+    def describe(self) -> str:
+        out = (
+            f"scanned `{self.scanned}` · shop posts `{self.matched}` · "
+            f"already mirrored `{self.skipped}` · queued `{self.queued}`"
+        )
+        if self.truncated:
+            out += f" · target scan capped at `{MIRROR_BACKFILL_SEEN_MAX}` IDs"
+        if self.stopped:
+            out += " · **stopped for restart**"
+        return out
+
+mirror_backfill = MirrorBackfill()
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Welcome DM scheduler
+def welcome_embed(member: discord.Member) -> discord.Embed:
+    # Register (Welcome) kanalına direkt link
+    cfg = guild_cfg(member.guild)
+    register_channel_id = cfg.register_channel_id if cfg else REGISTER_CHANNEL_ID
+    channel_link = f"https://discord.com/channels/{member.guild.id}/{register_channel_id}"
+
+    # Hoş geldin Embed Mesajı
+    emb = discord.Embed(
+        title=f"Welcome to {server_name(member.guild)}!",
+        description=(
+            f"Hello {member.mention}, glad to see you here!\n\n"
+            "To gain access to the server channels and chat with others, please **verify your Player ID**.\n\n"
+            f"👉 **Go to Verification Channel:** <#{register_channel_id}>\n"
+            f"[Click here to jump to channel]({channel_link})"
+        ),
+        color=0x57F287  # Yeşil ton
+    )
+
+    if SHOW_AUTHOR:
+        emb.set_author(name=f"{BRAND} Welcome")
+    return emb
+
+class WelcomeScheduler:
+    """Sınırlı kuyruk + token bucket ile welcome DM gönderici.
+    429 / "DM'leri çok hızlı açıyorsun" (40003) gelince hızı yarıya indirir, başarılı
+    gönderimlerde yavaşça WELCOME_RATE'e geri çıkar. Sırası gelen üye sunucudan
+    ayrılmış ya da verify olmuşsa DM atılmaz; aynı kullanıcıya cooldown içinde tekrar atılmaz."""
+
+    MIN_RATE = 0.05
+
+    def __init__(self, rate: float, burst: float, max_queue: int, cooldown: float, workers: int):
+        self.workers = workers
+        self.bucket = AdaptiveTokenBucket(rate, burst, self.MIN_RATE)
+        self.max_queue = max_queue
+        self.cooldown = cooldown
+        self._queue: deque[discord.Member] = deque()
+        self._wake = asyncio.Event()
+        self._left: set[int] = set()
+        self._last_dm: dict[int, float] = {}
+        self._sent_at: deque[float] = deque()
+        self._tasks: list[asyncio.Task] = []
+
+        self.enqueued = 0
+        self.sent = 0
+        self.dms_closed = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.skipped_verified = 0
+        self.skipped_left = 0
+        self.dropped_full = 0
+        self.dropped_cooldown = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    def throughput(self) -> float:
+        """Son 60 saniyedeki DM/dk."""
+        cutoff = time.monotonic() - 60
+        while self._sent_at and self._sent_at[0] < cutoff:
+            self._sent_at.popleft()
+        return float(len(self._sent_at))
+
+    def start(self):
+        # Token bucket hızı belirler; birden çok worker DM gecikmesinin hızı kısmasını önler
+        self._tasks = [t for t in self._tasks if not t.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._run()))
+
+    def enqueue(self, member: discord.Member):
+        now = time.monotonic()
+        last = self._last_dm.get(member.id)
+        if last is not None and now - last < self.cooldown:
+            self.dropped_cooldown += 1
+            return
+        if len(self._queue) >= self.max_queue:
+            self.dropped_full += 1
+            return
+        self._left.discard(member.id)
+        self._last_dm[member.id] = now
+        if len(self._last_dm) > 4 * self.max_queue:
+            self._prune_cooldowns(now)
+        self._queue.append(member)
+        self.enqueued += 1
+        self._wake.set()
+
+    def cancel(self, user_id: int):
+        if any(m.id == user_id for m in self._queue):
+            self._left.add(user_id)
+
+    def _prune_cooldowns(self, now: float):
+        for uid in [u for u, t in self._last_dm.items() if now - t >= self.cooldown]:
+            del self._last_dm[uid]
+
+    def _still_wanted(self, member: discord.Member) -> bool:
+        if member.id in self._left:
+            self._left.discard(member.id)
+            self.skipped_left += 1
+            return False
+        gid = member.guild.id
+        if member.id in verified_set(gid) or indexes[gid].player_of(member.id) is not None:
+            self.skipped_verified += 1
+            return False
+        return True
+
+    async def _run(self):
+        while True:
+            if not self._queue:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            await self.bucket.acquire()
+            if not self._queue:
+                continue
+            member = self._queue.popleft()
+            if not self._still_wanted(member):
+                continue
+            await self._send(member)
+
+    async def _send(self, member: discord.Member):
+        try:
+            await member.send(embed=welcome_embed(member))
+            self.sent += 1
+            self._sent_at.append(time.monotonic())
+            self.bucket.recover()
+        except discord.Forbidden as e:
+            if e.code == 40003:
+                # Discord: "You are opening direct messages too fast" → yavaşla, tekrar dene
+                self.rate_limited += 1
+                self._queue.appendleft(member)
+                await asyncio.sleep(self.bucket.backoff())
+            else:
+                # Kullanıcı DM'leri kapattıysa hata vermesin, sayaçta görünsün
+                self.dms_closed += 1
+        except discord.RateLimited as e:
+            self.rate_limited += 1
+            self._queue.appendleft(member)
+            await asyncio.sleep(self.bucket.backoff(e.retry_after))
+        except discord.HTTPException as e:
+            if e.status == 429:
+                self.rate_limited += 1
+                self._queue.appendleft(member)
+                await asyncio.sleep(self.bucket.backoff())
+            else:
+                self.errors += 1
+                print(f"[Welcome] Error sending DM to {member.name}: {e}")
+        except Exception as e:
+            self.errors += 1
+            print(f"[Welcome] Error sending DM to {member.name}: {e}")
+
+    def describe(self) -> str:
+        return (
+            f"Queue: `{self.depth}` / `{self.max_queue}`\n"
+            f"Rate: `{self.bucket.rate:.2f}` DM/s (max `{self.bucket.max_rate:g}`) · "
+            f"last minute: `{self.throughput():.0f}` DMs\n"
+            f"Sent: `{self.sent}` · DMs closed: `{self.dms_closed}` · errors: `{self.errors}` · "
+            f"rate limited: `{self.rate_limited}`\n"
+            f"Skipped: verified `{self.skipped_verified}` · left `{self.skipped_left}`\n"
+            f"Dropped: queue full `{self.dropped_full}` · cooldown `{self.dropped_cooldown}`\n"
+        )
+
+welcome_scheduler = WelcomeScheduler(
+    WELCOME_RATE, WELCOME_BURST, WELCOME_QUEUE_MAX, WELCOME_COOLDOWN, WELCOME_WORKERS
+)
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Role ↔ sheet reconciliation
+RECONCILE_INTERVAL  = float(os.getenv("RECONCILE_INTERVAL", "21600"))   # sn; 0 = yalnız elle
+RECONCILE_TIMEOUT   = float(os.getenv("RECONCILE_TIMEOUT", "1800"))
+RECONCILE_REPORT_MAX = 20                                               # mesajda listelenen örnek
+
+class Reconciler:
+    """Verified rolü ile Registrations sheet'i (storage.source; yoksa journal) arasındaki farkı bulur.
+    Sheet tek get_all_values ile okunur (henüz replike edilmemiş journal satırları da kayıtlı
+    sayılır); üyeler fetch_members ile 1000'lik sayfalar hâlinde akıtılır, yalnızca ID kümeleri
+    (CompactIdSet) bellekte tutulur. Farklar:
+      - role_only:   rolü var, kaydı yok (elle verilmiş rol) → yalnızca rapor
+      - sheet_only:  kaydı var, rolü yok (rol hatası ya da /unverify) → fix_roles ile rol verilir
+                     (role_grants kuyruğundan; süre dolarken bitmeyenler "queued" sayılır, arka planda sürer)
+      - lost_rows:   journal'da var, sheet'ten silinmiş → batch append_rows ile geri yazılır
+    Zamanlanmış çalışma yalnızca rapor verir: rol vermez (/unverify'ı geri almasın diye) ve sheet'e
+    satır geri yazmaz (mod'ların bilerek sildiği satırlar geri gelmesin). Düzeltmeler /reconcile ile."""
+
+    def __init__(self, interval: float, timeout: float):
+        self.interval = interval
+        self.timeout = timeout
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self.last_result: dict | None = None
+        self.last_run_at: datetime | None = None
+        self.last_error = ""
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def start(self):
+        if self.interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        # Yalnız yerel/JSONL kurulumlarda sheets_ready hiç set edilmez; kaynağın kendisini bekle
+        if storage.source is not None:
+            await storage.source.backend.wait_ready()
+        await client.wait_until_ready()
+        while True:
+            await asyncio.sleep(self.interval)
+            for guild in list(client.guilds):
+                if guild_cfg(guild) is None or self.running:
+                    continue
+                try:
+                    res = await self.run(guild, fix_sheet=False, fix_roles=False)
+                    if res["role_only"] or res["sheet_only"] or res["lost_rows"]:
+                        log_event("🔁 Scheduled reconcile: " + self.summary(res), guild=guild)
+                except Exception as e:
+                    print(f"[Reconcile] Failed for guild {guild.id}: {e}")
+
+    async def _read_sheet(self, backend: StorageBackend, guild_id: int) -> tuple[CompactIdSet, set[int]]:
+        values = await backend.read_all(guild_id)
+        users, seqs = CompactIdSet(), set()
+        for r in values:
+            if len(r) < 4 or not r[1].isdigit() or not r[3]:
+                continue
+            if len(r) >= 7 and r[6].isdigit():
+                seqs.add(int(r[6]))
+            if not is_test_row(r):
+                users.add(int(r[1]))
+        del values
+        users.compact()
+        return users, seqs
+
+    async def _members(self, guild: discord.Guild):
+        """Tam cache'te bellekteki üyeler; lean modda REST'ten sayfa sayfa."""
+        if guild.chunked and not LEAN_MEMBER_CACHE:
+            for i, m in enumerate(list(guild.members)):
+                yield m
+                if i % 5000 == 4999:
+                    await asyncio.sleep(0)
+        else:
+            async for m in guild.fetch_members(limit=None):
+                yield m
+
+    async def run(self, guild: discord.Guild, fix_sheet: bool, fix_roles: bool, progress=None) -> dict:
+        if self._lock.locked():
+            raise RuntimeError("A reconcile is already running")
+        async with self._lock:
+            try:
+                res = await asyncio.wait_for(self._reconcile(guild, fix_sheet, fix_roles, progress), self.timeout)
+            except asyncio.TimeoutError:
+                self.last_error = f"Timed out after {self.timeout:.0f}s"
+                raise RuntimeError(self.last_error)
+            except Exception as e:
+                self.last_error = str(e)
+                raise
+            self.last_result, self.last_error = res, ""
+            self.last_run_at = datetime.now(timezone.utc)
+            return res
+
+    async def _reconcile(self, guild: discord.Guild, fix_sheet: bool, fix_roles: bool, progress) -> dict:
+        t0 = time.monotonic()
+        cfg = guild_cfg(guild)
+        vrole = guild.get_role(cfg.verified_role_id) if cfg else None
+        if not vrole:
+            raise RuntimeError("Verified role not found")
+        src = storage.source
+        if src is not None and not src.backend.ready:
+            raise RuntimeError(f"{src.backend.label} storage is not connected")
 
-# ─────────────────────────────────────────────────────────────────────────────
-# Google Sheets init
-ws = None
-SHEETS_OK = False
-SHEETS_WHY = ""
-SERVICE_EMAIL = ""
+        registered, sheet_seqs = await self._read_sheet(src.backend if src else journal, guild.id)
+        sheet_users = len(registered)
+        # Henüz Sheets'e gitmemiş journal satırları da kayıttır
+        hwm = src.hwm if src else journal.last_seq()
+        seq = hwm
+        while batch := journal.after(seq, SHEETS_MAX_BATCH, guild.id):
+            for _s, row in batch:
+                if not is_test_row(row):
+                    registered.add(int(row[1]))
+            seq = batch[-1][0]
 
-if SHEET_ID and (GOOGLE_CREDENTIALS_B64 or GOOGLE_CREDENTIALS):
-    try:
-        import gspread
-        from gspread.exceptions import SpreadsheetNotFound
-        from google.oauth2.service_account import Credentials
+        res = {
+            "members": 0, "with_role": 0, "registered": len(registered),
+            "role_only": 0, "sheet_only": 0, "lost_rows": 0,
+            "roles_granted": 0, "roles_queued": 0, "rows_backfilled": 0, "errors": 0,
+            "examples": {"role_only": [], "sheet_only": []},
+        }
+        # Journal'da olup sheet'te olmayan (seq ≤ hwm) satırlar: sayfa sayfa, batch append.
+        # G sütunu olmayan eski sheet'lerde yapılmaz (her satır "kayıp" görünürdü); boş sheet hariç.
+        if src and (sheet_seqs or not sheet_users):
+            lost: list[tuple[int, list]] = []
+            seq = 0
+            while seq < hwm and (batch := journal.after(seq, SHEETS_MAX_BATCH, guild.id)):
+                lost.extend((guild.id, r + [str(s)]) for s, r in batch if s <= hwm and s not in sheet_seqs)
+                seq = batch[-1][0]
+            res["lost_rows"] = len(lost)
+            if fix_sheet and lost:
+                await src.backfill(lost)
+                res["rows_backfilled"] = len(lost)
+            for _gid, r in lost:
+                if not is_test_row(r):
+                    registered.add(int(r[1]))   # journal'da kayıtlı: rolü hak ediyor
+            del lost
+        res["registered"] = len(registered)
 
-        creds_raw = GOOGLE_CREDENTIALS
-        if GOOGLE_CREDENTIALS_B64:
-            creds_raw = base64.b64decode(GOOGLE_CREDENTIALS_B64).decode("utf-8")
+        to_grant: list[discord.Member] = []
+        async for m in self._members(guild):
+            if m.bot:
+                continue
+            res["members"] += 1
+            has_role = m.get_role(vrole.id) is not None
+            is_reg = m.id in registered
+            res["with_role"] += has_role
+            if has_role == is_reg:
+                continue
+            kind = "role_only" if has_role else "sheet_only"
+            res[kind] += 1
+            if len(res["examples"][kind]) < RECONCILE_REPORT_MAX:
+                res["examples"][kind].append(m.id)
+            if kind == "sheet_only" and fix_roles:
+                to_grant.append(m)
+            if progress and res["members"] % 10000 == 0:
+                await progress(res)
 
-        info = json.loads(creds_raw)
-        SERVICE_EMAIL = info.get("client_email", "")
+        if to_grant:
+            futs = [role_grants.submit(guild.id, m.id, True, "Reconcile: registered in sheet", member=m)
+                    for m in to_grant]
+            del to_grant
+            left = self.timeout - (time.monotonic() - t0) - 5
+            done, pending = await asyncio.wait(futs, timeout=max(1.0, left))
+            res["roles_granted"] = sum(1 for f in done if f.result())
+            res["roles_queued"] = len(pending)
+            failed = len(done) - res["roles_granted"]
+            if failed:
+                res["errors"] += failed
+                M_FAILURES.inc("reconcile", n=failed)
+        res["elapsed"] = time.monotonic() - t0
+        return res
 
-        scopes = [
-            "https://www.googleapis.com/auth/spreadsheets",
-            "https://www.googleapis.com/auth/drive",
-        ]
-        creds = Credentials.from_service_account_info(info, scopes=scopes)
-        gc = gspread.authorize(creds)
+    @staticmethod
+    def summary(res: dict) -> str:
+        out = (
+            f"{res['members']} members scanned, {res['with_role']} verified, {res['registered']} registered · "
+            f"role without registration: **{res['role_only']}**, registration without role: **{res['sheet_only']}**, "
+            f"rows missing from sheet: **{res['lost_rows']}**"
+        )
+        if res["roles_granted"] or res["rows_backfilled"]:
+            out += f" · fixed: {res['roles_granted']} roles, {res['rows_backfilled']} rows"
+        if res.get("roles_queued"):
+            out += f" · {res['roles_queued']} roles still queued"
+        if res["errors"]:
+            out += f" · {res['errors']} errors"
+        return out + f" ({res.get('elapsed', 0):.1f}s)"
 
-        try:
-            sh = gc.open_by_key(SHEET_ID)
-        except SpreadsheetNotFound:
-            raise RuntimeError(
-                f"Spreadsheet not found. Wrong SHEET_ID or not shared with {SERVICE_EMAIL}."
-            )
+reconciler = Reconciler(RECONCILE_INTERVAL, RECONCILE_TIMEOUT)
 
-        try:
-            ws = sh.worksheet(WORKSHEET)
-        except Exception:
-            ws = sh.add_worksheet(title=WORKSHEET, rows="1000", cols="12")
+# ─────────────────────────────────────────────────────────────────────────────
+# Lifecycle (graceful shutdown)
+SHUTDOWN_DEADLINE = float(os.getenv("SHUTDOWN_DEADLINE", "25"))   # sn; SIGTERM → çıkış (orkestratörün süresinden kısa)
 
-        SHEETS_OK = True
-        print(f"✅ Google Sheets connected as {SERVICE_EMAIL} → sheet:{SHEET_ID} tab:{WORKSHEET}")
-    except Exception as e:
-        SHEETS_WHY = str(e)
-        print("⚠️ Sheets disabled:", e)
-else:
-    SHEETS_WHY = "Missing SHEET_ID or credentials"
+def _pending_work() -> dict[str, int]:
+    """Kapanışta beklenen işler: yalnızca restart'ta kaybolacak olanlar."""
+    out = lifecycle.inflight()
+    for name, n in (
+        ("background tasks", len(_background)),
+        ("mirror posts", mirror_queue.depth + mirror_queue.sending),
+        ("welcome DMs", welcome_scheduler.depth),
+    ):
+        if n:
+            out[name] = n
+    return out
 
-def sheet_append_row(guild: discord.Guild, user: discord.abc.User, player_id: str, source: str):
-    """Order: Guild Name, User ID, Display Name, Player ID, Timestamp(UTC), Source"""
-    if not ws:
-        raise RuntimeError(f"Sheets not configured: {SHEETS_WHY or 'unknown'}")
+def _carried_over() -> dict[str, int]:
+    """Kalıcı backlog'lar (role_ops, replika mark'ı): beklenmez, restart sonrası kaldığı yerden sürer."""
+    out = {}
+    for name, n in (
+        ("role changes", role_grants.depth),
+        *((f"{r.backend.name} rows", r.depth) for r in storage.replicas),
+    ):
+        if n:
+            out[name] = n
+    return out
 
-    ts = datetime.now(timezone.utc).isoformat()
-    display = (
-        getattr(user, "global_name", None)
-        or getattr(user, "display_name", None)
-        or user.name
-    )
-    row = [
-        guild.name,      # Guild Name
-        str(user.id),    # User ID
-        display,         # Display Name
-        player_id,       # Player ID
-        ts,              # Timestamp (UTC)
-        source,          # panel | auto | manual | test
-    ]
-    ws.append_row(row, value_input_option="RAW")
+def _fmt_work(work: dict[str, int]) -> str:
+    return ", ".join(f"{n} {name}" for name, n in work.items()) or "nothing"
 
-async def apply_success(guild: discord.Guild, member: discord.Member, player_id: str, source: str):
-    log_ch = guild.get_channel(LOG_CHANNEL_ID)
+def request_shutdown(reason: str):
+    """Sinyal handler'ı: ilk sinyalde düzenli kapanış, ikincisinde beklemeden çık."""
+    if lifecycle.task is None:
+        lifecycle.task = asyncio.create_task(graceful_shutdown(reason))
+    else:
+        print(f"[Shutdown] {reason} again — closing without waiting")
+        asyncio.create_task(client.close())
 
-    # role
-    vrole = guild.get_role(VERIFIED_ROLE_ID)
-    if vrole and vrole not in member.roles:
-        try:
-            await member.add_roles(vrole, reason="Player ID verified")
-        except Exception as e:
-            if log_ch:
-                await log_ch.send(
-                    f"⚠️ Could not assign role to {member.mention}: `{e}`",
-                    allowed_mentions=allowed_mentions_users_only
-                )
+async def graceful_shutdown(reason: str):
+    lifecycle.closing = True
+    t0 = time.monotonic()
+    deadline = t0 + SHUTDOWN_DEADLINE
+    before = _pending_work()
+    print(f"[Shutdown] {reason}: draining {_fmt_work(before)}, persisted {_fmt_work(_carried_over())} "
+          f"(deadline {SHUTDOWN_DEADLINE:g}s)")
+
+    # Açık Confirm pencereleri: tıklayan "Interaction failed" yerine restart mesajını görsün
+    views = list(ConfirmView.open_views)
+    await asyncio.gather(*(v.close_for_restart() for v in views), return_exceptions=True)
+
+    storage.kick()
+    while _pending_work() and time.monotonic() < deadline:
+        await asyncio.sleep(0.2)
 
-    # sheets
+    # Son replikasyon denemesi (kalan satırlar journal'da; restart sonrası yine gider)
     try:
-        sheet_append_row(guild, member, player_id, source)
-        if log_ch:
-            await log_ch.send(
-                f"{member.mention} player id `{player_id}` · source **{source}**",
-                allowed_mentions=allowed_mentions_users_only
-            )
+        await asyncio.wait_for(storage.flush(), max(1.0, deadline - time.monotonic()))
     except Exception as e:
-        if log_ch:
-            await log_ch.send(
-                f"⚠️ Sheet write failed for {member.mention}: `{e}`",
-                allowed_mentions=allowed_mentions_users_only
-            )
+        print(f"[Shutdown] Final storage flush failed: {e}")
+    _mirrored_ids.save()
+    await mirror_files.close()
 
-    # DM
+    left = _pending_work()
+    drained = {k: n - left.get(k, 0) for k, n in before.items() if n - left.get(k, 0) > 0}
+    summary = (
+        f"♻️ Shutdown ({reason}) after {time.monotonic() - t0:.1f}s — drained: {_fmt_work(drained)}; "
+        f"abandoned: {_fmt_work(left)}; carried over to next start: {_fmt_work(_carried_over())}; "
+        f"{len(views)} open confirms closed, "
+        f"{lifecycle.refused} interactions refused."
+    )
+    print(f"[Shutdown] {summary}")
+    log_event(summary, urgent=True)
     try:
-        emb = discord.Embed(description=DM_OK, color=COLOR_OK)
-        if SHOW_AUTHOR:
-            emb.set_author(name=f"{BRAND} Verify")
-        emb.add_field(name="Player ID", value=f"`{player_id}`", inline=True)
-        await member.send(embed=emb)
-    except:
-        pass
+        await asyncio.wait_for(log_agg.flush(), 5)
+    except Exception as e:
+        print(f"[Shutdown] Log flush failed: {e}")
+    await client.close()
 
 # ─────────────────────────────────────────────────────────────────────────────
-# Panel View + Modal + Confirm
-class VerifyPanelView(discord.ui.View):
-    def __init__(self):
-        super().__init__(timeout=None)
+# Profiler (/profile; kapalıyken thread, task ya da hook yok → maliyet sıfır)
+PROFILE_SAMPLE_INTERVAL  = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))  # sn; CPU örnekleme aralığı
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "1"))
+PROFILE_TOP = 25
 
-    @discord.ui.button(
-        label=(VERIFY_BUTTON_LABEL or "Verify"),
-        style=discord.ButtonStyle.success,
-        custom_id="verify:start"
-    )
-    async def verify_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        member = interaction.user
-        vrole = interaction.guild.get_role(VERIFIED_ROLE_ID)
-        if vrole and vrole in member.roles:
-            return await interaction.response.send_message(
-                MSG_ALREADY_VERIFIED.format(mention=member.mention, cm=cm_contact()),
-                ephemeral=True
-            )
-        await interaction.response.send_modal(VerifyModal())
+def _short_path(path: str) -> str:
+    parts = path.replace("\\", "/").split("/")
+    return "/".join(parts[-2:])
 
-    @discord.ui.button(
-        label=(HELP_BUTTON_LABEL or "Where is my Player ID?"),
-        style=discord.ButtonStyle.secondary,
-        custom_id="verify:help"
-    )
-    async def help_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        """Ephemeral embed + image (file -> url -> text)."""
-        emb = discord.Embed(title=HELP_TITLE, description=HELP_DESC, color=COLOR_WARN)
+class Profiler:
+    """/profile süresince dört ölçüm birlikte alınır:
+    1. Örnekleyici thread her PROFILE_SAMPLE_INTERVAL'da tüm thread'lerin stack'ini okur (CPU profili;
+       loop thread'i selector'da bekliyorsa "idle" sayılır, to_thread/Sheets thread'leri ayrı listelenir).
+    2. Loop içinde 10 ms'lik heartbeat; gecikme eşiği aşınca örnekleyici o an loop'u bloklayan
+       stack'i yakalar (stall listesi).
+    3. 100 ms'de bir tüm task'ların nerede beklediği sayılır (Sheets thread'i, rate-limit uykusu, ...).
+    4. tracemalloc: pencere boyunca ayrılıp hâlâ yaşayan bellek, satır bazında."""
 
-        # 1) Repo içi dosya
-        path = os.getenv("ASSET_IMAGE_PATH", ASSET_IMAGE_PATH)
-        if path and os.path.isfile(path):
-            try:
-                fname = os.path.basename(path)
-                file = discord.File(path, filename=fname)
-                emb.set_image(url=f"attachment://{fname}")
-                return await interaction.response.send_message(embed=emb, ephemeral=True, file=file)
-            except Exception:
-                pass  # dosya okunamadı; URL fallback
+    BEAT = 0.01
+    TASK_EVERY = 0.1
+    MAX_DEPTH = 40
+    _IDLE_FILES = ("selectors.py", "threading.py", "queue.py")
+    _IDLE_FUNCS = {("futures/thread.py", "_worker")}   # executor thread iş kuyruğunda (C içinde) bekliyor
 
-        # 2) URL fallback
-        url = os.getenv("HELP_IMAGE_URL", HELP_IMAGE_URL)
-        if url:
-            emb.set_image(url=url)
-            return await interaction.response.send_message(embed=emb, ephemeral=True)
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = asyncio.Lock()
 
-        # 3) Görsel yoksa bilgilendir
-        warn = (
-            "⚠️ No help image configured.\n\n"
-            "• Set **ASSET_IMAGE_PATH** to an existing file in the repo (e.g. `assets/player_id_guide.png`),\n"
-            "  **or** set **HELP_IMAGE_URL** to a direct image URL.\n\n"
-            "Tip (raw GitHub):\n"
-            "`https://raw.githubusercontent.com/<user>/<repo>/<branch>/assets/player_id_guide.png`"
-        )
-        await interaction.response.send_message(warn, ephemeral=True)
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
 
-class VerifyModal(discord.ui.Modal, title=MODAL_TITLE):
-    player_id_input: discord.ui.TextInput = discord.ui.TextInput(
-        label=MODAL_FIELD_LABEL,
-        placeholder="e.g. 123456789",
-        style=discord.TextStyle.short,
-        required=True,
-        max_length=32,
-    )
+    def _stack(self, frame) -> tuple:
+        out = []
+        while frame is not None and len(out) < self.MAX_DEPTH:
+            code = frame.f_code
+            out.append((_short_path(code.co_filename), code.co_name, frame.f_lineno))
+            frame = frame.f_back
+        return tuple(reversed(out))   # kök → yaprak
 
-    async def on_submit(self, interaction: discord.Interaction):
-        raw = str(self.player_id_input.value).strip()
+    def _idle(self, stack: tuple) -> bool:
+        return not stack or stack[-1][0].endswith(self._IDLE_FILES) or stack[-1][:2] in self._IDLE_FUNCS
 
-        # sıkı doğrulama
-        if not EXACT_ASCII_DIGITS_RAW.fullmatch(raw):
-            return await interaction.response.send_message(
-                MSG_INVALID.format(mention=interaction.user.mention, need=ID_LENGTH),
-                ephemeral=True
-            )
+    def _sampler(self, stop: threading.Event):
+        me = threading.get_ident()
+        names: dict[int, str] = {}
+        while not stop.wait(self.interval):
+            self.samples += 1
+            frames = sys._current_frames()
+            for tid, frame in frames.items():
+                if tid == me:
+                    continue
+                stack = self._stack(frame)
+                if tid == self._loop_tid:
+                    if self._idle(stack):
+                        self.loop_idle += 1
+                    else:
+                        self.loop_stacks[stack] = self.loop_stacks.get(stack, 0) + 1
+                    if self._stall_stack is None and time.perf_counter() - self._beat > self.threshold + self.BEAT:
+                        self._stall_stack = stack
+                elif not self._idle(stack):
+                    if tid not in names:
+                        names = {t.ident: t.name for t in threading.enumerate()}
+                    key = (names.get(tid, str(tid)).split("_")[0], stack[-1])
+                    self.thread_leaves[key] = self.thread_leaves.get(key, 0) + 1
 
-        digits = raw
-        view = ConfirmView(player_id=digits)
-        emb = discord.Embed(
-            title="Confirm your Player ID",
-            description=f"**{digits}**\n\nClick **{CONFIRM_LABEL}** to finish, or **{CANCEL_LABEL}** to abort.",
-            color=COLOR_WARN
-        )
-        await interaction.response.send_message(embed=emb, view=view, ephemeral=True)
+    async def _heartbeat(self):
+        while True:
+            t = time.perf_counter()
+            await asyncio.sleep(self.BEAT)
+            now = time.perf_counter()
+            lag = max(0.0, now - t - self.BEAT)
+            self._beat = now
+            self.lags.append(lag)
+            if lag > self.threshold:
+                self.stalls.append((now - lag - self._t0, lag, self._stall_stack))
+            self._stall_stack = None
 
-class ConfirmView(discord.ui.View):
-    def __init__(self, player_id: str):
-        super().__init__(timeout=60)
-        self.player_id = player_id
+    @staticmethod
+    def _awaiting(coro) -> str:
+        """cr_await zincirini izle: bot kodundaki en içteki kare + (varsa) asyncio'daki son adım."""
+        outer, inner, obj = None, None, coro
+        for _ in range(64):
+            frame = getattr(obj, "cr_frame", None) or getattr(obj, "gi_frame", None) or getattr(obj, "ag_frame", None)
+            if frame is not None:
+                where = f"{_short_path(frame.f_code.co_filename)}:{frame.f_lineno} {frame.f_code.co_name}"
+                if "asyncio/" in where:
+                    inner = frame.f_code.co_name
+                else:
+                    outer, inner = where, None
+            nxt = getattr(obj, "cr_await", None) or getattr(obj, "gi_yieldfrom", None) or getattr(obj, "ag_await", None)
+            if nxt is None:
+                break
+            obj = nxt
+        label = outer or "?"
+        if inner:
+            label += f" → asyncio.{inner}"
+        return label
 
-    @discord.ui.button(label=CONFIRM_LABEL, style=discord.ButtonStyle.success, row=0)
-    async def confirm(self, interaction: discord.Interaction, button: discord.ui.Button):
-        # 1) Hemen ACK (kullanıcı 'Interaction failed' görmesin)
-        await interaction.response.defer(ephemeral=True)
+    async def _task_sampler(self):
+        me = asyncio.current_task()
+        while True:
+            await asyncio.sleep(self.TASK_EVERY)
+            for task in asyncio.all_tasks():
+                if task is me or task.done():
+                    continue
+                where = self._awaiting(task.get_coro())
+                self.awaits[where] = self.awaits.get(where, 0) + 1
 
-        member = interaction.user
-        guild  = interaction.guild
+    async def run(self, seconds: float, threshold: float) -> tuple[str, str]:
+        """→ (rapor metni, tek satırlık özet)"""
+        if self._lock.locked():
+            raise RuntimeError("A profile is already running")
+        async with self._lock:
+            self.threshold = threshold
+            self.samples = self.loop_idle = 0
+            self.loop_stacks: dict[tuple, int] = {}
+            self.thread_leaves: dict[tuple, int] = {}
+            self.awaits: dict[str, int] = {}
+            self.lags: list[float] = []
+            self.stalls: list[tuple] = []
+            self._stall_stack = None
+            self._loop_tid = threading.get_ident()
+            self._t0 = self._beat = time.perf_counter()
+            started_at = datetime.now(timezone.utc)
 
-        vrole = guild.get_role(VERIFIED_ROLE_ID)
-        if vrole and vrole in member.roles:
-            # 2) Orijinal ephemeral’ı düzenle
-            return await interaction.edit_original_response(
-                content=MSG_ALREADY_VERIFIED.format(mention=member.mention, cm=cm_contact()),
-                embed=None, view=None
-            )
+            own_tracing = not tracemalloc.is_tracing()
+            if own_tracing:
+                tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+            # Snapshot'lar ve fark büyük heap'te saniyeler sürebilir: ölçtüğümüz loop'u bloklamasın
+            snap0 = await asyncio.to_thread(tracemalloc.take_snapshot)
+            stop = threading.Event()
+            sampler = threading.Thread(target=self._sampler, args=(stop,), name="profiler", daemon=True)
+            tasks = [asyncio.create_task(self._heartbeat()), asyncio.create_task(self._task_sampler())]
+            sampler.start()
+            try:
+                while time.perf_counter() - self._t0 < seconds and not lifecycle.closing:
+                    await asyncio.sleep(0.25)
+            finally:
+                stop.set()
+                for t in tasks:
+                    t.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                sampler.join(timeout=1)
+                elapsed = time.perf_counter() - self._t0
+                try:
+                    snap1 = await asyncio.to_thread(tracemalloc.take_snapshot)
+                finally:
+                    if own_tracing:
+                        tracemalloc.stop()
+            return await asyncio.to_thread(self._report, started_at, elapsed, snap0, snap1)
 
-        # Uzun sürebilecek işler (rol, sheets, DM) artık güvenle yapılabilir
-        await apply_success(guild, member, self.player_id, source="panel")
+    def _report(self, started_at: datetime, elapsed: float, snap0, snap1) -> tuple[str, str]:
+        def top(d: dict, n: int = PROFILE_TOP):
+            return sorted(d.items(), key=lambda kv: kv[1], reverse=True)[:n]
 
-        # 3) Bitti mesajı
-        await interaction.edit_original_response(content="✅ Verified!", embed=None, view=None)
+        def frame(f: tuple) -> str:
+            return f"{f[0]}:{f[2]} {f[1]}"
 
-    @discord.ui.button(label=CANCEL_LABEL, style=discord.ButtonStyle.secondary, row=0)
-    async def cancel(self, interaction: discord.Interaction, button: discord.ui.Button):
-        # Yine önce ACK gönder
-        await interaction.response.defer(ephemeral=True)
-        await interaction.edit_original_response(content="❎ Cancelled.", embed=None, view=None)
+        ms = self.interval * 1000
+        lags = sorted(self.lags)
+        pct = lambda q: lags[min(len(lags) - 1, int(q * len(lags)))] * 1000 if lags else 0.0
+        busy = sum(self.loop_stacks.values())
+        out = [
+            f"PROFILE {started_at:%Y-%m-%d %H:%M:%S} UTC · {elapsed:.1f}s · sample every {ms:g} ms · "
+            f"stall threshold {self.threshold * 1000:.0f} ms",
+            "",
+            "== Event loop lag (10 ms heartbeat) ==",
+            f"beats {len(lags)} · p50 {pct(0.5):.1f} ms · p99 {pct(0.99):.1f} ms · max {pct(1.0):.1f} ms · "
+            f"stalls {len(self.stalls)} ({sum(s[1] for s in self.stalls) * 1000:.0f} ms blocked)",
+        ]
+        for at, lag, stack in sorted(self.stalls, key=lambda s: s[1], reverse=True)[:PROFILE_TOP]:
+            out.append(f"  +{at:7.2f}s  {lag * 1000:7.1f} ms")
+            for f in reversed((stack or ())[-8:]):
+                out.append(f"      {frame(f)}")
+            if not stack:
+                out.append("      (stack not captured; stall shorter than a sample)")
+
+        out += ["", "== CPU: event loop thread ==",
+                f"samples {self.samples} · busy {busy} ({busy / max(1, self.samples):.1%}) · idle {self.loop_idle}"]
+        leaf: dict[str, int] = {}
+        total: dict[str, int] = {}
+        for stack, n in self.loop_stacks.items():
+            leaf[frame(stack[-1])] = leaf.get(frame(stack[-1]), 0) + n
+            for fn in {f"{f[0]} {f[1]}" for f in stack}:
+                total[fn] = total.get(fn, 0) + n
+        out.append("self (leaf line):")
+        out += [f"  {n:6d} {n * ms:9.0f} ms  {name}" for name, n in top(leaf)]
+        out.append("total (inclusive function):")
+        out += [f"  {n:6d} {n * ms:9.0f} ms  {name}" for name, n in top(total)]
+
+        out += ["", "== CPU: other threads (to_thread: Sheets, JSONL, ...) =="]
+        out += [f"  {n:6d} {n * ms:9.0f} ms  [{name}] {frame(f)}" for (name, f), n in top(self.thread_leaves)] or ["  (idle)"]
+
+        out += ["", f"== Where tasks wait (task × {self.TASK_EVERY * 1000:.0f} ms samples) =="]
+        out += [f"  {n:6d}  {where}" for where, n in top(self.awaits)]
+
+        ignore = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"))
+        snap0, snap1 = snap0.filter_traces(ignore), snap1.filter_traces(ignore)
+        growth = [s for s in snap1.compare_to(snap0, "lineno") if s.size_diff > 0][:PROFILE_TOP]
+        out += ["", "== Memory: growth during the window (tracemalloc, by line) =="]
+        out += [f"  {s.size_diff / 1024:9.1f} KB  {s.count_diff:+7d} blocks  {s.traceback[0]}" for s in growth] or ["  (none)"]
+
+        out += ["", "== Collapsed stacks: event loop thread (flamegraph.pl / speedscope) =="]
+        out += [";".join(f"{f[0]}:{f[1]}" for f in stack) + f" {n}" for stack, n in top(self.loop_stacks, 500)]
+
+        summary = (
+            f"loop busy `{busy / max(1, self.samples):.0%}` · lag p99 `{pct(0.99):.0f} ms` max `{pct(1.0):.0f} ms` · "
+            f"stalls > {self.threshold * 1000:.0f} ms: `{len(self.stalls)}`"
+        )
+        return "\n".join(out) + "\n", summary
+
+profiler = Profiler(PROFILE_SAMPLE_INTERVAL)
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Events
 @client.event
 async def on_ready():
-    client.add_view(VerifyPanelView())  # persistent view
-    await tree.sync()
-    print(f"✅ Login successful: {client.user} (ID_LENGTH={ID_LENGTH}, AUTO_REGISTER={AUTO_REGISTER})")
+    first = not any(n == "ready" for n, _ in STARTUP_MARKS)
+    mark_startup("ready")
+    configured = [g for g in client.guilds if guild_cfg(g)]
+    print(
+        f"✅ Login successful: {client.user} (ID_LENGTH={ID_LENGTH}, "
+        f"guilds={len(configured)}/{len(client.guilds)}, shards={client.shard_count or 1})"
+    )
+    if first:
+        global RSS_AT_READY
+        for g in configured:
+            indexes[g.id]   # sunucu index'ini oluştur (journal'dan yüklenir, source'tan yenilenir)
+        seed_verified_users()
+        RSS_AT_READY = _rss_bytes()
+        print("[Startup]\n" + startup_report())
+        print("[Memory]\n" + memory_report().replace("`", ""))
 
 # 🆕 YENİ EKLENEN KISIM: SUNUCUYA KATILANLARA DM ATMA
 @client.event
 async def on_member_join(member: discord.Member):
-    # Eğer botun olduğu sunucu değilse (ID kontrolü) veya bot girdiyse
-    if member.bot or (GUILD_ID and member.guild.id != GUILD_ID):
+    # Ayarı olmayan sunucu veya bot girdiyse
+    if member.bot or guild_cfg(member.guild) is None:
         return
-    
-    # Register (Welcome) kanalına direkt link
-    channel_link = f"https://discord.com/channels/{member.guild.id}/{REGISTER_CHANNEL_ID}"
-    
-    # Hoş geldin Embed Mesajı
-    emb = discord.Embed(
-        title=f"Welcome to {SERVER_NAME}!",
-        description=(
-            f"Hello {member.mention}, glad to see you here!\n\n"
-            "To gain access to the server channels and chat with others, please **verify your Player ID**.\n\n"
-            f"👉 **Go to Verification Channel:** <#{REGISTER_CHANNEL_ID}>\n"
-            f"[Click here to jump to channel]({channel_link})"
-        ),
-        color=0x57F287  # Yeşil ton
-    )
-    
-    if SHOW_AUTHOR:
-        emb.set_author(name=f"{BRAND} Welcome")
-        
-    try:
-        await member.send(embed=emb)
-        print(f"[Welcome] Sent DM to {member.name}")
-    except discord.Forbidden:
-        # Kullanıcı DM'leri kapattıysa hata vermesin, konsola yazsın
-        print(f"[Welcome] Could not DM {member.name} (DMs closed)")
-    except Exception as e:
-        print(f"[Welcome] Error sending DM to {member.name}: {e}")
+    # DM'i hemen atma; scheduler sıraya koyar, hız sınırına göre gönderir
+    welcome_scheduler.enqueue(member)
+
+@client.event
+async def on_raw_member_remove(payload: discord.RawMemberRemoveEvent):
+    welcome_scheduler.cancel(payload.user.id)
+    mark_unverified(payload.guild_id, payload.user.id)
+    verification_gate.forget(payload.guild_id, payload.user.id)
+
+@client.event
+async def on_member_update(before: discord.Member, after: discord.Member):
+    # Lean modda yalnızca cache'teki üyeler için gelir; diğerleri payload'larla düzelir
+    cfg = guild_cfg(after.guild)
+    if not cfg or not cfg.verified_role_id:
+        return
+    had, has = before.get_role(cfg.verified_role_id), after.get_role(cfg.verified_role_id)
+    if has and not had:
+        verified_set(after.guild.id).add(after.id)
+    elif had and not has:
+        mark_unverified(after.guild.id, after.id)
 
 @client.event
 async def on_message(message: discord.Message):
     # ─── MIRROR LOGIC START ───
     if message.author.bot:
-        if (MIRROR_TARGET_CHANNEL_ID and 
-            COMMUNITY_MANAGER_ROLE_ID and 
-            len(MIRROR_BOT_USER_IDS) > 0 and 
-            message.guild):
-            
-            if message.author.id in MIRROR_BOT_USER_IDS:
-                if message.id in _mirrored_ids: return
-
-                role_mention = f"<@&{COMMUNITY_MANAGER_ROLE_ID}>"
-                content = message.content or ""
-                has_role = role_mention in content or any(r.id == COMMUNITY_MANAGER_ROLE_ID for r in message.role_mentions)
-                
-                if has_role:
-                    target = message.guild.get_channel(MIRROR_TARGET_CHANNEL_ID)
-                    if target:
-                        avatar = message.author.display_avatar.url if message.author.display_avatar else None
-                        chan_name = getattr(message.channel, "name", str(message.channel.id))
-                        
-                        e = discord.Embed(color=0xFFD166, description=(content[:4000] or "*(no text)*"))
-                        e.set_author(name=f"{message.author.name} • #{chan_name}", icon_url=avatar)
-                        e.add_field(name="Source", value=f"[Go to message]({message.jump_url})", inline=False)
-                        
-                        if message.attachments:
-                            att = message.attachments[0]
-                            if att.content_type and att.content_type.startswith("image/"):
-                                e.set_image(url=att.url)
-                            if len(message.attachments) > 1:
-                                e.set_footer(text=f"+{len(message.attachments)-1} more attachments")
-                        
-                        try:
-                            await target.send(embed=e)
-                            _mirrored_ids.add(message.id)
-                        except Exception as err:
-                            print(f"[Mirror] Error: {err}")
+        if mirror_enabled(message.guild) and is_mirror_candidate(message) and not already_mirrored(message.id):
+            target = message.guild.get_channel(guild_cfg(message.guild).mirror_target_channel_id)
+            if target:
+                mirror_queue.enqueue(target, message.id, mirror_embed(message), mirror_attachments(message))
         return
     # ─── MIRROR LOGIC END ───
 
     # DMs -> yönlendir
     if not message.guild and not message.author.bot:
         try:
-            await message.channel.send(DM_BLOCK)
+            await message.channel.send(dm_block(message.author))
         except:
             pass
         return
 
-    if not AUTO_REGISTER:
+    cfg = guild_cfg(message.guild)
+    if not cfg or not cfg.auto_register:
         return
-    if message.channel.id != REGISTER_CHANNEL_ID:
+    if message.channel.id != cfg.register_channel_id:
         return
 
-    try:
-        await message.delete()
-    except:
-        pass
+    if lifecycle.closing:
+        return await send_temp(message.channel, f"{message.author.mention} {MSG_RESTARTING}")
+    lifecycle.track("verify")
+
+    # Silme ayrı bir aşama; doğrulamayı beklemeden paralel yürür
+    spawn(_stage_delete(message))
 
+    # Aynı üyenin mesajları sırayla, farklı üyeler paralel işlenir
+    async with member_locks(message.author.id):
+        await _auto_register(message)
+
+async def _auto_register(message: discord.Message):
     guild = message.guild
     member = message.author
-    vrole = guild.get_role(VERIFIED_ROLE_ID)
 
-    if vrole and vrole in member.roles:
+    if verification_gate.pending(guild.id, member.id):
+        # Aynı anda Confirm'e de basıldı ya da mesaj tekrarlandı: iş zaten yapılıyor/yapıldı
+        return
+    if is_verified(member):
         await send_temp(message.channel, MSG_ALREADY_VERIFIED.format(
-            mention=member.mention, cm=cm_contact()
+            mention=member.mention, cm=cm_contact(guild)
         ))
-        log_ch = guild.get_channel(LOG_CHANNEL_ID)
-        if log_ch:
-            await log_ch.send(
-                f"⛔ Update attempt blocked for {member.mention}. Typed `{message.content.strip()}`",
-                allowed_mentions=allowed_mentions_users_only
-            )
+        log_event(f"⛔ Update attempt blocked for {member.mention}. Typed `{message.content.strip()}`", guild=guild)
         return
 
     content = message.content.strip()
@@ -489,7 +3859,12 @@ async def on_message(message: discord.Message):
             MSG_INVALID.format(mention=member.mention, need=ID_LENGTH)
         )
 
-    await apply_success(guild, member, content, source="auto")
+    outcome = await verification_gate.run(guild, member, content, source="auto")
+    if outcome.status == "conflict":
+        await send_temp(message.channel, MSG_ID_TAKEN.format(mention=member.mention, cm=cm_contact(guild)))
+        return await report_conflict(guild, member, content, outcome.owner)
+    if outcome.role == "failed":
+        await send_temp(message.channel, MSG_ROLE_FAILED.format(mention=member.mention, cm=cm_contact(guild)))
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Slash Commands (mod-only)
@@ -519,16 +3894,21 @@ async def setup_panel_cmd(interaction: discord.Interaction, channel: discord.Tex
         )
 
     # NEW: 1) Üstte büyük karşılama görselini gönder
-    banner_path = os.getenv("BANNER_IMAGE_PATH", BANNER_IMAGE_PATH)
-    banner_url  = os.getenv("BANNER_IMAGE_URL", BANNER_IMAGE_URL)
+    banner_asset.check()
     try:
-        if banner_path and os.path.isfile(banner_path):
-            fname = os.path.basename(banner_path)
-            file = discord.File(banner_path, filename=fname)
-            await target.send(file=file)  # yalnızca görsel
-        elif banner_url:
+        cdn = banner_asset.cdn()
+        if cdn:
+            banner_asset.cdn_hits += 1
+            e = discord.Embed(color=COLOR_WARN)
+            e.set_image(url=cdn)
+            await target.send(embed=e)   # önceki upload'ın CDN URL'i
+        elif banner_asset.data is not None:
+            banner_asset.uploads += 1
+            banner_asset.remember(await target.send(file=banner_asset.file()))  # yalnızca görsel
+        elif banner_asset.fallback_url:
+            banner_asset.url_fallbacks += 1
             e = discord.Embed(color=COLOR_WARN)
-            e.set_image(url=banner_url)
+            e.set_image(url=banner_asset.fallback_url)
             await target.send(embed=e)   # URL ile görsel
     except Exception as e:
         # banner gönderilemese de panel gönderilmeye devam etsin
@@ -555,86 +3935,568 @@ async def verify_cmd(interaction: discord.Interaction, user: discord.Member, pla
             MSG_INVALID.format(mention=user.mention, need=ID_LENGTH),
             ephemeral=True, allowed_mentions=allowed_mentions_users_only
         )
-    vrole = interaction.guild.get_role(VERIFIED_ROLE_ID)
-    if vrole and vrole in user.roles:
+    if not verification_gate.pending(interaction.guild.id, user.id) and is_verified(user):
         return await interaction.response.send_message(
             f"{user.mention} is already verified.",
             ephemeral=True, allowed_mentions=allowed_mentions_users_only
         )
-    await apply_success(interaction.guild, user, raw, source="manual")
+    # Rol kuyrukta ROLE_GRANT_WAIT'e kadar bekleyebilir: 3 sn sınırına takılmamak için önce ACK
+    lifecycle.track("verify")
+    await interaction.response.defer(ephemeral=True)
+    outcome = await verification_gate.run(interaction.guild, user, raw, source="manual")
+    if outcome.status == "conflict":
+        return await interaction.followup.send(
+            f"Player ID `{raw}` is already registered to <@{outcome.owner}>.",
+            ephemeral=True, allowed_mentions=allowed_mentions_users_only
+        )
+    if outcome.player_id != raw:
+        return await interaction.followup.send(
+            f"{user.mention} was just verified with ID `{outcome.player_id}`.",
+            ephemeral=True, allowed_mentions=allowed_mentions_users_only
+        )
+    if outcome.role == "failed":
+        text = f"⚠️ Saved ID `{raw}` for {user.mention}, but the role could not be granted (see the log channel)."
+    elif outcome.role == "queued":
+        text = f"⏳ Saved ID `{raw}` for {user.mention}; the role grant is queued and they’ll get a DM when it’s done."
+    else:
+        text = f"✅ Verified {user.mention} with ID `{raw}`."
+    await interaction.followup.send(text, ephemeral=True, allowed_mentions=allowed_mentions_users_only)
+
+def parse_bulk_csv(text: str) -> tuple[list[tuple[int, int, str]], list[tuple[int, str, str]]]:
+    """Tek geçişte user_id,player_id satırlarını doğrula.
+    → (geçerli [(satır, user_id, player_id)], hatalı [(satır, ham, sebep)])"""
+    valid, bad = [], []
+    seen_users: dict[int, str] = {}
+    seen_players: dict[str, int] = {}
+    for lineno, rec in enumerate(csv.reader(io.StringIO(text)), start=1):
+        if not rec or all(not c.strip() for c in rec):
+            continue
+        raw = ",".join(rec)
+        if len(rec) < 2:
+            bad.append((lineno, raw, "expected user_id,player_id"))
+            continue
+        uid, pid = rec[0].strip().strip("<@!>"), rec[1].strip()
+        if not uid.isdigit():
+            if lineno == 1:
+                continue  # header
+            bad.append((lineno, raw, "user_id is not numeric"))
+            continue
+        if not EXACT_ASCII_DIGITS_RAW.fullmatch(pid):
+            bad.append((lineno, raw, f"player_id must be exactly {ID_LENGTH} digits"))
+            continue
+        uid = int(uid)
+        if seen_users.get(uid, pid) != pid:
+            bad.append((lineno, raw, "user listed twice with different Player IDs"))
+            continue
+        if seen_players.get(pid, uid) != uid:
+            bad.append((lineno, raw, "Player ID listed twice for different users"))
+            continue
+        if uid in seen_users:
+            continue  # birebir tekrar
+        seen_users[uid] = pid
+        seen_players[pid] = uid
+        valid.append((lineno, uid, pid))
+    return valid, bad
+
+@tree.command(name="verify_bulk", description="Import user_id,player_id rows from a CSV attachment (mods only).")
+@app_commands.describe(file="CSV with user_id,player_id per line (header optional)")
+async def verify_bulk_cmd(interaction: discord.Interaction, file: discord.Attachment):
+    """Toplu import: roller role_grants kuyruğundan (ortak hız, kalıcı), kayıtlar 500'lük journal
+    transaction'larıyla, Sheets'e olabildiğince az append_rows çağrısıyla. DM atılmaz."""
+    if not is_mod(interaction.user):
+        return await interaction.response.send_message("You don’t have permission.", ephemeral=True)
+    if file.size > BULK_MAX_BYTES:
+        return await interaction.response.send_message(
+            f"File too large ({file.size // 1024} KB, max {BULK_MAX_BYTES // 1024} KB).", ephemeral=True
+        )
+    lifecycle.track("bulk import")
+    await interaction.response.defer(ephemeral=True, thinking=True)
+
+    try:
+        text = (await file.read()).decode("utf-8-sig")
+    except Exception as e:
+        return await interaction.edit_original_response(content=f"Could not read the file: `{e}`")
+
+    guild = interaction.guild
+    cfg = guild_cfg(guild)
+    vrole = guild.get_role(cfg.verified_role_id) if cfg else None
+    rows, bad = parse_bulk_csv(text)
+    failures: list[tuple[int, str, str]] = []   # geçerli satırların hataları; bozuk satırlar `bad`da
+    skipped: dict[str, int] = {}
+    done = 0
+    ok_rows: list[list] = []
+    role_futs: list[tuple[int, asyncio.Future]] = []
+    total = len(rows)
+
+    def skip(why: str):
+        skipped[why] = skipped.get(why, 0) + 1
+
+    async def progress(final: bool = False):
+        head = "✅ Bulk import finished." if final else "⏳ Bulk import running…"
+        content = (
+            f"{head}\n"
+            f"Rows: `{done}` / `{total}` processed · invalid lines: `{len(bad)}`\n"
+            f"Registered: `{len(ok_rows)}` · skipped: `{sum(skipped.values())}` · "
+            f"failed: `{len(failures)}`"
+        )
+        queued = sum(1 for _uid, f in role_futs if not f.done())
+        if queued:
+            content += f"\nRoles queued: `{queued}` (granted in the background)"
+        if skipped:
+            content += "\nSkipped: " + ", ".join(f"{k} `{v}`" for k, v in skipped.items())
+        try:
+            if final and (failures or bad):
+                out = io.StringIO()
+                w = csv.writer(out)
+                w.writerow(["line", "input", "reason"])
+                w.writerows(sorted(bad + failures))
+                report = discord.File(io.BytesIO(out.getvalue().encode()), filename="verify_bulk_failures.csv")
+                await interaction.edit_original_response(content=content, attachments=[report])
+            else:
+                await interaction.edit_original_response(content=content)
+        except Exception as e:
+            print(f"[Bulk] Progress update failed: {e}")
+
+    # Kayıt ve çakışma kontrolü bellekteki index'ten; API çağrısı yok
+    index = indexes[guild.id]
+    work = []
+    for lineno, uid, pid in rows:
+        owner = index.conflict(uid, pid)
+        if owner is not None:
+            failures.append((lineno, f"{uid},{pid}", f"Player ID already registered to {owner}"))
+            done += 1
+        elif index.player_of(uid) == pid:
+            skip("already registered")
+            done += 1
+        else:
+            work.append((lineno, uid, pid))
+    await progress()
+
+    it = iter(work)
+    last_edit = time.monotonic()
+    pending_rows: list[list] = []
+    line_of: dict[int, tuple[int, str]] = {}   # user_id → (satır, girdi): rol hatalarını rapora bağlamak için
+
+    def commit_rows():
+        # journal'a parça parça (tek transaction) yaz: import yarıda kesilse de kayıtlar kalır
+        journal.append_many(guild.id, pending_rows)
+        ok_rows.extend(pending_rows)
+        pending_rows.clear()
+
+    async def bulk_apply(guild: discord.Guild, member: discord.Member, pid: str, source: str) -> str:
+        # verification_gate içinde: aynı kullanıcı için eşzamanlı panel/auto doğrulaması bekler ya da
+        # bu sonucu paylaşır. Index hemen güncellenir (çakışma kontrolleri görsün), journal toplu yazılır.
+        row = build_row(guild, member, pid, source)
+        index.add(member.id, pid, row[2])
+        pending_rows.append(row)
+        if len(pending_rows) >= 500:
+            commit_rows()
+        if vrole and vrole not in member.roles:
+            # Rol ortak kuyruktan (kalıcı, 429'a uyarlanan hız); player_id verilmez → DM yok
+            role_futs.append((member.id, role_grants.submit(
+                guild.id, member.id, True, "Bulk Player ID import", member=member
+            )))
+            return "queued"
+        return "granted"
+
+    async def worker():
+        nonlocal done, last_edit
+        for lineno, uid, pid in it:
+            if lifecycle.closing:
+                skip("stopped for restart")   # kalanlar aşağıda sayılır; yazılanlar commit edilir
+                done += 1
+                break
+            member = guild.get_member(uid)
+            if member is None:
+                try:
+                    member = await guild.fetch_member(uid)
+                except discord.NotFound:
+                    member = None
+                except Exception as e:
+                    failures.append((lineno, f"{uid},{pid}", f"fetch failed: {e}"))
+                    done += 1
+                    continue
+            if member is None:
+                skip("not in server")
+            else:
+                outcome = await verification_gate.run(guild, member, pid, "bulk", apply=bulk_apply)
+                if outcome.status == "conflict":
+                    failures.append((lineno, f"{uid},{pid}", f"Player ID already registered to {outcome.owner}"))
+                elif outcome.shared and outcome.player_id != pid:
+                    failures.append((lineno, f"{uid},{pid}", f"verified concurrently as {outcome.player_id}"))
+                elif outcome.shared:
+                    skip("verified concurrently")
+                else:
+                    line_of[member.id] = (lineno, f"{uid},{pid}")
+            done += 1
+            if time.monotonic() - last_edit >= 3:
+                last_edit = time.monotonic()
+                await progress()
+
+    with storage.hold():
+        await asyncio.gather(*(worker() for _ in range(max(1, BULK_ROLE_CONCURRENCY))))
+        if pending_rows:
+            commit_rows()
+        for _ in it:
+            skip("stopped for restart")
+            done += 1
+
+    if ok_rows:
+        try:
+            await storage.flush(limit=SHEETS_MAX_BATCH)
+        except Exception as e:
+            log_event(f"⚠️ Storage write failed after bulk import: `{e}` — rows kept in the journal.", urgent=True, guild=guild)
+    # Bu ana kadar biten rol hataları rapora; sonrakiler role_grants'ın urgent log'una düşer
+    failures.extend(
+        (*line_of[uid], "role failed (see log)") for uid, f in role_futs if f.done() and not f.result()
+    )
+    log_event(
+        f"📥 Bulk import by {interaction.user.mention}: {len(ok_rows)} registered, "
+        f"{sum(skipped.values())} skipped, {len(failures)} failed.",
+        guild=guild,
+    )
+    await progress(final=True)
+
+@tree.command(name="mirror_backfill", description="Mirror shop posts missed during downtime (mods only).")
+@app_commands.describe(
+    channel="Source channel to scan",
+    hours="How far back to scan (hours)",
+    until_hours="Stop this many hours ago (default: now)",
+)
+async def mirror_backfill_cmd(
+    interaction: discord.Interaction,
+    channel: discord.TextChannel,
+    hours: app_commands.Range[float, 0.1, 2160.0] = 24.0,
+    until_hours: app_commands.Range[float, 0.0, 2160.0] = 0.0,
+):
+    if not is_mod(interaction.user):
+        return await interaction.response.send_message("No permission.", ephemeral=True)
+    if not mirror_enabled(interaction.guild):
+        return await interaction.response.send_message("Mirroring is not configured.", ephemeral=True)
+    target = interaction.guild.get_channel(guild_cfg(interaction.guild).mirror_target_channel_id)
+    if not target:
+        return await interaction.response.send_message("Mirror target channel not found.", ephemeral=True)
+    if until_hours >= hours:
+        return await interaction.response.send_message("`until_hours` must be less than `hours`.", ephemeral=True)
+    if mirror_backfill.running:
+        return await interaction.response.send_message("A backfill is already running.", ephemeral=True)
+    lifecycle.track("mirror backfill")
+
+    now = datetime.now(timezone.utc)
+    after = now - timedelta(hours=hours)
+    before = now - timedelta(hours=until_hours) if until_hours else None
     await interaction.response.send_message(
-        f"✅ Verified {user.mention} with ID `{raw}`.",
-        ephemeral=True, allowed_mentions=allowed_mentions_users_only
+        f"⏪ Backfilling {channel.mention} → {target.mention} (last {hours:g}h)…", ephemeral=True
     )
 
+    async def progress(bf: MirrorBackfill):
+        try:
+            await interaction.edit_original_response(content=f"⏪ Backfilling {channel.mention}… {bf.describe()}")
+        except Exception:
+            pass
+
+    async def finish(content: str):
+        # Uzun taramalarda 15 dk'lık interaction token'ı dolmuş olabilir: kanala düş
+        try:
+            await interaction.edit_original_response(content=content)
+        except Exception as e:
+            print(f"[Backfill] Final update failed: {e}")
+            try:
+                await interaction.channel.send(
+                    f"{interaction.user.mention} {content}",
+                    allowed_mentions=discord.AllowedMentions(users=[interaction.user]),
+                )
+            except Exception:
+                pass
+
+    t0 = time.monotonic()
+    try:
+        await mirror_backfill.run(channel, target, after, before, progress=progress)
+    except Exception as e:
+        log_event(f"⚠️ Mirror backfill of {channel.mention} failed: `{e}` ({mirror_backfill.describe()})",
+                  guild=interaction.guild)
+        return await finish(f"Backfill failed: `{e}` ({mirror_backfill.describe()})")
+    summary = f"{mirror_backfill.describe()} in {time.monotonic() - t0:.0f}s"
+    log_event(f"⏪ Mirror backfill of {channel.mention} by {interaction.user.mention}: {summary}", guild=interaction.guild)
+    await finish(f"✅ Backfill of {channel.mention} done: {summary}")
+
 @tree.command(name="unverify", description="Remove the Verified role (mods only).")
 async def unverify_cmd(interaction: discord.Interaction, user: discord.Member):
     if not is_mod(interaction.user):
         return await interaction.response.send_message("You don’t have permission.", ephemeral=True)
-    vrole = interaction.guild.get_role(VERIFIED_ROLE_ID)
-    if not vrole or vrole not in user.roles:
+    cfg = guild_cfg(interaction.guild)
+    vrole = interaction.guild.get_role(cfg.verified_role_id) if cfg else None
+    if not vrole or (vrole not in user.roles and not role_grants.pending(interaction.guild.id, user.id)):
         return await interaction.response.send_message(f"{user.mention} is not verified.", ephemeral=True)
+    lifecycle.track("unverify")
+    await interaction.response.defer(ephemeral=True)
+    verification_gate.forget(interaction.guild.id, user.id)
+    ok = await role_grants.revoke(user, "Manual unverify", ROLE_GRANT_WAIT)
+    if ok is False:
+        return await interaction.followup.send(f"Failed to remove Verified from {user.mention} (see the log channel).", ephemeral=True)
+    if ok is None:
+        log_event(f"🗑️ Unverify of {user.mention} queued.", guild=interaction.guild)
+        return await interaction.followup.send(f"⏳ Queued: Verified will be removed from {user.mention} shortly.", ephemeral=True)
+    log_event(f"🗑️ Unverified {user.mention}.", guild=interaction.guild)
+    await interaction.followup.send(f"Done. Removed Verified from {user.mention}.", ephemeral=True)
+
+def _lookup_label(ri: RegistrationIndex, player_id: str, user_id: int) -> str:
+    name = ri.names.get(user_id) or "?"
+    return f"{player_id} — {name} ({user_id})"[:100]
+
+async def lookup_autocomplete(interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
+    if not is_mod(interaction.user) or not current.strip():
+        return []
+    ri = indexes[interaction.guild.id]
+    return [
+        app_commands.Choice(name=_lookup_label(ri, pid, uid), value=pid)
+        for pid, uid in ri.search(current)
+    ]
+
+@tree.command(name="lookup", description="Find who owns a Player ID, or a user's Player ID (mods only).")
+@app_commands.describe(query="Player ID, user ID or display name")
+@app_commands.autocomplete(query=lookup_autocomplete)
+async def lookup_cmd(interaction: discord.Interaction, query: str):
+    if not is_mod(interaction.user):
+        return await interaction.response.send_message("No permission.", ephemeral=True)
+    ri = indexes[interaction.guild.id]
+    q = query.strip()
+    if q in ri.by_player:
+        matches = [(q, ri.by_player[q])]
+    elif q.isdigit() and int(q) in ri.by_user:
+        matches = [(ri.by_user[int(q)], int(q))]
+    else:
+        matches = ri.search(q, limit=10)
+    if not matches:
+        return await interaction.response.send_message(f"No registration matches `{q[:50]}`.", ephemeral=True)
+    lines = []
+    for pid, uid in matches:
+        name = ri.names.get(uid) or "?"
+        line = f"`{pid}` → <@{uid}> (`{uid}`, {discord.utils.escape_markdown(name)})"
+        if ri.by_user.get(uid) != pid:
+            line += f" · now registered as `{ri.by_user.get(uid)}`"
+        if len(matches) == 1:
+            # Tek sonuçta kayıt geçmişi: journal'da player_id/user_id index'li sorgu
+            for row in await journal.lookup(player_id=pid, user_id=uid, guild_id=interaction.guild.id):
+                line += f"\n• `{row[3]}` by <@{row[1]}> — {row[4][:19].replace('T', ' ')} UTC ({row[5]})"
+        lines.append(line)
+    head = "**LOOKUP**" if len(matches) == 1 else f"**LOOKUP** — {len(matches)} matches"
+    await interaction.response.send_message(
+        head + "\n" + "\n".join(lines), ephemeral=True, allowed_mentions=discord.AllowedMentions.none()
+    )
+
+@tree.command(name="reconcile", description="Compare the Verified role with the sheet and fix drift (mods only).")
+@app_commands.describe(
+    fix_sheet="Re-append journal rows that are missing from the sheet (default: yes)",
+    fix_roles="Grant Verified to registered members who lack it (default: no)",
+)
+async def reconcile_cmd(interaction: discord.Interaction, fix_sheet: bool = True, fix_roles: bool = False):
+    if not is_mod(interaction.user):
+        return await interaction.response.send_message("No permission.", ephemeral=True)
+    if reconciler.running:
+        return await interaction.response.send_message("A reconcile is already running.", ephemeral=True)
+    await interaction.response.send_message("🔁 Reconciling… reading the sheet.", ephemeral=True)
+
+    async def progress(res: dict):
+        try:
+            await interaction.edit_original_response(content=f"🔁 Reconciling… {res['members']} members scanned.")
+        except Exception:
+            pass
+
     try:
-        await user.remove_roles(vrole, reason="Manual unverify")
+        res = await reconciler.run(interaction.guild, fix_sheet=fix_sheet, fix_roles=fix_roles, progress=progress)
     except Exception as e:
-        return await interaction.response.send_message(f"Failed: `{e}`", ephemeral=True)
-    log_ch = interaction.guild.get_channel(LOG_CHANNEL_ID)
-    if log_ch:
-        await log_ch.send(f"🗑️ Unverified {user.mention}.", allowed_mentions=allowed_mentions_users_only)
-    await interaction.response.send_message(f"Done. Removed Verified from {user.mention}.", ephemeral=True)
+        return await interaction.edit_original_response(content=f"Reconcile failed: `{e}`")
+    text = "**RECONCILE**\n" + Reconciler.summary(res)
+    for kind, label in (("role_only", "Verified but not registered"), ("sheet_only", "Registered but not verified")):
+        ids = res["examples"][kind]
+        if ids:
+            more = f" (+{res[kind] - len(ids)} more)" if res[kind] > len(ids) else ""
+            text += f"\n{label}: " + ", ".join(f"<@{i}>" for i in ids) + more
+    await interaction.edit_original_response(content=text[:2000], allowed_mentions=discord.AllowedMentions.none())
+    log_event(f"🔁 Reconcile by {interaction.user.mention}: " + Reconciler.summary(res), guild=interaction.guild)
 
-@tree.command(name="sheets_diag", description="Show Google Sheets connection status (mods only).")
+@tree.command(name="sheets_diag", description="Show storage backend and Google Sheets status (mods only).")
 async def sheets_diag(interaction: discord.Interaction):
     if not is_mod(interaction.user):
         return await interaction.response.send_message("No permission.", ephemeral=True)
 
-    status = "✅ CONNECTED" if SHEETS_OK else "❌ DISABLED"
-    desc = (
-        f"Status: **{status}**\n"
-        f"Sheet ID: `{SHEET_ID or '-'}`\n"
-        f"Worksheet: `{WORKSHEET}`\n"
-        f"Service acct: `{SERVICE_EMAIL or '-'}`\n"
+    desc = "**STORAGE**\n" + storage.describe()
+    if "sheets" in STORAGE_REPLICAS:
+        if SHEETS_OK and sheets_api.state != "closed":
+            status = "⚠️ DEGRADED"
+        elif SHEETS_OK:
+            status = "✅ CONNECTED"
+        elif SHEETS_CONNECTING:
+            status = "⏳ CONNECTING"
+        else:
+            status = "❌ DISABLED"
+        desc += (
+            f"\n**Google Sheets**: **{status}**\n"
+            f"Sheet ID: `{SHEET_ID or '-'}`\n"
+            f"Worksheet: `{SheetsBackend.title_for(interaction.guild.id)}`\n"
+            f"Service acct: `{SERVICE_EMAIL or '-'}`\n"
+        )
+        if not SHEETS_OK and SHEETS_WHY:
+            desc += f"Reason: `{SHEETS_WHY}`\n"
+        if SHEETS_OK:
+            desc += sheets_api.describe()
+    desc += "\n"
+    ri = indexes[interaction.guild.id]
+    desc += (
+        f"Index: `{len(ri.by_player)}` player IDs / `{len(ri.by_user)}` users, "
+        f"`{ri.sheet_rows}` sheet rows read (loaded: `{ri.loaded}`)\n"
     )
-    if not SHEETS_OK and SHEETS_WHY:
-        desc += f"\nReason: `{SHEETS_WHY}`"
+    if ri.last_error:
+        desc += f"Index error: `{ri.last_error}`\n"
+    if reconciler.last_run_at:
+        desc += f"Last reconcile: <t:{int(reconciler.last_run_at.timestamp())}:R> — {Reconciler.summary(reconciler.last_result)}\n"
+    if reconciler.last_error:
+        desc += f"Reconcile error: `{reconciler.last_error}`\n"
     desc += "\n\nRun `/sheets_test` to try appending a test row."
-    await interaction.response.send_message(desc, ephemeral=True)
+    await interaction.response.send_message(desc[:2000], ephemeral=True)
 
-@tree.command(name="sheets_test", description="Append a test row to Google Sheet (mods only).")
+@tree.command(name="sheets_test", description="Append a test row to every storage backend (mods only).")
 async def sheets_test(interaction: discord.Interaction):
     if not is_mod(interaction.user):
         return await interaction.response.send_message("No permission.", ephemeral=True)
     try:
-        sheet_append_row(interaction.guild, interaction.user, "9"*ID_LENGTH, "test")
-        await interaction.response.send_message("Wrote a test row ✓", ephemeral=True)
+        seq = sheet_append_row(interaction.guild, interaction.user, "9"*ID_LENGTH, TEST_SOURCE)
+        await journal.durable()
     except Exception as e:
-        await interaction.response.send_message(f"Failed: `{e}`", ephemeral=True)
+        return await interaction.response.send_message(f"Failed: `{e}`", ephemeral=True)
+    await interaction.response.defer(ephemeral=True)
+    # Test satırını hemen her hazır replikaya gönder; sonucu depo başına raporla
+    lines = [f"Journaled test row `#{seq}` ✓ (sqlite)"]
+    for r in storage.replicas:
+        if not r.backend.ready:
+            lines.append(f"⏳ {r.backend.name}: not connected, row queued (depth `{r.depth}`)")
+            continue
+        t0 = time.perf_counter()
+        try:
+            await r.flush()
+            lines.append(f"✅ {r.backend.name}: written in `{(time.perf_counter() - t0) * 1000:.0f} ms`")
+        except Exception as e:
+            lines.append(f"❌ {r.backend.name}: `{e}` (row kept, depth `{r.depth}`)")
+    await interaction.followup.send("\n".join(lines), ephemeral=True)
+
+@tree.command(name="guild_config", description="Show, change or reload this server's bot settings (mods only).")
+@app_commands.describe(
+    action="show: current settings · set: change one setting · reload: re-read the config file",
+    key="Setting name (for set)",
+    value="New value (for set); IDs as numbers, lists comma-separated, booleans true/false",
+)
+async def guild_config_cmd(
+    interaction: discord.Interaction,
+    action: Literal["show", "set", "reload"] = "show",
+    key: str | None = None,
+    value: str | None = None,
+):
+    if not is_mod(interaction.user):
+        return await interaction.response.send_message("No permission.", ephemeral=True)
+    gid = interaction.guild.id
+    if action == "reload":
+        try:
+            n = guild_configs.load()
+        except Exception as e:
+            return await interaction.response.send_message(f"Reload failed, old config kept: `{e}`", ephemeral=True)
+        return await interaction.response.send_message(f"🔄 Reloaded `{GUILD_CONFIG_PATH}`: {n} servers.", ephemeral=True)
+    if action == "set":
+        if not key or value is None:
+            return await interaction.response.send_message("`set` needs both `key` and `value`.", ephemeral=True)
+        try:
+            cfg = guild_configs.set(gid, key, value)
+        except (KeyError, ValueError) as e:
+            known = ", ".join(f"`{k}`" for k in GuildConfig.FIELDS)
+            return await interaction.response.send_message(f"Invalid setting: `{e}`\nKnown keys: {known}", ephemeral=True)
+        except OSError as e:
+            return await interaction.response.send_message(f"Could not save the config file: `{e}`", ephemeral=True)
+        log_event(f"⚙️ {interaction.user.mention} set `{key}` = `{getattr(cfg, key)}`", guild=interaction.guild)
+    cfg = guild_cfg(gid)
+    if cfg is None:
+        return await interaction.response.send_message(
+            "This server is not configured. Use `/guild_config set` to add it.", ephemeral=True
+        )
+    source = "config file" if guild_configs.in_file(gid) else "environment (default server)"
+    lines = [f"**GUILD CONFIG** — `{gid}` ({source})"]
+    lines += [f"• `{k}`: `{v}`" for k, v in cfg.to_dict().items()]
+    await interaction.response.send_message("\n".join(lines)[:2000], ephemeral=True)
+
+@tree.command(name="welcome_diag", description="Show welcome DM queue and throughput (mods only).")
+async def welcome_diag(interaction: discord.Interaction):
+    if not is_mod(interaction.user):
+        return await interaction.response.send_message("No permission.", ephemeral=True)
+    await interaction.response.send_message("**WELCOME DMs**\n" + welcome_scheduler.describe(), ephemeral=True)
+
+@tree.command(name="roles_diag", description="Show the role grant queue and retry counters (mods only).")
+async def roles_diag(interaction: discord.Interaction):
+    if not is_mod(interaction.user):
+        return await interaction.response.send_message("No permission.", ephemeral=True)
+    await interaction.response.send_message("**ROLE GRANTS**\n" + role_grants.describe(), ephemeral=True)
+
+@tree.command(name="startup_diag", description="Show the startup timing breakdown (mods only).")
+async def startup_diag(interaction: discord.Interaction):
+    if not is_mod(interaction.user):
+        return await interaction.response.send_message("No permission.", ephemeral=True)
+    await interaction.response.send_message(f"**STARTUP**\n```\n{startup_report()}\n```", ephemeral=True)
+
+@tree.command(name="profile", description="Capture a CPU, memory and event-loop lag report (mods only).")
+@app_commands.describe(
+    seconds="How long to profile",
+    lag_ms="Flag event-loop stalls longer than this (ms)",
+)
+async def profile_cmd(
+    interaction: discord.Interaction,
+    seconds: app_commands.Range[int, 5, 300] = 30,
+    lag_ms: app_commands.Range[int, 10, 5000] = 100,
+):
+    if not is_mod(interaction.user):
+        return await interaction.response.send_message("No permission.", ephemeral=True)
+    if profiler.running:
+        return await interaction.response.send_message("A profile is already running.", ephemeral=True)
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    try:
+        report, summary = await profiler.run(seconds, lag_ms / 1000)
+    except Exception as e:
+        return await interaction.followup.send(f"Profile failed: `{e}`", ephemeral=True)
+    name = f"profile-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}.txt"
+    await interaction.followup.send(
+        f"**PROFILE** ({seconds}s)\n{summary}",
+        file=discord.File(io.BytesIO(report.encode()), filename=name), ephemeral=True
+    )
+
+@tree.command(name="cache_diag", description="Show member cache mode and memory use (mods only).")
+async def cache_diag(interaction: discord.Interaction):
+    if not is_mod(interaction.user):
+        return await interaction.response.send_message("No permission.", ephemeral=True)
+    await interaction.response.send_message("**MEMBER CACHE**\n" + memory_report(), ephemeral=True)
 
 @tree.command(name="assets_diag", description="Show help/banner image settings (mods only).")
 async def assets_diag(interaction: discord.Interaction):
     if not is_mod(interaction.user):
         return await interaction.response.send_message("No permission.", ephemeral=True)
 
-    help_path = os.getenv("ASSET_IMAGE_PATH", ASSET_IMAGE_PATH)
-    help_url  = os.getenv("HELP_IMAGE_URL", HELP_IMAGE_URL)
-    help_exists = os.path.isfile(help_path) if help_path else False
-
-    banner_path = os.getenv("BANNER_IMAGE_PATH", BANNER_IMAGE_PATH)
-    banner_url  = os.getenv("BANNER_IMAGE_URL", BANNER_IMAGE_URL)
-    banner_exists = os.path.isfile(banner_path) if banner_path else False
+    help_asset.check()
+    banner_asset.check()
 
     msg = (
         "**HELP IMAGE**\n"
-        f"• ASSET_IMAGE_PATH: `{help_path or '-'}` (exists: `{help_exists}`)\n"
-        f"• HELP_IMAGE_URL : `{help_url or '-'}`\n"
-        f"• will_use       : `{'file' if help_exists else ('url' if help_url else 'none')}`\n\n"
-        "**BANNER IMAGE**\n"
-        f"• BANNER_IMAGE_PATH: `{banner_path or '-'}` (exists: `{banner_exists}`)\n"
-        f"• BANNER_IMAGE_URL : `{banner_url or '-'}`\n"
-        f"• will_use         : `{'file' if banner_exists else ('url' if banner_url else 'none')}`\n"
+        f"• ASSET_IMAGE_PATH: `{help_asset.path or '-'}` (exists: `{help_asset.data is not None}`)\n"
+        f"• HELP_IMAGE_URL : `{help_asset.fallback_url or '-'}`\n"
+        f"• will_use       : `{help_asset.will_use()}`\n"
+        + help_asset.describe() +
+        "\n**BANNER IMAGE**\n"
+        f"• BANNER_IMAGE_PATH: `{banner_asset.path or '-'}` (exists: `{banner_asset.data is not None}`)\n"
+        f"• BANNER_IMAGE_URL : `{banner_asset.fallback_url or '-'}`\n"
+        f"• will_use         : `{banner_asset.will_use()}`\n"
+        + banner_asset.describe()
     )
     await interaction.response.send_message(msg, ephemeral=True)
 
 # ─────────────────────────────────────────────────────────────────────────────
-# RUN
-client.run(TOKEN)
+# RUN (bench.py gibi araçlar main'i import edebilsin diye guard'lı)
+if __name__ == "__main__":
+    mark_startup("module_loaded")
+    client.run(TOKEN)
+    _mirrored_ids.save()
+    journal.close()